@@ -0,0 +1,286 @@
+"""Benchmarks of condor_stat.py against a synthetic schedd.
+
+Run from the top of the repository, e.g.
+
+    python -m benchmarks.bench --sizes 1000 10000 100000 1000000 --output bench.json
+
+Each stage (fetch_jobs, format_table, write_stats and the whole of main) is timed at each queue size,
+and then run again under tracemalloc for its peak memory. The results are written as JSON so runs of
+different versions can be compared.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from collections.abc import Callable
+from itertools import accumulate
+from typing import Optional
+from unittest import mock
+
+from condor_tools import condor_tools
+from condor_tools.writers import write_stats
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+STAGES = ["fetch_jobs", "format_table", "write_stats", "main"]
+
+# Roughly what a busy pool looks like: most jobs running, a long tail of idle and a few held
+STATUS_WEIGHTS = {2: 0.6, 1: 0.3, 5: 0.1}
+
+
+class SyntheticSchedd:
+    """Stands in for htcondor2.Schedd, with a queue of made up but realistic jobs.
+
+    Owners follow a Zipf-like distribution, so a few users have most of the jobs as on a real pool, and
+    a fraction of the jobs want GPUs. The queue is held as columns of small integers, and queries build
+    the full list of matching ads as dicts before running the callback over them, as htcondor2 does, so
+    the peak memory measured includes the ads.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        n_jobs: int,
+        n_owners: int = 500,
+        gpu_fraction: float = 0.15,
+        status_weights: Optional[dict[int, float]] = None,
+        skew: float = 1.2,
+        n_machines: int = 400,
+        seed: int = 0,
+    ):
+        status_weights = status_weights or STATUS_WEIGHTS
+        rng = random.Random(seed)
+        self.owners = [f"user{i:04d}" for i in range(n_owners)]
+        owner_weights = list(accumulate(1 / (i + 1) ** skew for i in range(n_owners)))
+        self.n_machines = n_machines
+
+        self._owner = array("l", rng.choices(range(n_owners), cum_weights=owner_weights, k=n_jobs))
+        self._status = array("b", rng.choices(list(status_weights), weights=list(status_weights.values()), k=n_jobs))
+        self._gpu = array("b", (rng.random() < gpu_fraction for _ in range(n_jobs)))
+        self._machine = array("l", rng.choices(range(n_machines), k=n_jobs))
+        self.queries = 0
+
+    def __len__(self) -> int:
+        return len(self._owner)
+
+    def _host(self, machine: int, gpu: bool) -> str:
+        return f"slot1_{machine % 32}@{'gpu' if gpu else 'wn'}{machine:03d}.example.com"
+
+    def startd_ads(self) -> list[dict]:
+        """The startd ads of the machines the jobs run on, as the collector would give them"""
+        return [
+            {"Machine": self._host(m, gpu).split("@")[1], "TotalGPUs": 4 if gpu else 0}
+            for m in range(self.n_machines)
+            for gpu in (False, True)
+        ]
+
+    def jobs(self):
+        for owner, status, gpu, machine in zip(self._owner, self._status, self._gpu, self._machine):
+            job = {"Owner": self.owners[owner], "JobStatus": status, "RequestGPUs": gpu}
+            if status == 2:  # noqa: PLR2004
+                job["RemoteHost"] = self._host(machine, gpu)
+            yield job
+
+    def query(self, constraint="True", projection=None, callback=None, limit=-1, opts=None):
+        """Like Schedd.query, returning the ads (or callback results) that aren't None"""
+        self.queries += 1
+        matches = None
+        if constraint not in (None, "True", True):
+            from htcondor2 import classad  # noqa: PLC0415
+
+            expr = classad.ExprTree(str(constraint))
+
+            def matches(job):
+                return expr.eval(classad.ClassAd(job)) is True
+
+        # The schedd applies the constraint and limit, and the bindings unpack every ad it sends into a list
+        ads = [job for job in self.jobs() if matches is None or matches(job)]
+        if limit > 0:
+            del ads[limit:]
+        if callback is None:
+            return ads
+        return [result for result in map(callback, ads) if result is not None]
+
+
+class SyntheticCollector:
+    """Stands in for htcondor2.Collector, knowing about the synthetic schedd's machines"""
+
+    def __init__(self, schedd: SyntheticSchedd):
+        self.schedd = schedd
+
+    def query(self, ad_type=None, constraint=None, projection=None):
+        return self.schedd.startd_ads()
+
+    def locate(self, daemon_type):
+        raise RuntimeError("No negotiator in the synthetic pool")
+
+
+class LookupStub:
+    """Replaces the pinky/groups subprocesses with a fixed latency, counting the calls"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def real_name(self, username: str, timeout: Optional[float] = None) -> str:
+        self._wait()
+        return f"Synthetic {username}"
+
+    def experiments(self, username: str, excluded_groups=None, timeout: Optional[float] = None) -> list[str]:
+        self._wait()
+        return ["cms"]
+
+
+@contextlib.contextmanager
+def _stubbed(schedd: SyntheticSchedd, latency: float):
+    """Point condor_tools at the synthetic pool, with stubbed lookups and a throwaway cache and log"""
+    lookups = LookupStub(latency)
+    with tempfile.TemporaryDirectory() as cache_dir, contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.dict(os.environ, {"XDG_CACHE_HOME": cache_dir}))
+        stack.enter_context(
+            mock.patch.object(condor_tools, "_setup_condor", lambda: (SyntheticCollector(schedd), schedd))
+        )
+        stack.enter_context(mock.patch.object(condor_tools, "_get_real_name", lookups.real_name))
+        stack.enter_context(mock.patch.object(condor_tools, "_get_user_experiments", lookups.experiments))
+        stack.enter_context(
+            mock.patch.dict(os.environ, {"CONDOR_STAT_USAGE_LOG": os.path.join(cache_dir, "usage_log.txt")})
+        )
+        stack.enter_context(mock.patch.object(condor_tools.handler, "stream", io.StringIO()))
+        yield lookups
+
+
+def _stage(name: str, schedd: SyntheticSchedd) -> Callable[[], object]:
+    """Get a function running one stage, with its inputs prepared outside of what's measured"""
+    if name == "fetch_jobs":
+        return lambda: condor_tools.fetch_jobs(None, schedd)
+    if name == "main":
+
+        def run_main():
+            # A fresh cache each time, so the machines and identities are looked up as on a cold cache
+            with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"XDG_CACHE_HOME": cache_dir}):
+                with mock.patch.object(sys, "argv", ["condor_stat.py", "--no-daemon"]):
+                    condor_tools.main()
+
+        return run_main
+
+    counts = condor_tools.fetch_jobs(None, schedd)
+    if name == "format_table":
+        # A fresh IdentityIndex each time, so identities are looked up as on a cold cache
+        return lambda: str(condor_tools.format_table(counts, None, {}, identities=condor_tools.IdentityIndex()))
+    return lambda: write_stats(
+        "json", counts, io.StringIO(), condor_tools.STATUSES_TO_PRINT, identities=condor_tools.IdentityIndex()
+    )
+
+
+def measure(name: str, schedd: SyntheticSchedd, latency: float, repeat: int, memory: bool) -> dict:
+    """Time a stage (the best of several runs) and optionally measure its peak memory"""
+    times = []
+    with _stubbed(schedd, latency) as lookups:
+        run = _stage(name, schedd)
+        calls = lookups.calls
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        subprocess_calls = (lookups.calls - calls) // repeat
+
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+    wall_time = min(times)
+    return {
+        "stage": name,
+        "jobs": len(schedd),
+        "wall_time_s": wall_time,
+        "jobs_per_s": len(schedd) / wall_time if wall_time else None,
+        "peak_memory_bytes": peak,
+        "subprocess_calls": subprocess_calls,
+    }
+
+
+def run_benchmarks(  # noqa: PLR0913
+    sizes: list[int] = DEFAULT_SIZES,
+    stages: list[str] = STAGES,
+    n_owners: int = 500,
+    latency: float = 0.005,
+    repeat: int = 3,
+    memory: bool = True,
+    seed: int = 0,
+) -> dict:
+    """Run every stage at every queue size, returning the results with the configuration used"""
+    results = []
+    for size in sizes:
+        schedd = SyntheticSchedd(size, n_owners=n_owners, seed=seed)
+        for name in stages:
+            result = measure(name, schedd, latency, repeat, memory)
+            peak = f", peak {result['peak_memory_bytes'] / 2**20:.1f} MiB" if memory else ""
+            logging.info(f"{name:>12} {size:>9} jobs: {result['wall_time_s']:.4f}s{peak}")
+            results.append(result)
+    return {
+        "version": condor_tools._version(),
+        "python": platform.python_version(),
+        "created": datetime.datetime.now().isoformat(),
+        "config": {"owners": n_owners, "lookup_latency_s": latency, "repeat": repeat, "seed": seed},
+        "results": results,
+    }
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark condor_stat.py against a synthetic schedd.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Numbers of jobs in the queue.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to measure.")
+    parser.add_argument("--owners", type=int, default=500, help="Number of distinct job owners (default: 500).")
+    parser.add_argument(
+        "--latency", type=float, default=0.005, help="Seconds each identity lookup takes (default: 0.005)."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest is kept (default: 3).")
+    parser.add_argument("--no-memory", action="store_true", help="Skip measuring peak memory.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the synthetic queue.")
+    parser.add_argument("--output", metavar="PATH", help="Write the results here as JSON, rather than to stdout.")
+    return parser.parse_args()
+
+
+def main():
+    args = _parse_args()
+    results = run_benchmarks(
+        sizes=args.sizes,
+        stages=args.stages,
+        n_owners=args.owners,
+        latency=args.latency,
+        repeat=args.repeat,
+        memory=not args.no_memory,
+        seed=args.seed,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
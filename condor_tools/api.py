@@ -0,0 +1,292 @@
+"""Programmatic access to the pool's job stats, for long-lived services such as dashboards.
+
+    import asyncio
+    from condor_tools.api import PoolStats
+
+    async def refresh(stats: PoolStats):
+        result = await stats.stats()
+        for user in result.users[:10]:
+            print(user.user, user.name, user.total(), user.priority)
+
+    async def main():
+        async with PoolStats(pool=True) as stats:
+            while True:
+                await refresh(stats)
+                await asyncio.sleep(30)
+
+One PoolStats keeps its collector and schedd handles, its thread pool, the machine index and the
+identity index between calls, so refreshing costs the schedd queries and little else.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from .cache import DiskCache
+from .classifier import MachineClassifier
+from .condor_tools import (
+    IDENTITY_TTL,
+    MACHINE_TTL,
+    PRIORITY_TTL,
+    SCHEDD_TIMEOUT,
+    SCHEDD_WORKERS,
+    IdentityIndex,
+    _rank_users,
+    fetch_jobs,
+    fetch_totals,
+    get_user_priorities,
+    load_classifier,
+)
+from .stats import STATUSES, JobCounts
+
+
+class UserStats:
+    """Job counts of one user per machine type and status, with their name, experiments and priority"""
+
+    __slots__ = ("experiments", "jobs", "name", "priority", "user")
+
+    def __init__(
+        self,
+        user: str,
+        name: str,
+        experiments: list[str],
+        priority: Optional[float],
+        jobs: dict[str, dict[str, int]],
+    ):
+        self.user = user
+        self.name = name
+        self.experiments = experiments
+        self.priority = priority
+        self.jobs = jobs
+
+    def total(self, statuses=STATUSES, machine_type: str = "Total") -> int:
+        """Number of the user's jobs with the given statuses, on one machine type or all of them"""
+        counts = self.jobs.get(machine_type, {})
+        return sum(counts.get(status, 0) for status in statuses)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self) -> str:
+        return f"UserStats(user={self.user!r}, name={self.name!r}, jobs={self.total()}, priority={self.priority!r})"
+
+
+class StatsResult:
+    """Job counts of every user in the pool (or schedd), most jobs first, with the totals per machine type"""
+
+    __slots__ = ("failed", "fetched_at", "totals", "users")
+
+    def __init__(self, users: list[UserStats], totals: dict[str, dict[str, int]], failed: list[str], fetched_at: float):
+        self.users = users
+        self.totals = totals
+        self.failed = failed
+        self.fetched_at = fetched_at
+
+    def get(self, user: str) -> Optional[UserStats]:
+        return next((stats for stats in self.users if stats.user == user), None)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "users": [stats.to_dict() for stats in self.users],
+            "totals": self.totals,
+            "failed": self.failed,
+            "fetched_at": self.fetched_at,
+        }
+
+    def __repr__(self) -> str:
+        return f"StatsResult(users={len(self.users)}, failed={self.failed!r}, fetched_at={self.fetched_at!r})"
+
+
+class PoolStats:
+    """Async access to the job stats of the local schedd, or every schedd in the pool.
+
+    The HTCondor calls block, so they run in a thread pool owned by this object, with the schedds of
+    the pool queried at the same time, each on its own daemon thread. The collector and schedd handles are kept and reused, as are
+    the machine index (refreshed every MACHINE_TTL seconds) and the identity index, which is backed
+    by the same on-disk cache as the command line tool. Close it (or use it as an async context
+    manager) to stop the threads.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        pool: bool = False,
+        only: Optional[str] = None,
+        schedd_timeout: float = SCHEDD_TIMEOUT,
+        max_workers: int = SCHEDD_WORKERS,
+        identity_ttl: float = IDENTITY_TTL,
+        collector=None,
+        schedd=None,
+    ):
+        self.pool = pool
+        self.only = only
+        self.schedd_timeout = schedd_timeout
+        self._collector = collector
+        self._schedd = schedd
+        self._schedds: dict[tuple[str, str], Any] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="PoolStats")
+        self._priority_cache = DiskCache("priorities", ttl=PRIORITY_TTL)
+        self.identities = IdentityIndex(cache=DiskCache("identities", ttl=identity_ttl))
+        self._classifier: Optional[MachineClassifier] = None
+        self._classifier_loaded = 0.0
+        # Created on first use, so it belongs to the event loop the methods are awaited in
+        self._identity_lock: Optional[asyncio.Lock] = None
+
+    async def _call(self, func: Callable, *args, **kwargs):
+        """Run a blocking call in the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    @staticmethod
+    def _call_on_thread(func: Callable, *args) -> asyncio.Future:
+        """Run a blocking call on a daemon thread of its own, so one that hangs holds up neither the thread
+        pool nor the interpreter's exit"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(result, error):
+            if future.done():
+                # Timed out and was cancelled
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+        def run():
+            try:
+                result, error = func(*args), None
+            except Exception as e:
+                result, error = None, e
+            try:
+                loop.call_soon_threadsafe(resolve, result, error)
+            except RuntimeError:
+                # The event loop was closed while the call was running
+                pass
+
+        threading.Thread(target=run, daemon=True, name="PoolStats-schedd").start()
+        return future
+
+    def _connect(self):
+        import htcondor2  # noqa: PLC0415
+
+        if self._collector is None:
+            self._collector = htcondor2.Collector()
+        if self._schedd is None and not self.pool:
+            self._schedd = htcondor2.Schedd()
+        return self._collector
+
+    def _pool_schedd(self, ad):
+        """Get a handle for a schedd in the pool, reusing the one from earlier calls if it hasn't moved"""
+        import htcondor2  # noqa: PLC0415
+
+        key = (ad.get("Name", ""), ad.get("MyAddress", ""))
+        schedd = self._schedds.get(key)
+        if schedd is None:
+            schedd = self._schedds[key] = htcondor2.Schedd(ad)
+        return schedd
+
+    async def classifier(self) -> MachineClassifier:
+        """Get the machine classifier, rebuilding it once it's older than MACHINE_TTL"""
+        if self._classifier is None or time.monotonic() - self._classifier_loaded > MACHINE_TTL:
+            collector = self._connect()
+            self._classifier = await self._call(load_classifier, collector)
+            self._classifier_loaded = time.monotonic()
+        return self._classifier
+
+    async def _each_schedd(self, func: Callable) -> tuple[list, list[str]]:
+        """Call func(schedd) for the local schedd, or every schedd in the pool at the same time.
+
+        Returns the results and the names of the schedds that failed or didn't answer within the timeout.
+        """
+        collector = self._connect()
+        if not self.pool:
+            return [await self._call(func, self._schedd)], []
+
+        import htcondor2  # noqa: PLC0415
+
+        schedd_ads = await self._call(collector.locateAll, htcondor2.DaemonType.Schedd)
+        names = [ad.get("Name", f"schedd{i}") for i, ad in enumerate(schedd_ads)]
+        # Each schedd gets a thread of its own, so its timeout starts when its query does rather than when
+        # a worker is free, and a schedd that hangs is left behind without taking up a worker
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(self._call_on_thread(func, self._pool_schedd(ad)), self.schedd_timeout)
+                for ad in schedd_ads
+            ),
+            return_exceptions=True,
+        )
+        failed = [name for name, result in zip(names, results) if isinstance(result, BaseException)]
+        return [result for result in results if not isinstance(result, BaseException)], failed
+
+    async def jobs(self) -> tuple[JobCounts, list[str]]:
+        """Get the job counts per user, and the names of any schedds that didn't answer"""
+        classifier = await self.classifier()
+        results, failed = await self._each_schedd(lambda schedd: fetch_jobs(self.only, schedd, classifier))
+        counts = JobCounts()
+        for result in results:
+            counts.merge(result)
+        return counts, failed
+
+    async def totals(self) -> tuple[dict[str, dict[str, int]], list[str]]:
+        """Get the number of jobs in each status per machine type, counted by the schedd(s), and the names of
+        any schedds that didn't answer"""
+        classifier = await self.classifier()
+        results, failed = await self._each_schedd(lambda schedd: fetch_totals(schedd, classifier))
+        totals: dict[str, dict[str, int]] = {}
+        for result in results:
+            for machine_type, stats in result.items():
+                for status, count in stats.items():
+                    totals.setdefault(machine_type, {}).setdefault(status, 0)
+                    totals[machine_type][status] += count
+        return totals, failed
+
+    async def priorities(self) -> dict[str, float]:
+        """Get the effective priority of every user, cached for PRIORITY_TTL seconds"""
+        return await self._call(get_user_priorities, self._connect(), self._priority_cache)
+
+    async def stats(self, priorities: bool = True) -> StatsResult:
+        """Get everyone's job counts, names, experiments and (optionally) priorities.
+
+        The schedd queries, the priority lookup and loading the identity cache all run at the same time.
+        """
+        if self._identity_lock is None:
+            self._identity_lock = asyncio.Lock()
+        async with self._identity_lock:
+            gathered = await asyncio.gather(
+                self.jobs(),
+                self.priorities() if priorities else asyncio.sleep(0, {}),
+                self._call(self.identities.prefetch),
+            )
+            (counts, failed), user_priorities, _ = gathered
+            users = _rank_users(counts, self.only, user_priorities, "jobs", None)
+            await self._call(self.identities.resolve, users)
+            await self._call(self.identities.save)
+            user_stats = [
+                UserStats(
+                    user,
+                    self.identities.real_name(user),
+                    self.identities.experiments(user),
+                    user_priorities.get(user),
+                    {machine_type: dict(stats) for machine_type, stats in counts[user].items()},
+                )
+                for user in users
+            ]
+        totals = counts.machine_type_totals()
+        return StatsResult(user_stats, totals, failed, time.time())
+
+    async def close(self):
+        """Save newly resolved identities and shut down the thread pool"""
+        try:
+            await self._call(self.identities.save)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self) -> "PoolStats":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import Iterable
+from typing import Any, Optional
+
+DEFAULT_MAX_ENTRIES = 10000
+SQLITE_TIMEOUT = 5.0
+
+
+def default_cache_dir() -> str:
+    """Get the directory used for on-disk caches, following the XDG base directory spec"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "condor_tools")
+
+
+class DiskCache:
+    """Small persistent key -> JSON value store with a TTL and LRU eviction, backed by sqlite.
+
+    Entries live in a namespace so several caches can share one file. Any sqlite error (e.g. a
+    read-only or full home directory) is logged and the cache behaves as if it were empty.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        path: Optional[str] = None,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path or os.path.join(default_cache_dir(), "cache.sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+            # Rollback journal rather than WAL, as home directories are often on NFS. The connection may be
+            # opened in a worker thread and used later from the main thread, but never by two at once
+            self._conn = sqlite3.connect(
+                self.path, timeout=SQLITE_TIMEOUT, isolation_level=None, check_same_thread=False
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+        return self._conn
+
+    def load(self) -> dict[str, Any]:
+        """Get all unexpired entries in the namespace"""
+        try:
+            rows = self._connect().execute(
+                "SELECT key, value FROM entries WHERE namespace = ? AND created >= ?",
+                (self.namespace, time.time() - self.ttl),
+            )
+            return {key: json.loads(value) for key, value in rows}
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.debug(f"Could not read cache {self.path}: {e}")
+            return {}
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a single unexpired entry, or None if it is missing"""
+        try:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND created >= ?",
+                    (self.namespace, key, time.time() - self.ttl),
+                )
+                .fetchone()
+            )
+            return None if row is None else json.loads(row[0])
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.debug(f"Could not read cache {self.path}: {e}")
+            return None
+
+    def update(self, entries: dict[str, Any], touched: Iterable[str] = ()):
+        """Store new entries and mark existing ones as recently used, then evict the least recently used"""
+        touched = list(touched)
+        if not entries and not touched:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    [(self.namespace, key, json.dumps(value), now, now) for key, value in entries.items()],
+                )
+                conn.executemany(
+                    "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                    [(now, self.namespace, key) for key in touched],
+                )
+                conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key NOT IN "
+                    "(SELECT key FROM entries WHERE namespace = ? ORDER BY accessed DESC LIMIT ?)",
+                    (self.namespace, self.namespace, self.max_entries),
+                )
+        except (sqlite3.Error, OSError) as e:
+            logging.debug(f"Could not write cache {self.path}: {e}")
+
+    def clear(self):
+        """Remove all entries in the namespace"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM entries WHERE namespace = ?", (self.namespace,))
+        except (sqlite3.Error, OSError) as e:
+            logging.debug(f"Could not clear cache {self.path}: {e}")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,85 @@
+import logging
+from typing import Optional
+
+from .cache import DiskCache
+
+# Startd attributes needed to tell GPU machines from CPU ones
+STARTD_PROJECTION = ["Machine", "TotalGPUs", "GPUs"]
+
+
+def _host(remote_host: str) -> str:
+    """Get the machine name from a slot name like slot1_2@host"""
+    return remote_host.rpartition("@")[2]
+
+
+def _has_gpus(ad) -> bool:
+    try:
+        return float(ad.get("TotalGPUs") or 0) > 0 or float(ad.get("GPUs") or 0) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class MachineClassifier:
+    """Classifies jobs as running (or waiting to run) on a CPU or GPU machine.
+
+    Running jobs are classified by looking up the machine in their RemoteHost in a host -> machine type
+    index built from the startd ads in the collector, so GPU machines are found whatever they're called.
+    Machines missing from the index fall back to looking for "gpu" in the name, and idle jobs are
+    classified by whether they request GPUs. The result for each RemoteHost is memoised, as a queue has
+    many jobs on each slot.
+    """
+
+    def __init__(self, machine_types: Optional[dict[str, str]] = None):
+        self.machine_types = machine_types or {}
+        self._memo: dict[str, str] = {}
+
+    @classmethod
+    def from_startd_ads(cls, ads) -> "MachineClassifier":
+        """Build the index from startd ads. A machine is a GPU machine if any of its slots has GPUs"""
+        machine_types = {}
+        for ad in ads:
+            machine = ad.get("Machine")
+            if machine and machine_types.get(machine.lower()) != "GPU":
+                machine_types[machine.lower()] = "GPU" if _has_gpus(ad) else "CPU"
+        return cls(machine_types)
+
+    @classmethod
+    def from_collector(cls, collector, cache: Optional[DiskCache] = None) -> "MachineClassifier":
+        """Build the index from the collector's startd ads, or from the cache if it's been built recently.
+
+        If the collector can't be queried, the classifier falls back to the naming heuristic for every job.
+        """
+        if cache is not None:
+            cached = cache.get("machines")
+            if cached is not None:
+                return cls(cached)
+
+        import htcondor2  # noqa: PLC0415
+
+        try:
+            ads = collector.query(htcondor2.AdType.Startd, projection=STARTD_PROJECTION)
+            classifier = cls.from_startd_ads(ads)
+        except Exception as e:
+            logging.debug(f"Could not get startd ads, classifying machines by name: {e!r}")
+            return cls()
+
+        if cache is not None and classifier.machine_types:
+            cache.update({"machines": classifier.machine_types})
+        return classifier
+
+    def classify_host(self, remote_host: str) -> str:
+        """Get the machine type of a slot or machine name"""
+        machine_type = self._memo.get(remote_host)
+        if machine_type is None:
+            machine_type = self.machine_types.get(_host(remote_host).lower())
+            if machine_type is None:
+                machine_type = "GPU" if "gpu" in remote_host.lower() else "CPU"
+            self._memo[remote_host] = machine_type
+        return machine_type
+
+    def classify(self, job) -> str:
+        """Classify a job from its RemoteHost, or its RequestGPUs if it isn't running"""
+        remote_host = job.get("RemoteHost")
+        if remote_host is not None:
+            return self.classify_host(remote_host)
+        return "GPU" if job.get("RequestGPUs", 0) != 0 else "CPU"
@@ -1,21 +1,70 @@
 import argparse
 import datetime
+import functools
 import getpass
-import importlib.metadata
+import grp
+import heapq
 import logging
 import os
+import pwd
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from collections import defaultdict
-from dataclasses import dataclass
+from collections.abc import Iterable, Mapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Optional
 
-import htcondor2
-from prettytable import PrettyTable
-from termcolor import colored
+from .cache import DiskCache
+from .classifier import MachineClassifier
+from .slots import SLOT_STATES, SlotCapacity
+from .snapshot import Snapshot
+from .stats import JOB_STATUSES, JobCounts
+from .table import Table
+from .threads import run_with_deadline
+from .timing import span, timed, timings
+from .usage import write_usage
+from .writers import FORMATS, write_stats
 
 STATUSES_TO_PRINT = ["Running", "Idle", "Held"]
-__version__ = importlib.metadata.version("condor-tools")
+EXCLUDED_GROUPS = ["res0", "htcuser"]
+IDENTITY_TTL = 24 * 60 * 60
+IDENTITY_WORKERS = 16
+IDENTITY_TIMEOUT = 5.0
+SCHEDD_WORKERS = 16
+SCHEDD_TIMEOUT = 30.0
+PRIORITY_TTL = 60
+DRILLDOWN_LIMIT = 1000
+DRILLDOWN_PAGE_SIZE = 100
+MACHINE_TTL = 3600
+DAEMON_INTERVAL = 30.0
+DEFAULT_SOCKET = os.environ.get("CONDOR_STAT_SOCKET") or os.path.join(tempfile.gettempdir(), "condor_stat.sock")
+
+
+# The HTCondor bindings, termcolor and importlib.metadata are imported where they're first
+# needed rather than here, as they make up most of the startup time when the virtualenv is on NFS, and
+# --help, --version and reading snapshots don't need some or all of them
+@functools.cache
+def _version() -> str:
+    import importlib.metadata  # noqa: PLC0415
+
+    return importlib.metadata.version("condor-tools")
+
+
+def __getattr__(name: str):
+    if name == "__version__":
+        return _version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def colored(text: str, color: str) -> str:
+    """termcolor.colored, importing termcolor on first use"""
+    import termcolor  # noqa: PLC0415
+
+    return termcolor.colored(text, color)
 
 
 # Setup logging
@@ -34,18 +83,35 @@ logging.basicConfig(level=logging.INFO, handlers=[handler])
 
 
 def _setup_condor() -> tuple:
+    import htcondor2  # noqa: PLC0415
+
     # Initialize the Collector and Schedd
     collector = htcondor2.Collector()
     schedd = htcondor2.Schedd()
     return collector, schedd
 
 
-def _get_real_name(username: str) -> str:
+def _local_schedd_name() -> str:
+    """Get the name of the local schedd from the configuration, as HTCondor would name it"""
+    import htcondor2  # noqa: PLC0415
+
+    host = htcondor2.param.get("FULL_HOSTNAME", "")
+    name = htcondor2.param.get("SCHEDD_NAME")
+    if not name:
+        return host
+    # Like HTCondor, qualify names without a host with the local one
+    return name if "@" in name else f"{name}@{host}"
+
+
+def _get_real_name(username: str, timeout: Optional[float] = None) -> str:
     """Uses the 'pinky' command to get the real name of a user from their username"""
     real_name = ""
     try:
         # Parse output of 'pinky' to extract the real name
-        result = subprocess.run(["pinky", "-l", username], check=False, stdout=subprocess.PIPE, text=True)
+        with span("subprocess.pinky"):
+            result = subprocess.run(
+                ["pinky", "-l", username], check=False, stdout=subprocess.PIPE, text=True, timeout=timeout
+            )
         if result.returncode == 0:
             for line in result.stdout.split("\n"):
                 if "In real life:" in line:
@@ -58,74 +124,505 @@ def _get_real_name(username: str) -> str:
     return real_name
 
 
-def _get_user_experiments(username: str, excluded_groups: Optional[list[str]] = None) -> str:
+def _groups_to_experiments(username: str, groups: list[str], excluded_groups: list[str]) -> list[str]:
+    """Turn a user's group names into experiments, dropping excluded groups"""
+    # remove "0" that appears at the end of the experiment groups, e.g. cms0
+    experiments = [g[:-1] for g in groups if g != username and g not in excluded_groups]
+    return experiments or ["???"]
+
+
+def _get_user_experiments(
+    username: str, excluded_groups: Optional[list[str]] = None, timeout: Optional[float] = None
+) -> str:
     """Get user's experiment(s) using groups command"""
     if excluded_groups is None:
-        excluded_groups = [username, "res0", "htcuser"]
+        excluded_groups = [username, *EXCLUDED_GROUPS]
     try:
-        result = subprocess.run(
-            ["groups", username], check=False, text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
-        )
+        with span("subprocess.groups"):
+            result = subprocess.run(
+                ["groups", username],
+                check=False,
+                text=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                timeout=timeout,
+            )
         if result.returncode == 0:
-            excluded_groups.append(username)
             # command output is formatted like username : username group1 group2 ...
             groups = result.stdout.split(":")[1].split()
-            # remove "0" that appears at the end of the experiment groups, e.g. cms0
-            experiments = [g[:-1] for g in groups if g not in excluded_groups]
-            if experiments:
-                return experiments
+            return _groups_to_experiments(username, groups, excluded_groups)
     except Exception:
         pass
     return ["???"]
 
 
-def fetch_jobs(only: str, schedd) -> defaultdict:
-    """Fetch and print job details from HTCondor schedd, grouped and ranked by user based on job count"""
-    status_dict = {
-        1: "Idle",
-        2: "Running",
-        3: "Removed",
-        4: "Completed",
-        5: "Held",
-        6: "Transferring Output",
-        7: "Suspended",
-    }
+class IdentityIndex:
+    """Resolves real names and experiments in-process from the passwd and group databases.
 
-    # Query for jobs
-    jobs = schedd.query(projection=["ClusterId", "ProcId", "Owner", "JobStatus", "RemoteHost", "RequestGPUs"])
+    The databases are read in bulk on the first single-user lookup, so each user afterwards costs a
+    dictionary lookup, while resolve() looks up just the users it's given. Users that can't be enumerated
+    (e.g. some LDAP setups) are looked up individually, and the 'pinky'/'groups' commands are only used
+    for users unknown to the local NSS configuration. If a cache is given, resolved identities are read
+    from it first and written back by save().
+    """
 
-    # Group jobs by owner and count statuses, differentiated by machine type
-    user_jobs = defaultdict(list)
-    user_stats = defaultdict(lambda: {"CPU": defaultdict(int), "GPU": defaultdict(int), "Total": defaultdict(int)})
-    for job in jobs:
-        job_info = {
-            "Job ID": f"{job['ClusterId']}.{job['ProcId']}",
-            "Status": status_dict.get(job.get("JobStatus"), "Unknown"),
-            "Machine": job.get("RemoteHost", "N/A"),
+    def __init__(self, excluded_groups: Optional[list[str]] = None, cache: Optional[DiskCache] = None):
+        self.excluded_groups = EXCLUDED_GROUPS if excluded_groups is None else excluded_groups
+        self.cache = cache
+        self._real_names: dict[str, str] = {}
+        self._groups: dict[str, list[str]] = {}
+        self._experiments: dict[str, list[str]] = {}
+        self._loaded = False
+        self._cached: Optional[dict[str, list]] = None
+        self._cache_hits: set[str] = set()
+        self._unresolved: set[str] = set()
+        self._external: set[str] = set()
+
+    @staticmethod
+    def _gecos_name(entry: pwd.struct_passwd) -> str:
+        # Mimic 'pinky': the real name is the first GECOS field, with '&' standing for the username
+        return entry.pw_gecos.split(",")[0].replace("&", entry.pw_name.capitalize()).strip()
+
+    def _load(self):
+        """Build the username -> real name and username -> groups index"""
+        self._loaded = True
+        group_names = {}
+        members = defaultdict(list)
+        try:
+            for group in grp.getgrall():
+                group_names.setdefault(group.gr_gid, group.gr_name)
+                for member in group.gr_mem:
+                    members[member].append(group.gr_name)
+            users = pwd.getpwall()
+        except OSError:
+            return
+
+        for entry in users:
+            if entry.pw_name in self._real_names:
+                continue
+            self._real_names[entry.pw_name] = self._gecos_name(entry)
+            # 'groups' lists the primary group first, followed by the supplementary groups
+            primary = group_names.get(entry.pw_gid)
+            groups = [primary] if primary is not None else []
+            groups += [g for g in members.get(entry.pw_name, []) if g != primary]
+            self._groups[entry.pw_name] = groups
+
+    def _lookup(self, username: str) -> Optional[tuple[str, list[str]]]:
+        """Look up a single user that isn't in the bulk index, returns None if NSS doesn't know them"""
+        try:
+            entry = pwd.getpwnam(username)
+            gids = os.getgrouplist(username, entry.pw_gid)
+        except (KeyError, TypeError, OSError):
+            return None
+        groups = []
+        for gid in gids:
+            try:
+                groups.append(grp.getgrgid(gid).gr_name)
+            except KeyError:
+                continue
+        return self._gecos_name(entry), groups
+
+    def _resolve_one(self, username: str, timeout: Optional[float] = None) -> tuple[str, list[str]]:
+        """Resolve a user that isn't in the cache or the bulk index, without touching shared state"""
+        found = self._lookup(username)
+        if found is None:
+            return (
+                _get_real_name(username, timeout=timeout),
+                _get_user_experiments(username, [username, *self.excluded_groups], timeout=timeout),
+            )
+        real_name, groups = found
+        return real_name, _groups_to_experiments(username, groups, self.excluded_groups)
+
+    def _from_cache(self, username: str) -> bool:
+        """Fill in a user from the on-disk cache, returns whether it was found"""
+        if self.cache is None:
+            return False
+        if self._cached is None:
+            self._cached = self.cache.load()
+        if username not in self._cached:
+            return False
+        self._real_names[username], self._experiments[username] = self._cached[username]
+        self._cache_hits.add(username)
+        return True
+
+    def _known(self, username: str) -> bool:
+        """Whether a user can be answered from memory, the cache or the bulk index"""
+        if username in self._real_names or self._from_cache(username):
+            return True
+        if not self._loaded:
+            self._load()
+        return username in self._real_names
+
+    def _ensure(self, username: str):
+        """Resolve a user's real name and experiments, so they're saved to the cache whichever was asked for"""
+        if not self._known(username):
+            self._real_names[username], self._experiments[username] = self._resolve_one(username)
+        elif username not in self._experiments:
+            self._experiments[username] = _groups_to_experiments(username, self._groups[username], self.excluded_groups)
+
+    def update(self, identities: Mapping[str, tuple[str, list[str]]]):
+        """Add identities resolved elsewhere (e.g. by the daemon) as user -> (real name, experiments).
+
+        They may be out of date or from another site's directory, so they're used but not written to the cache.
+        """
+        for user, (real_name, experiments) in identities.items():
+            self._real_names[user] = real_name
+            self._experiments[user] = list(experiments)
+            self._external.add(user)
+
+    def export(self, usernames: Iterable[str]) -> dict[str, tuple[str, list[str]]]:
+        """Get the resolved identities of some users as user -> (real name, experiments)"""
+        return {user: (self.real_name(user), self.experiments(user)) for user in usernames}
+
+    @timed("identities.prefetch")
+    def prefetch(self):
+        """Load the on-disk cache ahead of time, e.g. while waiting for the schedd"""
+        if self.cache is not None and self._cached is None:
+            self._cached = self.cache.load()
+
+    @timed("identities.resolve")
+    def resolve(self, usernames: Iterable[str], max_workers: int = IDENTITY_WORKERS, timeout: float = IDENTITY_TIMEOUT):
+        """Resolve a batch of users up front, looking up the ones not in memory or the cache concurrently.
+
+        The users are looked up one by one rather than by enumerating the passwd and group databases, so
+        the cost follows the number of users shown rather than the size of the site's directory. Each
+        lookup gets its own timeout, and users whose lookup doesn't finish in time are shown with the
+        usual "Unknown"/"???" fallbacks (but not cached) instead of holding up the rest of the table.
+        """
+        pending = [
+            user for user in dict.fromkeys(usernames) if user not in self._real_names and not self._from_cache(user)
+        ]
+        if not pending:
+            return
+
+        workers = min(max_workers, len(pending))
+        # Lookups are queued behind each other on the workers, so allow one timeout per round of workers
+        rounds = -(-len(pending) // workers)
+        results, failed = run_with_deadline(
+            {user: functools.partial(self._resolve_one, user, timeout) for user in pending},
+            workers,
+            timeout * (rounds + 1),
+        )
+        self._real_names.update((user, name) for user, (name, _) in results.items())
+        self._experiments.update((user, experiments) for user, (_, experiments) in results.items())
+        for user, e in failed.items():
+            logging.debug(f"Could not resolve identity of {user}: {e!r}")
+            self._real_names[user], self._experiments[user] = "Unknown", ["???"]
+            self._unresolved.add(user)
+
+    def real_name(self, username: str) -> str:
+        """Get the real name of a user, falling back to 'pinky' for users unknown to NSS"""
+        self._ensure(username)
+        real_name = self._real_names[username]
+        if real_name in {"???", ""}:
+            real_name = "Unknown"
+        return real_name
+
+    def experiments(self, username: str) -> list[str]:
+        """Get the experiment(s) of a user, falling back to 'groups' for users unknown to NSS"""
+        self._ensure(username)
+        return self._experiments[username]
+
+    @timed("identities.save")
+    def save(self):
+        """Write newly resolved identities to the cache and refresh the ones that were used"""
+        if self.cache is None:
+            return
+        resolved = {
+            user: [self.real_name(user), experiments]
+            for user, experiments in self._experiments.items()
+            if user in self._real_names and user not in self._cache_hits | self._unresolved | self._external
         }
-        owner = job["Owner"]
-        if "gpu" in job_info["Machine"].lower():
-            machine_type = "GPU"
-        elif job_info["Machine"] == "N/A":
-            gpus = job.get("RequestGPUs", 0)
-            if gpus != 0:
-                machine_type = "GPU"
-            else:
-                machine_type = "CPU"
-        else:
-            machine_type = "CPU"
+        self.cache.update(resolved, touched=self._cache_hits)
+
+
+# Attributes needed to aggregate jobs by owner, status and machine type
+JOB_PROJECTION = ["Owner", "JobStatus", "RemoteHost", "RequestGPUs"]
+
+# ClassAd equivalent of the classifier's naming heuristic, so the schedd can do the --only filtering
+GPU_JOB_CONSTRAINT = (
+    '(RemoteHost isnt undefined && regexp("gpu", RemoteHost, "i")) || '
+    "(RemoteHost is undefined && RequestGPUs isnt undefined && RequestGPUs != 0)"
+)
+GPU_IDLE_JOB_CONSTRAINT = "RemoteHost is undefined && RequestGPUs isnt undefined && RequestGPUs != 0"
+
+
+def _machine_type_constraint(only: Optional[str], classifier: Optional[MachineClassifier] = None) -> str:
+    """Build the schedd query constraint selecting jobs on the given machine type, classifying them
+    exactly as the classifier does so the schedd only sends the jobs that are counted"""
+    if not only:
+        return "True"
+    gpu = _gpu_job_constraint(classifier)
+    if only.lower() == "gpu":
+        return gpu
+    return f"!({gpu})"
+
 
+@timed()
+def fetch_jobs(only: str, schedd, classifier: Optional[MachineClassifier] = None) -> JobCounts:
+    """Fetch and print job details from HTCondor schedd, grouped and ranked by user based on job count"""
+    only_type = only.upper() if only else None
+    classify = (classifier or MachineClassifier()).classify
+
+    # Group jobs by owner and count statuses, differentiated by machine type
+    user_stats = JobCounts()
+
+    def count(job):
+        machine_type = classify(job)
         # Filter on machine type if specified
-        if only and machine_type.lower() != only.lower():
-            continue
+        if only_type and machine_type != only_type:
+            return
+        user_stats.add_job(job["Owner"], machine_type, job.get("JobStatus"))
+
+    # Query for jobs, letting the schedd drop jobs on the other machine type. The bindings build the full
+    # list of ads before running the callback over it, so peak memory still grows with the queue, but the
+    # callback returns None so no second list of ads is kept while the counts are built up
+    jobs = schedd.query(
+        constraint=_machine_type_constraint(only, classifier), projection=JOB_PROJECTION, callback=count
+    )
 
-        user_jobs[owner].append(job_info)
-        user_stats[owner][machine_type][job_info["Status"]] += 1
-        user_stats[owner]["Total"][job_info["Status"]] += 1
+    # Bindings that don't support callbacks hand back the ads instead
+    for job in jobs or ():
+        count(job)
 
     return user_stats
 
 
+# Attributes needed to list one user's jobs, HoldReason is only fetched when looking at held jobs
+USER_JOB_PROJECTION = ["ClusterId", "ProcId", "JobStatus", "RemoteHost", "RequestGPUs"]
+STATUS_CODES = {name.lower(): code for code, name in JOB_STATUSES.items()}
+HOLD_REASON_WIDTH = 80
+
+
+def _classad_string(value: str) -> str:
+    """Quote a string for use in a ClassAd expression"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _user_jobs_constraint(user: str, status: Optional[str] = None) -> str:
+    """Build the schedd query constraint selecting one user's jobs, optionally with one status"""
+    constraint = f"Owner == {_classad_string(user)}"
+    if status:
+        constraint += f" && JobStatus == {STATUS_CODES[status.lower()]}"
+    return constraint
+
+
+def fetch_user_jobs(  # noqa: PLR0913
+    user: str,
+    schedd,
+    status: Optional[str] = None,
+    limit: int = DRILLDOWN_LIMIT,
+    classifier: Optional[MachineClassifier] = None,
+    page_size: int = DRILLDOWN_PAGE_SIZE,
+) -> Iterable[list[list[str]]]:
+    """Get the jobs of one user, as pages of rows of job id, status, machine type and host (or hold reason).
+
+    The Owner (and status) constraint and the limit are applied by the schedd, so this costs about as
+    much as the number of jobs returned rather than the size of the queue. Each ad is reduced to its row
+    by the query's callback, and the rows are handed out a page at a time.
+    """
+    classify = (classifier or MachineClassifier()).classify
+    held = status is not None and status.lower() == "held"
+    projection = USER_JOB_PROJECTION + ["HoldReason"] * held
+
+    def row(job):
+        where = job.get("HoldReason", "")[:HOLD_REASON_WIDTH] if held else job.get("RemoteHost", "")
+        return [
+            f"{job.get('ClusterId')}.{job.get('ProcId')}",
+            JOB_STATUSES.get(job.get("JobStatus"), "Unknown"),
+            classify(job),
+            where,
+        ]
+
+    # Timed here rather than with @timed, which would only time creating the generator
+    with span("fetch_user_jobs"):
+        rows = schedd.query(
+            constraint=_user_jobs_constraint(user, status), projection=projection, callback=row, limit=limit
+        )
+    for start in range(0, len(rows), page_size):
+        yield rows[start : start + page_size]
+
+
+def show_user_jobs(  # noqa: PLR0913
+    user: str,
+    schedd,
+    status: Optional[str] = None,
+    limit: int = DRILLDOWN_LIMIT,
+    classifier: Optional[MachineClassifier] = None,
+    real_name: Optional[str] = None,
+) -> int:
+    """Print the jobs of one user a page at a time, returning how many were shown"""
+    headers = ["Job ID", "Status", "Machine", "Hold Reason" if status and status.lower() == "held" else "Host"]
+    title = f"Jobs of {user}" + (f" ({real_name})" if real_name else "") + (f", {status.lower()}" if status else "")
+    logging.info(title, extra={"simple": True})
+    shown = 0
+    for page in fetch_user_jobs(user, schedd, status=status, limit=limit, classifier=classifier):
+        tab = Table(headers)
+        for job_row in page:
+            tab.add_row(job_row)
+        logging.info(tab, extra={"simple": True})
+        shown += len(page)
+    if not shown:
+        logging.warning(f"No jobs found for {user} in current schedd.")
+    elif shown == limit:
+        logging.info(f"Only the first {limit} jobs are shown, use --limit to see more.", extra={"simple": True})
+    return shown
+
+
+@timed()
+def get_user_priorities(collector, cache: Optional[DiskCache] = None) -> dict[str, float]:
+    """Get the effective priority of every user from the negotiator's accounting ads.
+
+    The accountant has an entry for every submitter it knows about, so unlike the Negotiator ads in the
+    collector this includes users with no recent usage (as 'condor_userprio -allusers' does).
+    """
+    if cache is not None:
+        cached = cache.get("priorities")
+        if cached is not None:
+            return cached
+
+    import htcondor2  # noqa: PLC0415
+
+    try:
+        negotiator = htcondor2.Negotiator(collector.locate(htcondor2.DaemonType.Negotiator))
+        accounting_ads = negotiator.getPriorities()
+    except Exception as e:
+        logging.warning(f"Could not get user priorities from the negotiator: {e}")
+        return {}
+
+    user_priorities = {}
+    for ad in accounting_ads:
+        if "Name" in ad and "Priority" in ad:
+            # Round like condor_userprio does, names are like user@domain
+            user_priorities[ad["Name"].split("@")[0]] = round(float(ad["Priority"]), 2)
+
+    if cache is not None:
+        cache.update({"priorities": user_priorities})
+    return user_priorities
+
+
+def _gpu_job_constraint(classifier: Optional[MachineClassifier] = None) -> str:
+    """Build a ClassAd expression classifying jobs as GPU jobs like the classifier, so the schedd can do it.
+
+    Running jobs are classified by the naming heuristic, except on the machines in the classifier's index
+    that it gets wrong, which are listed. That is usually a handful, so the expression stays small on a
+    pool of thousands of machines.
+    """
+    if classifier is None or not classifier.machine_types:
+        return GPU_JOB_CONSTRAINT
+    host = "splitSlotName(RemoteHost)[1]"
+    # Machines are indexed by their lower case names
+    misnamed = {m: t for m, t in classifier.machine_types.items() if (t == "GPU") != ("gpu" in m)}
+    gpus = ", ".join(_classad_string(m) for m, t in misnamed.items() if t == "GPU")
+    cpus = ", ".join(_classad_string(m) for m, t in misnamed.items() if t == "CPU")
+    running = 'regexp("gpu", RemoteHost, "i")'
+    if cpus:
+        running = f"!member({host}, {{{cpus}}}) && {running}"
+    if gpus:
+        running = f"member({host}, {{{gpus}}}) || ({running})"
+    return f"(RemoteHost isnt undefined && ({running})) || ({GPU_IDLE_JOB_CONSTRAINT})"
+
+
+def _summary(schedd, constraint: str) -> Optional[dict[str, int]]:
+    """Get the number of jobs matching a constraint in each status from the schedd's summary ad, as
+    condor_q -totals does, or None if the schedd doesn't send one"""
+    import htcondor2  # noqa: PLC0415
+
+    for ad in schedd.query(constraint=constraint, projection=["JobStatus"], opts=htcondor2.QueryOpt.SummaryOnly):
+        if "Jobs" in ad:
+            return {status: int(ad.get(status, 0)) for status in STATUSES_TO_PRINT}
+    return None
+
+
+@timed()
+def fetch_totals(schedd, classifier: Optional[MachineClassifier] = None) -> dict[str, dict[str, int]]:
+    """Get the number of jobs in each status per machine type and in total, without fetching any jobs.
+
+    The schedd counts all the jobs, and the GPU jobs, in its summary ad, and the CPU jobs are the
+    difference. If the schedd doesn't send a summary ad, the jobs are fetched and counted here instead.
+    """
+    total = _summary(schedd, "True")
+    gpu = _summary(schedd, _gpu_job_constraint(classifier)) if total is not None else None
+    if total is None or gpu is None:
+        logging.debug("No summary ad from the schedd, counting the jobs instead")
+        return fetch_jobs(None, schedd, classifier).machine_type_totals(STATUSES_TO_PRINT)
+    cpu = {status: total[status] - gpu[status] for status in STATUSES_TO_PRINT}
+    return {"CPU": cpu, "GPU": gpu, "Total": total}
+
+
+@timed()
+def fetch_pool_jobs(
+    only: str,
+    collector,
+    timeout: float = SCHEDD_TIMEOUT,
+    max_workers: int = SCHEDD_WORKERS,
+    classifier: Optional[MachineClassifier] = None,
+) -> tuple[JobCounts, list[str]]:
+    """Fetch jobs from every schedd in the pool concurrently, merging the per-user stats.
+
+    Returns the merged stats and the names of the schedds that failed or didn't answer within the timeout.
+    """
+    import htcondor2  # noqa: PLC0415
+
+    user_stats = JobCounts()
+    schedd_ads = collector.locateAll(htcondor2.DaemonType.Schedd)
+    if not schedd_ads:
+        return user_stats, []
+
+    # The schedds are queried at the same time, so they all share one deadline. A schedd that hangs is
+    # left behind on its daemon thread rather than holding up the exit
+    tasks = {
+        ad.get("Name", f"schedd{i}"): functools.partial(
+            lambda ad: fetch_jobs(only, htcondor2.Schedd(ad), classifier), ad
+        )
+        for i, ad in enumerate(schedd_ads)
+    }
+    results, errors = run_with_deadline(tasks, min(max_workers, len(schedd_ads)), timeout)
+    failed = []
+    for name in tasks:
+        if name in results:
+            user_stats.merge(results[name])
+        else:
+            logging.debug(f"Query of schedd {name} failed: {errors[name]!r}")
+            failed.append(name)
+    return user_stats, failed
+
+
+@timed()
+def fetch_pool_totals(
+    collector,
+    timeout: float = SCHEDD_TIMEOUT,
+    max_workers: int = SCHEDD_WORKERS,
+    classifier: Optional[MachineClassifier] = None,
+) -> tuple[dict[str, dict[str, int]], list[str]]:
+    """Get the job totals of every schedd in the pool concurrently, adding them up.
+
+    Returns the totals and the names of the schedds that failed or didn't answer within the timeout.
+    """
+    import htcondor2  # noqa: PLC0415
+
+    totals = {machine_type: dict.fromkeys(STATUSES_TO_PRINT, 0) for machine_type in ("CPU", "GPU", "Total")}
+    schedd_ads = collector.locateAll(htcondor2.DaemonType.Schedd)
+    if not schedd_ads:
+        return totals, []
+
+    tasks = {
+        ad.get("Name", f"schedd{i}"): functools.partial(lambda ad: fetch_totals(htcondor2.Schedd(ad), classifier), ad)
+        for i, ad in enumerate(schedd_ads)
+    }
+    results, errors = run_with_deadline(tasks, min(max_workers, len(schedd_ads)), timeout)
+    failed = []
+    for name in tasks:
+        if name not in results:
+            logging.debug(f"Query of schedd {name} failed: {errors[name]!r}")
+            failed.append(name)
+            continue
+        for machine_type, stats in results[name].items():
+            for status, count in stats.items():
+                totals[machine_type][status] += count
+    return totals, failed
+
+
 def _get_headers(priority: bool, only: str):
     if priority:
         headers = ["User", "Name", "Priority", "CPU", "GPU", "Total"]
@@ -149,24 +646,43 @@ class TableContext:
     only: str
     user_priorities: dict[str, float]
     priority: bool
+    identities: IdentityIndex = field(default_factory=IdentityIndex)
+    previous: Optional[Mapping] = None
+
 
+def _format_delta(val: int, previous_val: int) -> str:
+    """Highlight the change in a count since the previous refresh, if there is one"""
+    if val == previous_val:
+        return ""
+    return colored(f" ({val - previous_val:+d})", "yellow")
 
-def _build_machine_stats_string(machine_type: str, stats: defaultdict, machine_stats: defaultdict) -> str:
+
+def _build_machine_stats_string(
+    machine_type: str, stats: defaultdict, machine_stats: defaultdict, previous: Optional[Mapping] = None
+) -> str:
     """Build the summary statistics string for a machine type."""
     s = ""
     total = 0
+    previous_total = 0
     for status in STATUSES_TO_PRINT:
         val = stats[status]
-        s += f"{status}: {val}\n"
+        s += f"{status}: {val}"
+        if previous is not None:
+            s += _format_delta(val, previous.get(status, 0))
+            previous_total += previous.get(status, 0)
+        s += "\n"
         total += val
         machine_stats[machine_type][status] += val
     s += f"Total: {total}"
+    if previous is not None:
+        s += _format_delta(total, previous_total)
     return s
 
 
 def _get_row(user: str, jobs: defaultdict, ctx: TableContext) -> tuple[list[str], defaultdict]:
     """Generate a table row for a user with their job statistics."""
-    row = [user, _get_real_name(user) + f" ({', '.join(_get_user_experiments(user))})"]
+    identities = ctx.identities
+    row = [user, identities.real_name(user) + f" ({', '.join(identities.experiments(user))})"]
     machine_stats = defaultdict(lambda: dict(zip(STATUSES_TO_PRINT, [0] * len(STATUSES_TO_PRINT))))
 
     # ;)
@@ -180,39 +696,66 @@ def _get_row(user: str, jobs: defaultdict, ctx: TableContext) -> tuple[list[str]
     if ctx.priority:
         row.append(ctx.user_priorities.get(user, -1))
 
+    # Counts from the previous refresh in --watch mode, users that weren't there before count from zero
+    previous = None
+    if ctx.previous is not None:
+        previous = ctx.previous[user] if user in ctx.previous else {}
+
     for machine_type, stats in jobs.items():
         if ctx.only and machine_type.lower() != ctx.only.lower():
             continue
 
-        stats_string = _build_machine_stats_string(machine_type, stats, machine_stats)
+        previous_stats = None if previous is None else previous.get(machine_type, {})
+        stats_string = _build_machine_stats_string(machine_type, stats, machine_stats, previous_stats)
         row.append(stats_string)
 
     return row, machine_stats
 
 
-def _highlight_row(user: str, current_user: str, row: list[str]) -> list[str]:
-    if user == current_user:
-        c_row = []
-        for entry in row:
-            # Apply color to the text content only, not the dividers
-            colored_lines = [colored(line, "green") for line in str(entry).split("\n")]
-            colored_entry = "\n".join(colored_lines)
-            c_row.append(colored_entry)
-        return c_row
-    return row
+def _rank_users(
+    counts: JobCounts, only: Optional[str], user_priorities: dict[str, float], sort_by: str, top: Optional[int]
+) -> list[str]:
+    """Order the users by job count, most first, or by priority, best (lowest) first, keeping only the top N.
+
+    With a top N this is a partial sort, so only N users are ever kept in order.
+    """
+    if sort_by == "priority":
+        # Users without a priority go last
+        def key(user):
+            return (user not in user_priorities, user_priorities.get(user, 0))
+    else:
+        totals = counts.user_totals(STATUSES_TO_PRINT, only)
+
+        def key(user):
+            return -totals[user]
+
+    if top is None:
+        return sorted(counts.users, key=key)
+    return heapq.nsmallest(top, counts.users, key=key)
 
 
-def format_table(
-    user_stats: defaultdict,
+@timed()
+def format_table(  # noqa: PLR0913
+    user_stats: Mapping,
     only: str,
     user_priorities: dict[str, float],
     current_user: Optional[str] = None,
     priority: bool = False,
-) -> PrettyTable:
-    """Format job statistics into a table."""
+    identities: Optional[IdentityIndex] = None,
+    previous: Optional[Mapping] = None,
+    sort_by: str = "jobs",
+    top: Optional[int] = None,
+    capacity: Optional[SlotCapacity] = None,
+) -> Table:
+    """Format job statistics into a table, ranked by job count or priority.
+
+    With top, only that many users are shown (and have their identities looked up), but the totals row
+    still covers everyone. Changes since the previous stats are highlighted if they're given, and the
+    pool's slots are shown under the totals if their capacity is given.
+    """
     headers = _get_headers(priority, only)
     current_date = datetime.datetime.now().strftime("%d/%m")
-    tab = PrettyTable(headers, align="l", hrules=1)
+    tab = Table(headers)
 
     # Create context object to reduce parameter passing
     ctx = TableContext(
@@ -221,87 +764,620 @@ def format_table(
         only=only,
         user_priorities=user_priorities,
         priority=priority,
+        identities=identities or IdentityIndex(),
+        previous=previous,
     )
 
-    machine_stats = defaultdict(lambda: dict(zip(STATUSES_TO_PRINT, [0] * len(STATUSES_TO_PRINT))))
-
-    # Get stats by user, per machine type
-    for user, jobs in user_stats.items():
-        row, user_machine_stats = _get_row(user, jobs, ctx)
+    counts = JobCounts.from_user_stats(user_stats)
+    if not counts:
+        logging.warning("No jobs found in current schedd.")
+        sys.exit(1)
 
-        # Accumulate machine stats for totals
-        for machine_type, stats in user_machine_stats.items():
-            for status in STATUSES_TO_PRINT:
-                machine_stats[machine_type][status] += stats[status]
+    with span("format_table.rank"):
+        users = _rank_users(counts, only, user_priorities, sort_by, top)
+    # Resolve everyone's identity in one go, rather than one user at a time
+    ctx.identities.resolve(users)
 
-        tab.add_row(_highlight_row(user, current_user, row))
+    # Get stats by user, per machine type
+    with span("format_table.rows"):
+        for user in users:
+            row, _ = _get_row(user, counts[user], ctx)
+            tab.add_row(row, colour="green" if user == current_user else None)
 
     # Get totals by machine type
-    totals = []
-    for stats in machine_stats.values():
-        s = ""
-        for status in STATUSES_TO_PRINT:
-            s += colored(f"{status}: {stats[status]}", "red") + "\n"
-        s += colored(f"Total: {sum(stats.values())}", "red")
-        totals.append(s)
+    totals = _totals_cells(counts.machine_type_totals(STATUSES_TO_PRINT), only)
 
     # Add totals row
-    try:
-        if priority:
-            tab.add_row([colored("Total", "red"), "", "", *totals])
-        else:
-            tab.add_row([colored("Total", "red"), "", *totals])
-    except ValueError:
-        logging.warning("No jobs found in current schedd.")
-        sys.exit(1)
+    padding = ["", ""] if priority else [""]
+    tab.add_row(["Total", *padding, *totals], colour="red")
+
+    if capacity is not None:
+        machine_types = [m for m in ("CPU", "GPU") if not only or m.lower() == only.lower()]
+        cells = [_slots_cell(capacity, m) for m in machine_types] + ([] if only else [_slots_cell(capacity, None)])
+        tab.add_row(["Slots", *padding, *cells])
 
     return tab
 
 
-def log(args: argparse.Namespace):
-    """Logs the usage of the script"""
+def _totals_cells(totals: Mapping[str, Mapping[str, int]], only: Optional[str]) -> list[str]:
+    """Describe the number of jobs in each status, for each machine type and in total"""
+    return [
+        "\n".join([*(f"{status}: {stats[status]}" for status in STATUSES_TO_PRINT), f"Total: {sum(stats.values())}"])
+        for machine_type, stats in totals.items()
+        if not only or machine_type.lower() == only.lower()
+    ]
+
+
+def format_totals_table(totals: Mapping[str, Mapping[str, int]], only: Optional[str] = None) -> Table:
+    """Format just the totals row of the table, without any users"""
+    tab = Table([m for m in totals if not only or m.lower() == only.lower()])
+    tab.add_row(_totals_cells(totals, only), colour="red")
+    return tab
+
+
+def _slots_cell(capacity: SlotCapacity, machine_type: Optional[str]) -> str:
+    """Describe the CPUs, memory and GPUs of the slots in each state, on one machine type or all of them"""
+    lines = []
+    for state in SLOT_STATES:
+        line = (
+            f"{state}: {capacity.get(machine_type, state, 'Cpus'):g} CPUs, "
+            f"{capacity.get(machine_type, state, 'Memory') / 1024:.0f} GB"
+        )
+        if machine_type != "CPU":
+            line += f", {capacity.get(machine_type, state, 'GPUs'):g} GPUs"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _history_cell(values: Optional[list[float]]) -> str:
+    completed, removed, wall_seconds, cpu_seconds = values or [0, 0, 0.0, 0.0]
+    return (
+        f"Completed: {completed}\nRemoved: {removed}\n"
+        f"Wall hours: {wall_seconds / 3600:.1f}\nCPU hours: {cpu_seconds / 3600:.1f}"
+    )
+
+
+@timed()
+def format_history_table(
+    history: Mapping[str, Mapping[str, list[float]]],
+    only: Optional[str] = None,
+    current_user: Optional[str] = None,
+    identities: Optional[IdentityIndex] = None,
+) -> Table:
+    """Format the finished jobs per user and machine type, from the most finished jobs to the least"""
+    machine_types = [m for m in ("CPU", "GPU") if not only or m.lower() == only.lower()]
+    tab = Table(["User", "Name", *machine_types])
+    identities = identities or IdentityIndex()
+
+    def finished(user):
+        return sum(values[0] + values[1] for m, values in history[user].items() if m in machine_types)
+
+    users = sorted((user for user in history if finished(user)), key=lambda user: (-finished(user), user))
+    identities.resolve(users)
+    totals = {m: [0, 0, 0.0, 0.0] for m in machine_types}
+    for user in users:
+        cells = [_history_cell(history[user].get(m)) for m in machine_types]
+        for m in machine_types:
+            for i, value in enumerate(history[user].get(m, ())):
+                totals[m][i] += value
+        tab.add_row(
+            [user, identities.real_name(user) + f" ({', '.join(identities.experiments(user))})", *cells],
+            colour="green" if user == current_user else None,
+        )
+    tab.add_row(["Total", "", *(_history_cell(totals[m]) for m in machine_types)], colour="red")
+    return tab
+
+
+def format_trend_table(trend: list[tuple[int, Mapping[tuple[str, str], float]]], only: Optional[str] = None) -> Table:
+    """Format the average job counts over time, one row per bucket of time"""
+    columns = [
+        (m, status) for m in ("CPU", "GPU") if not only or m.lower() == only.lower() for status in STATUSES_TO_PRINT
+    ]
+    tab = Table(["Time", *(f"{m} {status}" for m, status in columns)])
+    for start, averages in trend:
+        when = datetime.datetime.fromtimestamp(start).strftime("%d/%m %H:%M")
+        tab.add_row([when, *(f"{averages.get(column, 0):.1f}".removesuffix(".0") for column in columns)])
+    return tab
+
+
+@timed()
+def log(args: argparse.Namespace, real_name: Optional[str] = None):
+    """Logs the usage of the script, reusing the user's real name if it has already been looked up"""
     # Get the current user's username
     username = getpass.getuser()
-    real_name = _get_real_name(username)
+    if real_name is None:
+        real_name = _get_real_name(username)
 
     # Get the current timestamp
     timestamp = datetime.datetime.now().isoformat()
 
-    # Log to file
+    # Log to the shared file, under a lock and rotated by size
     script_dir = os.path.dirname(os.path.realpath(__file__))
-    log_file_path = os.path.join(script_dir, "usage_log.txt")
-    with open(log_file_path, "a+") as log_file:
-        # Write the timestamp, username, and real name to the log file
-        log_file.write(f"{timestamp}, {username}, {real_name}, {str(vars(args)).replace(',', ';').replace(' ', '')}\n")
+    log_file_path = os.environ.get("CONDOR_STAT_USAGE_LOG") or os.path.join(script_dir, "usage_log.txt")
+    write_usage(
+        f"{timestamp}, {username}, {real_name}, {str(vars(args)).replace(',', ';').replace(' ', '')}", log_file_path
+    )
 
 
-def main():
-    # Parse command line arguments
+@timed()
+def load_classifier(collector, cache: Optional[DiskCache] = None) -> MachineClassifier:
+    """Get the machine classifier for the pool, reusing the index of machines from a recent run"""
+    return MachineClassifier.from_collector(collector, cache or DiskCache("machines", ttl=MACHINE_TTL))
+
+
+@timed()
+def load_slots(collector) -> SlotCapacity:
+    """Get the capacity of the pool's slots, also refreshing the index of machines used to classify jobs"""
+    return SlotCapacity.from_collector(collector, DiskCache("machines", ttl=MACHINE_TTL))
+
+
+def _job_classifier(collector, capacity: Optional[Future] = None) -> MachineClassifier:
+    """Get the machine classifier, taking the index of machines from the slots being loaded (rather than
+    querying the startd ads a second time) if it isn't cached"""
+    cache = DiskCache("machines", ttl=MACHINE_TTL)
+    if capacity is None or cache.get("machines") is not None:
+        return load_classifier(collector, cache)
+    return capacity.result().classifier()
+
+
+def _fetch_user_stats(  # noqa: PLR0913
+    args: argparse.Namespace,
+    collector,
+    schedd,
+    classifier: Optional[MachineClassifier] = None,
+    unfiltered: bool = False,
+    capacity: Optional[Future] = None,
+) -> JobCounts:
+    """Fetch the per-user job stats from the local schedd, or every schedd in the pool, on the --only machine
+    type unless unfiltered"""
+    if classifier is None:
+        classifier = _job_classifier(collector, capacity)
+    only = None if unfiltered else args.only
+    if not args.pool:
+        return fetch_jobs(only, schedd, classifier)
+    user_stats, failed = fetch_pool_jobs(only, collector, timeout=args.schedd_timeout, classifier=classifier)
+    if failed:
+        logging.warning(f"No response from schedd(s), their jobs are not shown: {', '.join(failed)}")
+    return user_stats
+
+
+def _gather(
+    args: argparse.Namespace,
+    identities: IdentityIndex,
+    unfiltered: bool = False,
+    condor: Optional[tuple] = None,
+    capacity: Optional[Future] = None,
+) -> tuple[JobCounts, dict[str, float]]:
+    """Run the independent data-gathering steps at the same time, waiting for all of them before returning.
+
+    The schedd query, priority fetch and loading the identity cache don't depend on each other, so this
+    takes about as long as the slowest of them rather than their sum. The collector and schedd handles
+    and the slots being loaded for --slots can be passed in, so they're shared with the slots query.
+    """
+    collector, schedd = condor or _setup_condor()
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        user_stats = pool.submit(_fetch_user_stats, args, collector, schedd, unfiltered=unfiltered, capacity=capacity)
+        user_priorities = None
+        if args.priority or args.save_snapshot:
+            user_priorities = pool.submit(get_user_priorities, collector, DiskCache("priorities", ttl=PRIORITY_TTL))
+        prefetched = pool.submit(identities.prefetch)
+
+        prefetched.result()
+        return user_stats.result(), user_priorities.result() if user_priorities else {}
+
+
+def _load_stats(
+    args: argparse.Namespace,
+    identities: IdentityIndex,
+    condor: Optional[tuple] = None,
+    capacity: Optional[Future] = None,
+) -> tuple[Mapping, dict[str, float]]:
+    """Get the job stats and priorities from a snapshot file, the local daemon or the schedd(s), in that order.
+
+    With --record the stats cover every machine type, whatever --only says, as that's what's recorded.
+    """
+    if args.from_snapshot:
+        try:
+            snapshot = Snapshot.load(args.from_snapshot)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read snapshot {args.from_snapshot}: {e}")
+            sys.exit(1)
+    elif args.no_daemon:
+        snapshot = None
+    else:
+        from .daemon import request_snapshot  # noqa: PLC0415
+
+        snapshot = request_snapshot(args.socket, pool=args.pool)
+
+    if snapshot is None:
+        return _gather(args, identities, unfiltered=args.record, condor=condor, capacity=capacity)
+    identities.update(snapshot.identities)
+    return snapshot.counts.select(None if args.record else args.only), snapshot.priorities
+
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+
+def _duration(text: str) -> float:
+    """Parse a duration like 90m, 12h or 7d (hours if there's no unit) into seconds"""
+    unit = DURATION_UNITS.get(text[-1:].lower())
+    try:
+        value = float(text[:-1] if unit else text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {text!r}") from None
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"duration must be positive: {text!r}")
+    return value * (unit or DURATION_UNITS["h"])
+
+
+class _VersionAction(argparse.Action):
+    """Like argparse's "version" action, but only looks up the version if it's asked for"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, default=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings=option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser.exit(message=f"{parser.prog} {_version()}\n")
+
+
+def _parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
     parser = argparse.ArgumentParser(description="Display HTCondor job stats.")
+    parser.add_argument("--version", action=_VersionAction, help="Show the version and exit.")
     parser.add_argument("--priority", action="store_true", help="Display user priorities.")
     parser.add_argument("--only", choices=["cpu", "gpu"], help="Filter jobs by machine type (CPU or GPU).")
+    parser.add_argument(
+        "--sort",
+        choices=["jobs", "priority"],
+        default="jobs",
+        help="Rank users by their number of jobs, or by priority (implies --priority) (default: jobs).",
+    )
+    parser.add_argument("--top", type=int, metavar="N", help="Only show the top N users, plus the totals.")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        default="table",
+        help="Output format, the machine-readable ones are written to stdout (default: table).",
+    )
+    parser.add_argument(
+        "--user", metavar="NAME", help="List the jobs of one user in the local schedd instead of the summary table."
+    )
+    parser.add_argument(
+        "--status", choices=list(STATUS_CODES), help="With --user, only list the jobs with this status."
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=DRILLDOWN_LIMIT,
+        metavar="N",
+        help=f"With --user, list at most N jobs (default: {DRILLDOWN_LIMIT}).",
+    )
+    parser.add_argument(
+        "--history",
+        type=float,
+        metavar="HOURS",
+        help="Show the jobs that completed or were removed in the last HOURS hours, with their wall and CPU hours.",
+    )
+    parser.add_argument(
+        "--totals-only",
+        action="store_true",
+        help="Only show the totals row, counted by the schedd, without looking up users or priorities.",
+    )
+    parser.add_argument(
+        "--slots",
+        action="store_true",
+        help="Also show the CPUs, memory and GPUs of the pool's slots by whether they're claimed, under the table.",
+    )
+    parser.add_argument(
+        "--record", action="store_true", help="Also append the job counts to the local store used by --trend."
+    )
+    parser.add_argument(
+        "--trend",
+        metavar="USER|all",
+        help="Show how the job counts of a user (or everyone) have changed, from the runs saved with --record.",
+    )
+    parser.add_argument(
+        "--since",
+        type=_duration,
+        default=_duration("7d"),
+        metavar="DURATION",
+        help="With --trend, how far back to look, e.g. 12h or 30d (default: 7d).",
+    )
+    parser.add_argument(
+        "--refresh-identities", action="store_true", help="Ignore cached user names and experiments and rebuild them."
+    )
+    parser.add_argument(
+        "--identity-ttl",
+        type=float,
+        default=IDENTITY_TTL,
+        metavar="SECONDS",
+        help=f"How long cached user names and experiments are valid for (default: {IDENTITY_TTL}).",
+    )
+    parser.add_argument(
+        "--pool",
+        "--all-schedds",
+        action="store_true",
+        dest="pool",
+        help="Show jobs from every schedd in the pool, not just the local one.",
+    )
+    parser.add_argument(
+        "--schedd-timeout",
+        type=float,
+        default=SCHEDD_TIMEOUT,
+        metavar="SECONDS",
+        help=f"How long to wait for each schedd with --pool (default: {SCHEDD_TIMEOUT:g}).",
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="SECONDS",
+        help="Keep running and refresh the table every SECONDS, highlighting changes since the last refresh.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run a local daemon that polls the schedd and serves the stats to other condor_stat.py runs.",
+    )
+    parser.add_argument(
+        "--daemon-interval",
+        type=float,
+        default=DAEMON_INTERVAL,
+        metavar="SECONDS",
+        help=f"How often the daemon polls the schedd (default: {DAEMON_INTERVAL:g}).",
+    )
+    parser.add_argument(
+        "--socket",
+        default=DEFAULT_SOCKET,
+        metavar="PATH",
+        help=f"Unix socket the daemon serves on (default: {DEFAULT_SOCKET}, or $CONDOR_STAT_SOCKET).",
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true", help="Always query the schedd directly, even if a daemon is running."
+    )
+    parser.add_argument(
+        "--save-snapshot", metavar="PATH", help="Also save the job counts, priorities and identities to a file."
+    )
+    parser.add_argument(
+        "--from-snapshot", metavar="PATH", help="Show the stats from a file saved with --save-snapshot."
+    )
+    parser.add_argument(
+        "--timings", action="store_true", help="Print how long each phase took, including subprocess calls."
+    )
+    parser.add_argument(
+        "--profile", metavar="PATH", help="Save cProfile data for the run (of the main thread) to a file."
+    )
     args = parser.parse_args()
+    if args.history is not None and args.history <= 0:
+        parser.error("--history must be a positive number of hours")
+    if args.totals_only and args.format != "table":
+        parser.error("--totals-only only supports --format table")
+    if args.status and not args.user:
+        parser.error("--status needs --user")
+    if args.limit < 1:
+        parser.error("--limit must be at least 1")
+    if args.top is not None and args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.save_snapshot and args.only:
+        parser.error("--save-snapshot saves every machine type, it can't be combined with --only")
+    if args.sort == "priority":
+        args.priority = True
+    return args
+
+
+def _show_trend(args: argparse.Namespace):
+    from .trends import TrendStore  # noqa: PLC0415
+
+    store = TrendStore()
+    try:
+        trend = store.trend(None if args.trend == "all" else args.trend, time.time() - args.since)
+    finally:
+        store.close()
+    if not trend:
+        logging.warning(f"No samples recorded for {args.trend}, record some with --record.")
+        sys.exit(1)
+    logging.info(f"Average jobs of {args.trend}", extra={"simple": True})
+    logging.info(format_trend_table(trend, args.only), extra={"simple": True})
+
+
+def _own_name(identities: IdentityIndex, username: str) -> str:
+    """Get the real name of the user running this for the usage log, with a single lookup if it isn't cached
+    (rather than through the bulk index, as they usually have no jobs shown)"""
+    identities.resolve([username])
+    return identities.real_name(username)
+
+
+def _show_totals(args: argparse.Namespace, identities: IdentityIndex, username: str):
+    # Only the usage log needs a name, looked up in the background while the schedd counts the jobs
+    usage_log = threading.Thread(target=lambda: log(args, _own_name(identities, username)))
+    usage_log.start()
+    collector, schedd = _setup_condor()
+    classifier = load_classifier(collector)
+    if args.pool:
+        totals, failed = fetch_pool_totals(collector, timeout=args.schedd_timeout, classifier=classifier)
+        if failed:
+            logging.warning(f"No response from schedd(s), their jobs are not counted: {', '.join(failed)}")
+    else:
+        totals = fetch_totals(schedd, classifier)
+    logging.info(format_totals_table(totals, args.only), extra={"simple": True})
+    usage_log.join()
+    identities.save()
+
+
+def _show_user(args: argparse.Namespace, identities: IdentityIndex):
+    collector, schedd = _setup_condor()
+    identities.resolve([args.user])
+    show_user_jobs(
+        args.user,
+        schedd,
+        status=args.status,
+        limit=args.limit,
+        classifier=load_classifier(collector),
+        real_name=identities.real_name(args.user),
+    )
+
+
+def _show_history(args: argparse.Namespace, identities: IdentityIndex, username: str):
+    from .history import HISTORY_RETENTION, load_history  # noqa: PLC0415
+
+    collector, schedd = _setup_condor()
+    history = load_history(
+        schedd,
+        _local_schedd_name(),
+        args.history,
+        classifier=load_classifier(collector),
+        cache=DiskCache("history", ttl=HISTORY_RETENTION),
+    )
+    logging.info(f"Jobs finished in the last {args.history:g} hours", extra={"simple": True})
+    logging.info(
+        format_history_table(history, args.only, current_user=username, identities=identities), extra={"simple": True}
+    )
+
+
+def _run_daemon(args: argparse.Namespace, identities: IdentityIndex):
+    """Serve snapshots until interrupted, exiting with an error if another daemon already serves on the socket"""
+    from .daemon import SnapshotDaemon  # noqa: PLC0415
+
+    collector, schedd = _setup_condor()
+    try:
+        SnapshotDaemon(
+            collector,
+            schedd,
+            socket_path=args.socket,
+            interval=args.daemon_interval,
+            pool=args.pool,
+            identities=identities,
+        ).run()
+    except RuntimeError as e:
+        logging.error(e)
+        sys.exit(1)
+
+
+def _save_stats(
+    args: argparse.Namespace, user_stats: Mapping, user_priorities: dict[str, float], identities: IdentityIndex
+):
+    """Record the stats to the trend store and save them as a snapshot, if asked to"""
+    if args.record:
+        from .trends import record_stats  # noqa: PLC0415
+
+        with span("record"):
+            record_stats(JobCounts.from_user_stats(user_stats))
+    if args.save_snapshot:
+        with span("save_snapshot"):
+            # The table may only have needed the names of the top users, the snapshot needs everyone's
+            identities.resolve(user_stats)
+            Snapshot(
+                JobCounts.from_user_stats(user_stats),
+                priorities=user_priorities,
+                identities=identities.export(user_stats),
+                pool=args.pool,
+            ).save(args.save_snapshot)
+
+
+def _run(args: argparse.Namespace):
     priority = args.priority
-    logging.info(f"HTCondor Job Stats v{__version__}")
+    logging.info(f"HTCondor Job Stats v{_version()}")
 
     # Get the user who ran the script
     username = getpass.getuser()
 
-    if priority:
-        # Get user priorities from condor_userprio --allusers
-        # because the AdTypes.Negotiator leaves out some users
-        user_priorities = defaultdict(float)
-        result = subprocess.run(["condor_userprio", "-allusers", "-priority"], check=False, stdout=subprocess.PIPE)
-        lines = result.stdout.decode("utf-8").split("\n")[4:-3]  # Cursed
-        MIN_USERPRIO_PARTS = 3
-        for line in lines:
-            parts = line.split()
-            if len(parts) >= MIN_USERPRIO_PARTS:
-                user_priorities[parts[0].split("@")[0]] = float(parts[1])  # Use the second column as the priority
+    identity_cache = DiskCache("identities", ttl=args.identity_ttl)
+    if args.refresh_identities:
+        identity_cache.clear()
+    identities = IdentityIndex(cache=identity_cache)
+
+    if args.watch:
+        from .watch import watch  # noqa: PLC0415
+
+        watch(args, identities, current_user=username)
+        return
+
+    if args.daemon:
+        _run_daemon(args, identities)
+        return
+
+    if args.trend:
+        _show_trend(args)
+        return
+
+    if args.totals_only:
+        _show_totals(args, identities, username)
+        return
+
+    if args.user or args.history is not None:
+        if args.user:
+            _show_user(args, identities)
+        else:
+            _show_history(args, identities, username)
+        log(args, _own_name(identities, username))
+        identities.save()
+        return
+
+    # The slots are queried from the collector while the jobs are being fetched, with the same handles
+    condor = _setup_condor() if args.slots else None
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        capacity = pool.submit(load_slots, condor[0]) if condor else None
+        with span("load_stats"):
+            user_stats, user_priorities = _load_stats(args, identities, condor, capacity)
+        capacity = capacity.result() if capacity else None
+    # The trend store gets every machine type, and the output just the --only one
+    all_stats = user_stats
+    if args.record:
+        user_stats = JobCounts.from_user_stats(user_stats).select(args.only)
+
+    # Log the usage in the background while the output is produced, with the user's name from the identities
+    usage_log = threading.Thread(target=lambda: log(args, _own_name(identities, username)))
+    usage_log.start()
+    if args.format == "table":
+        table = format_table(
+            user_stats,
+            args.only,
+            user_priorities if priority else {},
+            current_user=username,
+            priority=priority,
+            identities=identities,
+            sort_by=args.sort,
+            top=args.top,
+            capacity=capacity,
+        )
+        with span("render"):
+            logging.info(table, extra={"simple": True})
     else:
-        user_priorities = {}
+        # Users are ranked by --sort and cut to --top as in the table, the totals still cover everyone
+        users = _rank_users(JobCounts.from_user_stats(user_stats), args.only, user_priorities, args.sort, args.top)
+        with span("write_stats"):
+            write_stats(
+                args.format,
+                user_stats,
+                sys.stdout,
+                STATUSES_TO_PRINT,
+                only=args.only,
+                user_priorities=user_priorities,
+                priority=priority,
+                identities=identities,
+                users=users,
+            )
+    _save_stats(args, all_stats, user_priorities, identities)
+    # The usage log thread may still be resolving the user running this, who should be saved too
+    usage_log.join()
+    identities.save()
 
-    log(args)
-    user_stats = fetch_jobs(args.only, _setup_condor()[1])
-    table = format_table(user_stats, args.only, user_priorities, current_user=username, priority=priority)
-    logging.info(table, extra={"simple": True})
+
+def main():
+    args = _parse_args()
+    if args.timings:
+        timings.enable()
+    profiler = None
+    if args.profile:
+        import cProfile  # noqa: PLC0415
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with span("main"):
+            _run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.timings:
+            logging.info(timings.report(), extra={"simple": True})
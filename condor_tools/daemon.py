@@ -0,0 +1,193 @@
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from typing import Optional
+
+from . import condor_tools
+from .condor_tools import DAEMON_INTERVAL, DEFAULT_SOCKET
+from .snapshot import Snapshot
+
+CLIENT_TIMEOUT = 2.0
+# Snapshots older than this many of the daemon's polling intervals are stale (e.g. the daemon is stuck)
+STALE_INTERVALS = 4
+
+
+class _SnapshotHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        payload = self.server.snapshot_daemon.payload
+        if payload is not None:
+            self.request.sendall(payload)
+
+
+class _SnapshotServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Unix sockets refuse connections once the backlog is full rather than retrying, and the default of 5
+    # is easily reached by a burst of users on a login node
+    request_queue_size = 128
+
+    def __init__(self, socket_path: str, snapshot_daemon: "SnapshotDaemon"):
+        self.snapshot_daemon = snapshot_daemon
+        super().__init__(socket_path, _SnapshotHandler)
+
+
+class SnapshotDaemon:
+    """Polls the schedd(s) on a fixed interval and serves the latest snapshot over a Unix domain socket.
+
+    Many condor_stat.py runs on the same node can then share one schedd query, priority fetch and set of
+    identity lookups per interval. Each poll's snapshot is encoded once, and every client connection is
+    sent the latest encoded snapshot and then closed.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        collector,
+        schedd,
+        socket_path: str = DEFAULT_SOCKET,
+        interval: float = DAEMON_INTERVAL,
+        pool: bool = False,
+        identities: Optional[condor_tools.IdentityIndex] = None,
+    ):
+        self.collector = collector
+        self.schedd = schedd
+        self.socket_path = socket_path
+        self.interval = interval
+        self.pool = pool
+        self.identities = identities or condor_tools.IdentityIndex()
+        self.payload: Optional[bytes] = None
+        self._stop = threading.Event()
+        self._server: Optional[_SnapshotServer] = None
+
+    def poll(self) -> Snapshot:
+        """Gather a fresh snapshot and make it the one served to clients"""
+        classifier = condor_tools.load_classifier(self.collector)
+        if self.pool:
+            counts, failed = condor_tools.fetch_pool_jobs(None, self.collector, classifier=classifier)
+            if failed:
+                logging.warning(f"No response from schedd(s), their jobs are not shown: {', '.join(failed)}")
+        else:
+            counts = condor_tools.fetch_jobs(None, self.schedd, classifier)
+        priorities = condor_tools.get_user_priorities(self.collector)
+        self.identities.resolve(counts.users)
+        self.identities.save()
+        snapshot = Snapshot(
+            counts=counts,
+            priorities=priorities,
+            identities=self.identities.export(counts.users),
+            pool=self.pool,
+            interval=self.interval,
+        )
+        self.payload = snapshot.to_json()
+        return snapshot
+
+    def _poll_forever(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logging.warning(f"Failed to update snapshot: {e}")
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 0))
+
+    def start(self):
+        """Start polling and serving in background threads, raising RuntimeError if a daemon is already serving"""
+        if os.path.exists(self.socket_path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CLIENT_TIMEOUT)
+                try:
+                    sock.connect(self.socket_path)
+                except OSError:
+                    # Nothing answers, so it's the socket of a previous daemon that didn't shut down cleanly
+                    os.unlink(self.socket_path)
+                else:
+                    raise RuntimeError(f"A daemon is already serving on {self.socket_path}")
+        self._server = _SnapshotServer(self.socket_path, self)
+        # Let other users on the node connect, the stats are the same as anyone can get from the schedd
+        os.chmod(self.socket_path, 0o666)
+        threading.Thread(target=self._poll_forever, daemon=True).start()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def run(self):
+        """Serve until interrupted"""
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def _peer_uid(sock: socket.socket, socket_path: str) -> int:
+    """Get the user the process at the other end of a Unix socket runs as"""
+    if hasattr(socket, "SO_PEERCRED"):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        return struct.unpack("3i", creds)[1]
+    # Without SO_PEERCRED, fall back to who created the socket file
+    return os.stat(socket_path).st_uid
+
+
+def _trusted(uid: int, socket_path: str) -> bool:
+    """Whether a daemon running as uid can be trusted to serve honest stats.
+
+    The daemon is trusted if it runs as the current user or root, or as the owner of the directory the
+    socket is in when nobody else can write to that directory (so nobody else could have put the socket
+    there). A socket in a shared directory such as /tmp from any other user may be an impostor's.
+    """
+    if uid in (os.getuid(), 0):
+        return True
+    try:
+        directory = os.stat(os.path.dirname(os.path.abspath(socket_path)))
+    except OSError:
+        return False
+    return directory.st_uid == uid and not directory.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def request_snapshot(
+    socket_path: str = DEFAULT_SOCKET,
+    pool: bool = False,
+    max_age: Optional[float] = None,
+    timeout: float = CLIENT_TIMEOUT,
+) -> Optional[Snapshot]:
+    """Get the latest snapshot from a running daemon, or None if there isn't a (usable) one.
+
+    Snapshots are stale once older than max_age, by default STALE_INTERVALS of the daemon's own interval.
+    """
+    if not os.path.exists(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            uid = _peer_uid(sock, socket_path)
+            if not _trusted(uid, socket_path):
+                logging.warning(f"Ignoring the daemon on {socket_path}, it is run by an untrusted user (uid {uid})")
+                return None
+            chunks = []
+            while chunk := sock.recv(1 << 16):
+                chunks.append(chunk)
+        snapshot = Snapshot.from_json(b"".join(chunks))
+    except (OSError, ValueError) as e:
+        logging.debug(f"Could not get a snapshot from {socket_path}: {e}")
+        return None
+
+    if max_age is None:
+        max_age = STALE_INTERVALS * (snapshot.interval or DAEMON_INTERVAL)
+    if snapshot.pool != pool or time.time() - snapshot.created > max_age:
+        logging.debug(f"Ignoring snapshot from {socket_path}, it is stale or for a different set of schedds")
+        return None
+    return snapshot
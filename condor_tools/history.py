@@ -0,0 +1,189 @@
+import logging
+import time
+from collections.abc import Iterable
+from typing import Optional
+
+from .cache import DiskCache
+from .classifier import MachineClassifier
+
+# Job attributes needed to aggregate finished jobs, so the schedd doesn't send the rest of each history record
+HISTORY_PROJECTION = [
+    "Owner",
+    "ClusterId",
+    "ProcId",
+    "JobStatus",
+    "EnteredCurrentStatus",
+    "RemoteWallClockTime",
+    "RequestCpus",
+    "RequestGPUs",
+    "LastRemoteHost",
+]
+HISTORY_CONSTRAINT = "JobStatus == 3 || JobStatus == 4"
+# Aggregates are kept this long, so asking for a longer window than the last run's doesn't rescan the history
+HISTORY_RETENTION = 7 * 24 * 60 * 60
+# How far out of order (by EnteredCurrentStatus) history records can be and still be picked up if the
+# cursor's record has been rotated out of the history
+HISTORY_SLACK = 60 * 60
+BUCKET_SECONDS = 60 * 60
+STATE_VERSION = 2
+
+# Counters kept for each hour, user and machine type
+COMPLETED, REMOVED, WALL_SECONDS, CPU_SECONDS = range(4)
+_STATUS_COUNTER = {4: COMPLETED, 3: REMOVED}
+
+
+def _bucket(timestamp: float) -> int:
+    return int(timestamp // BUCKET_SECONDS) * BUCKET_SECONDS
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class HistoryAggregate:
+    """Completed and removed jobs per user and machine type, with their wall time and CPU time, by the hour.
+
+    The schedd's history is read newest first. The first run reads back to the start of the window and
+    later runs only read the records added since the newest one seen before (the cursor), so the whole
+    history is only read once. The cursor and the hourly aggregates are kept in a cache between
+    runs, and hours older than the retention period are dropped. The ids of the jobs that finished in the
+    last HISTORY_SLACK are kept too, so they aren't counted twice if the cursor's record is rotated away
+    and the history is read past where the last run stopped.
+
+    CPU time is the cores requested times the wall time, as it would be accounted for.
+    """
+
+    def __init__(self):
+        self.cursor: Optional[str] = None
+        self.latest = 0.0
+        self.covered_since: Optional[int] = None
+        self.buckets: dict[tuple[int, str, str], list[float]] = {}
+        # Job id -> EnteredCurrentStatus of the records within HISTORY_SLACK of the newest one
+        self.recent: dict[str, float] = {}
+
+    @classmethod
+    def from_json(cls, state: Optional[dict]) -> "HistoryAggregate":
+        aggregate = cls()
+        if not state or state.get("version") != STATE_VERSION:
+            return aggregate
+        aggregate.cursor = state["cursor"]
+        aggregate.latest = state["latest"]
+        aggregate.covered_since = state["covered_since"]
+        aggregate.recent = state["recent"]
+        aggregate.buckets = {
+            (hour, user, machine_type): values for hour, user, machine_type, *values in state["buckets"]
+        }
+        return aggregate
+
+    def to_json(self) -> dict:
+        return {
+            "version": STATE_VERSION,
+            "cursor": self.cursor,
+            "latest": self.latest,
+            "covered_since": self.covered_since,
+            "recent": self.recent,
+            "buckets": [[*key, *values] for key, values in self.buckets.items()],
+        }
+
+    def add(self, jobs: Iterable, classifier: Optional[MachineClassifier] = None) -> int:
+        """Add history records, newest first, moving the cursor to the first. Returns the number added,
+        which doesn't include records that were already added"""
+        classifier = classifier or MachineClassifier()
+        added = 0
+        first = True
+        for job in jobs:
+            job_id = f"{job.get('ClusterId')}.{job.get('ProcId')}"
+            if first:
+                self.cursor = job_id
+                first = False
+            if job_id in self.recent:
+                continue
+            added += 1
+            counter = _STATUS_COUNTER.get(job.get("JobStatus"))
+            if counter is None:
+                continue
+            last_host = job.get("LastRemoteHost")
+            if last_host:
+                machine_type = classifier.classify_host(last_host)
+            else:
+                machine_type = "GPU" if _number(job.get("RequestGPUs")) else "CPU"
+            finished = _number(job.get("EnteredCurrentStatus"))
+            self.latest = max(self.latest, finished)
+            self.recent[job_id] = finished
+            key = (_bucket(finished), job.get("Owner", "Unknown"), machine_type)
+            values = self.buckets.get(key)
+            if values is None:
+                values = self.buckets[key] = [0, 0, 0.0, 0.0]
+            wall = _number(job.get("RemoteWallClockTime"))
+            values[counter] += 1
+            values[WALL_SECONDS] += wall
+            values[CPU_SECONDS] += wall * max(_number(job.get("RequestCpus")), 1.0)
+        return added
+
+    def _prune(self, cutoff: int):
+        self.buckets = {key: values for key, values in self.buckets.items() if key[0] >= cutoff}
+        self.covered_since = max(self.covered_since or cutoff, cutoff)
+
+    def update(self, schedd, window_start: float, classifier: Optional[MachineClassifier] = None, now=None) -> int:
+        """Read the history records that aren't aggregated yet, making sure the aggregates reach back to
+        the window start. Returns the number of records read"""
+        now = time.time() if now is None else now
+        window_start = _bucket(window_start)
+        if self.covered_since is None or window_start < self.covered_since:
+            # Nothing stored reaches back far enough, so start again from the window start
+            self.cursor = None
+            self.latest = 0.0
+            self.covered_since = window_start
+            self.buckets = {}
+            self.recent = {}
+        # Without a cursor, read back to where the aggregates start (the history is ordered by when jobs
+        # left the queue, so this stops at the first older record)
+        since = self.cursor or f"EnteredCurrentStatus < {self.covered_since}"
+        constraint = HISTORY_CONSTRAINT
+        if self.cursor:
+            # If the cursor's record has been rotated away the whole history is read, so skip the records that
+            # finished well before the newest one seen (the history is roughly in the order jobs finished).
+            # Records out of order by less than HISTORY_SLACK are still read, and told apart by their job ids
+            constraint = f"({constraint}) && EnteredCurrentStatus >= {int(self.latest - HISTORY_SLACK)}"
+        added = self.add(schedd.history(constraint=constraint, projection=HISTORY_PROJECTION, since=since), classifier)
+        self.recent = {job_id: t for job_id, t in self.recent.items() if t >= self.latest - HISTORY_SLACK}
+        self._prune(_bucket(min(window_start, now - HISTORY_RETENTION)))
+        return added
+
+    def totals(self, window_start: float) -> dict[str, dict[str, list[float]]]:
+        """Get the counters per user and machine type, summed over the hours from the window start"""
+        window_start = _bucket(window_start)
+        totals: dict[str, dict[str, list[float]]] = {}
+        for (hour, user, machine_type), values in self.buckets.items():
+            if hour < window_start:
+                continue
+            summed = totals.setdefault(user, {}).setdefault(machine_type, [0, 0, 0.0, 0.0])
+            for i, value in enumerate(values):
+                summed[i] += value
+        return totals
+
+
+def load_history(
+    schedd,
+    schedd_name: str,
+    hours: float,
+    classifier: Optional[MachineClassifier] = None,
+    cache: Optional[DiskCache] = None,
+) -> dict[str, dict[str, list[float]]]:
+    """Get the finished jobs of the last few hours per user and machine type, reading only new history
+    records if the aggregates from an earlier run are in the cache.
+
+    The aggregates are cached under the schedd's name, as the cache may be in a home directory shared
+    between nodes with their own schedds, whose cursors mean nothing to each other.
+    """
+    key = schedd_name
+    aggregate = HistoryAggregate.from_json(cache.get(key) if cache is not None else None)
+    window_start = time.time() - hours * 60 * 60
+    read = aggregate.update(schedd, window_start, classifier)
+    logging.debug(f"Read {read} history records")
+    if cache is not None:
+        cache.update({key: aggregate.to_json()})
+    return aggregate.totals(window_start)
@@ -0,0 +1,88 @@
+import logging
+from array import array
+from collections.abc import Iterable
+from typing import Optional
+
+from .cache import DiskCache
+from .classifier import MachineClassifier, _has_gpus
+from .stats import MACHINE_TYPE_INDEX, MACHINE_TYPES
+
+# Startd attributes needed for the pool's capacity, which also tell GPU machines from CPU ones
+SLOT_PROJECTION = ["Machine", "State", "SlotType", "Cpus", "Memory", "GPUs", "TotalGPUs"]
+SLOT_STATES = ("Claimed", "Unclaimed", "Partitionable")
+RESOURCES = ("Cpus", "Memory", "GPUs")
+CLAIMED, UNCLAIMED, PARTITIONABLE = range(len(SLOT_STATES))
+_BLOCK = len(SLOT_STATES) * len(RESOURCES)
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class SlotCapacity:
+    """CPUs, memory (in MB) and GPUs of the pool's slots per machine type, by whether they're claimed.
+
+    Static and dynamic slots count as claimed or unclaimed by their State (slots that are matched,
+    preempting or owned count as claimed, as they can't take a new job), and partitionable slots count
+    as what they have left to hand out. The totals are held in one flat array laid out as
+    [machine type][state][resource], filled in one pass over the startd ads, which also builds the
+    index of machine types for the MachineClassifier.
+    """
+
+    def __init__(self):
+        self._totals = array("d", bytes(8 * len(MACHINE_TYPES) * _BLOCK))
+        self.machine_types: dict[str, str] = {}
+        self.slots = 0
+
+    @classmethod
+    def from_startd_ads(cls, ads: Iterable) -> "SlotCapacity":
+        capacity = cls()
+        totals = capacity._totals
+        machine_types = capacity.machine_types
+        for ad in ads:
+            machine = (ad.get("Machine") or "").lower()
+            machine_type = "GPU" if _has_gpus(ad) else "CPU"
+            if machine and machine_types.get(machine) != "GPU":
+                machine_types[machine] = machine_type
+            if ad.get("SlotType") == "Partitionable":
+                state = PARTITIONABLE
+            else:
+                state = UNCLAIMED if ad.get("State") == "Unclaimed" else CLAIMED
+            offset = MACHINE_TYPE_INDEX[machine_type] * _BLOCK + state * len(RESOURCES)
+            totals[offset] += _number(ad.get("Cpus"))
+            totals[offset + 1] += _number(ad.get("Memory"))
+            totals[offset + 2] += _number(ad.get("GPUs"))
+            capacity.slots += 1
+        return capacity
+
+    @classmethod
+    def from_collector(cls, collector, cache: Optional[DiskCache] = None) -> "SlotCapacity":
+        """Get the capacity from one query of the collector's startd ads, refreshing the cached machine index.
+
+        If the collector can't be queried, the capacity is empty.
+        """
+        import htcondor2  # noqa: PLC0415
+
+        try:
+            ads = collector.query(htcondor2.AdType.Startd, projection=SLOT_PROJECTION)
+        except Exception as e:
+            logging.warning(f"Could not get the slots from the collector: {e!r}")
+            return cls()
+        capacity = cls.from_startd_ads(ads)
+        if cache is not None and capacity.machine_types:
+            cache.update({"machines": capacity.machine_types})
+        return capacity
+
+    def classifier(self) -> MachineClassifier:
+        """Get a machine classifier using the machines seen in the startd ads"""
+        return MachineClassifier(dict(self.machine_types))
+
+    def get(self, machine_type: Optional[str], state: str, resource: str) -> float:
+        """Total of a resource over the slots in a state, on one machine type or all of them"""
+        column = SLOT_STATES.index(state) * len(RESOURCES) + RESOURCES.index(resource)
+        if machine_type is None:
+            return sum(self._totals[column::_BLOCK])
+        return self._totals[MACHINE_TYPE_INDEX[machine_type.upper()] * _BLOCK + column]
@@ -0,0 +1,138 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .stats import MACHINE_TYPES, STATUSES, JobCounts
+
+SNAPSHOT_VERSION = 1
+
+# Snapshot files are a fixed header, the JSON encoded users, priorities and identities, then the
+# counters as one little-endian int64 array aligned to 8 bytes, which can be copied straight out
+SNAPSHOT_MAGIC = b"CSNP"
+_HEADER = struct.Struct("<4sHHdQQ")  # magic, version, flags, created, metadata length, counters length
+_POOL_FLAG = 1
+
+
+@dataclass
+class Snapshot:
+    """Everything needed to render the table: job counts, user priorities and resolved identities"""
+
+    counts: JobCounts
+    priorities: dict[str, float] = field(default_factory=dict)
+    identities: dict[str, tuple[str, list[str]]] = field(default_factory=dict)
+    created: float = field(default_factory=time.time)
+    pool: bool = False
+    # How often the daemon that made the snapshot polls, so clients can tell when it has gone stale
+    interval: Optional[float] = None
+
+    def _metadata(self) -> dict:
+        return {
+            "layout": [MACHINE_TYPES, STATUSES],
+            "users": self.counts.users,
+            "priorities": self.priorities,
+            "identities": self.identities,
+            "interval": self.interval,
+        }
+
+    @classmethod
+    def _from_metadata(cls, metadata: dict, counts, created: float, pool: bool) -> "Snapshot":
+        try:
+            if metadata["layout"] != [list(MACHINE_TYPES), list(STATUSES)]:
+                raise ValueError("Snapshot has a different layout of machine types and statuses")
+            return cls(
+                counts=JobCounts.from_columns(metadata["users"], counts),
+                priorities=metadata["priorities"],
+                identities={user: (name, experiments) for user, (name, experiments) in metadata["identities"].items()},
+                created=created,
+                pool=pool,
+                interval=metadata.get("interval"),
+            )
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f"Malformed snapshot: {e!r}") from e
+
+    def to_json(self) -> bytes:
+        _, counts = self.counts.columns()
+        return json.dumps(
+            {
+                "version": SNAPSHOT_VERSION,
+                "created": self.created,
+                "pool": self.pool,
+                "counts": counts.tolist(),
+                **self._metadata(),
+            },
+            separators=(",", ":"),
+        ).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "Snapshot":
+        """Decode a snapshot, raising ValueError if it's malformed or from an incompatible version"""
+        decoded = json.loads(data)
+        if not isinstance(decoded, dict) or decoded.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Incompatible snapshot version")
+        try:
+            return cls._from_metadata(decoded, decoded["counts"], decoded["created"], decoded["pool"])
+        except KeyError as e:
+            raise ValueError(f"Malformed snapshot: {e!r}") from e
+
+    def save(self, path: str):
+        """Write the snapshot to a file, replacing it atomically"""
+        _, counts = self.counts.columns()
+        if sys.byteorder != "little":
+            counts.byteswap()
+        metadata = json.dumps(self._metadata(), separators=(",", ":")).encode()
+        padding = -(_HEADER.size + len(metadata)) % counts.itemsize
+        flags = _POOL_FLAG if self.pool else 0
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(
+                    _HEADER.pack(
+                        SNAPSHOT_MAGIC,
+                        SNAPSHOT_VERSION,
+                        flags,
+                        self.created,
+                        len(metadata),
+                        len(counts) * counts.itemsize,
+                    )
+                )
+                f.write(metadata)
+                f.write(bytes(padding))
+                counts.tofile(f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @classmethod
+    def load(cls, path: str) -> "Snapshot":
+        """Read a snapshot file, raising ValueError if it's malformed or from an incompatible version"""
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) < _HEADER.size:
+                raise ValueError("Snapshot file is truncated")
+            magic, version, flags, created, metadata_length, counts_length = _HEADER.unpack_from(mapped)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("Not a snapshot file")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Incompatible snapshot version {version}")
+
+            counts = array("q")
+            counts_start = _HEADER.size + metadata_length
+            counts_start += -counts_start % counts.itemsize
+            if counts_start + counts_length != len(mapped):
+                raise ValueError("Snapshot file is truncated")
+            with memoryview(mapped) as view:
+                metadata = json.loads(bytes(view[_HEADER.size : _HEADER.size + metadata_length]))
+                counts.frombytes(view[counts_start:])
+
+        if sys.byteorder != "little":
+            counts.byteswap()
+        if not isinstance(metadata, dict):
+            raise ValueError("Malformed snapshot metadata")
+        return cls._from_metadata(metadata, counts, created, bool(flags & _POOL_FLAG))
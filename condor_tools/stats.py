@@ -0,0 +1,169 @@
+from array import array
+from collections import defaultdict
+from collections.abc import Iterable, Iterator, Mapping
+from typing import Optional
+
+JOB_STATUSES = {
+    1: "Idle",
+    2: "Running",
+    3: "Removed",
+    4: "Completed",
+    5: "Held",
+    6: "Transferring Output",
+    7: "Suspended",
+}
+STATUSES = (*JOB_STATUSES.values(), "Unknown")
+MACHINE_TYPES = ("CPU", "GPU")
+
+# Column of each JobStatus code/status name/machine type within a user's block of counters
+STATUS_INDEX = {code: i for i, code in enumerate(JOB_STATUSES)}
+STATUS_NAME_INDEX = {status: i for i, status in enumerate(STATUSES)}
+UNKNOWN_STATUS = STATUS_NAME_INDEX["Unknown"]
+MACHINE_TYPE_INDEX = {machine_type: i for i, machine_type in enumerate(MACHINE_TYPES)}
+
+BLOCK_SIZE = len(MACHINE_TYPES) * len(STATUSES)
+_EMPTY_BLOCK = array("q", bytes(8 * BLOCK_SIZE))
+
+
+class JobCounts(Mapping):
+    """Job counts per (user, machine type, status), held in one flat integer array.
+
+    Owners get an integer id the first time they're seen, and a fixed-size block of counters laid out as
+    [machine type][status], so counting a job is one dict lookup and one array increment. Totals are
+    strided sums over the array rather than walks over nested dicts.
+
+    As a Mapping it also provides the user -> {"CPU": {...}, "GPU": {...}, "Total": {...}} view of the
+    non-zero counts that format_table and friends work with.
+    """
+
+    def __init__(self):
+        self.users: list[str] = []
+        self._ids: dict[str, int] = {}
+        self._counts = array("q")
+
+    @classmethod
+    def from_user_stats(cls, user_stats: Mapping) -> "JobCounts":
+        """Build the counts from the nested user -> machine type -> status -> count view"""
+        if isinstance(user_stats, JobCounts):
+            return user_stats
+        counts = cls()
+        for user, stats in user_stats.items():
+            for machine_type in MACHINE_TYPES:
+                for status, count in stats.get(machine_type, {}).items():
+                    counts.add(
+                        user, MACHINE_TYPE_INDEX[machine_type], STATUS_NAME_INDEX.get(status, UNKNOWN_STATUS), count
+                    )
+        return counts
+
+    @classmethod
+    def from_columns(cls, users: list[str], counts: Iterable[int]) -> "JobCounts":
+        """Build the counts from a list of users and their blocks of counters, as given by columns()"""
+        job_counts = cls()
+        job_counts.users = list(users)
+        job_counts._ids = {user: i for i, user in enumerate(job_counts.users)}
+        job_counts._counts = array("q", counts)
+        if len(job_counts._counts) != BLOCK_SIZE * len(job_counts.users):
+            raise ValueError("Number of counters doesn't match the number of users")
+        return job_counts
+
+    def columns(self) -> tuple[list[str], array]:
+        """Get the users, in id order, and the flat array of their counters"""
+        return list(self.users), array("q", self._counts)
+
+    def select(self, machine_type: Optional[str]) -> "JobCounts":
+        """Get the counts for one machine type only, dropping users with no jobs on it"""
+        if not machine_type:
+            return self
+        m = MACHINE_TYPE_INDEX[machine_type.upper()]
+        selected = JobCounts()
+        for user in self.users:
+            block = self.block(user)[m * len(STATUSES) : (m + 1) * len(STATUSES)]
+            for status, count in enumerate(block):
+                if count:
+                    selected.add(user, m, status, count)
+        return selected
+
+    def _offset(self, user: str) -> int:
+        """Get the start of a user's block of counters, adding the user if they're new"""
+        user_id = self._ids.get(user)
+        if user_id is None:
+            user_id = self._ids[user] = len(self.users)
+            self.users.append(user)
+            self._counts.extend(_EMPTY_BLOCK)
+        return user_id * BLOCK_SIZE
+
+    def add(self, user: str, machine_type: int, status: int, count: int = 1):
+        """Count jobs for a user, with the machine type and status given as indices"""
+        self._counts[self._offset(user) + machine_type * len(STATUSES) + status] += count
+
+    def add_job(self, owner: str, machine_type: str, job_status: Optional[int]):
+        """Count one job, given its machine type name and JobStatus code"""
+        self.add(owner, MACHINE_TYPE_INDEX[machine_type], STATUS_INDEX.get(job_status, UNKNOWN_STATUS))
+
+    def merge(self, other: "JobCounts") -> "JobCounts":
+        """Add the counts from another set of counts to these"""
+        for user in other.users:
+            offset = self._offset(user)
+            other_offset = other._ids[user] * BLOCK_SIZE
+            for i in range(BLOCK_SIZE):
+                self._counts[offset + i] += other._counts[other_offset + i]
+        return self
+
+    def block(self, user: str) -> array:
+        """Get a copy of a user's counters, laid out as [machine type][status]"""
+        offset = self._ids[user] * BLOCK_SIZE
+        return self._counts[offset : offset + BLOCK_SIZE]
+
+    def column_total(self, machine_type: int, status: int) -> int:
+        """Total number of jobs over all users with the given machine type and status indices"""
+        return sum(self._counts[machine_type * len(STATUSES) + status :: BLOCK_SIZE])
+
+    def machine_type_totals(self, statuses: Iterable[str] = STATUSES) -> dict[str, dict[str, int]]:
+        """Total number of jobs for each machine type and status, plus the "Total" over machine types"""
+        statuses = list(statuses)
+        totals = {
+            machine_type: {status: self.column_total(m, STATUS_NAME_INDEX[status]) for status in statuses}
+            for m, machine_type in enumerate(MACHINE_TYPES)
+        }
+        totals["Total"] = {
+            status: sum(totals[machine_type][status] for machine_type in MACHINE_TYPES) for status in statuses
+        }
+        return totals
+
+    def user_totals(self, statuses: Iterable[str] = STATUSES, machine_type: Optional[str] = None) -> dict[str, int]:
+        """Total number of jobs of each user with the given statuses, on one machine type or all of them"""
+        machine_types = [MACHINE_TYPE_INDEX[machine_type.upper()]] if machine_type else range(len(MACHINE_TYPES))
+        columns = [m * len(STATUSES) + STATUS_NAME_INDEX[status] for m in machine_types for status in statuses]
+        counts = self._counts
+        return {
+            user: sum(counts[offset + column] for column in columns)
+            for user, offset in zip(self.users, range(0, len(counts), BLOCK_SIZE))
+        }
+
+    def total(self, statuses: Iterable[str] = STATUSES) -> int:
+        """Total number of jobs with the given statuses"""
+        return sum(self.machine_type_totals(statuses)["Total"].values())
+
+    def __getitem__(self, user: str) -> dict[str, defaultdict]:
+        block = self.block(user)
+        stats = {}
+        total = defaultdict(int)
+        for m, machine_type in enumerate(MACHINE_TYPES):
+            counts = defaultdict(int)
+            for s, status in enumerate(STATUSES):
+                count = block[m * len(STATUSES) + s]
+                if count:
+                    counts[status] = count
+                    total[status] += count
+            stats[machine_type] = counts
+        stats["Total"] = total
+        return stats
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.users)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def __contains__(self, user) -> bool:
+        return user in self._ids
@@ -0,0 +1,71 @@
+import re
+from collections.abc import Sequence
+from typing import Optional
+
+_ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def _visible_len(text: str) -> int:
+    """Length of a line of text as shown in the terminal, ignoring colour codes"""
+    return len(_ANSI_ESCAPE.sub("", text)) if "\x1b" in text else len(text)
+
+
+def _colour_codes(colour: Optional[str]) -> tuple[str, str]:
+    """Get the escape codes to start and reset a colour, or empty strings if colour is off"""
+    if colour is None:
+        return "", ""
+    import termcolor  # noqa: PLC0415
+
+    start, _, end = termcolor.colored("\0", colour).partition("\0")
+    return start, end
+
+
+class Table:
+    """Left-aligned text table with a rule between every row and cells that can span several lines.
+
+    Looks like a PrettyTable with hrules=ALL, but the column widths are kept up to date as rows are
+    added, so rendering is one pass over the rows, and a row's colour is looked up once for the row
+    rather than for every line of every cell.
+    """
+
+    def __init__(self, field_names: Sequence[str]):
+        self.field_names = list(field_names)
+        self._rows: list[list[str]] = []
+        self._colours: list[Optional[str]] = []
+        self._widths = [len(name) for name in self.field_names]
+
+    def add_row(self, row: Sequence, colour: Optional[str] = None):
+        """Add a row of cells, which may contain newlines, optionally in a colour"""
+        if len(row) != len(self.field_names):
+            raise ValueError(f"Row has {len(row)} cells, but the table has {len(self.field_names)} columns")
+        cells = [str(cell) for cell in row]
+        for i, cell in enumerate(cells):
+            for line in cell.split("\n"):
+                self._widths[i] = max(self._widths[i], _visible_len(line))
+        self._rows.append(cells)
+        self._colours.append(colour)
+
+    def _render_row(self, cells: list[str], colour: Optional[str], out: list[str]):
+        start, end = _colour_codes(colour)
+        cell_lines = [cell.split("\n") for cell in cells]
+        for i in range(max(len(lines) for lines in cell_lines)):
+            line = []
+            for lines, width in zip(cell_lines, self._widths):
+                text = lines[i] if i < len(lines) else ""
+                # Colour the text only, not the padding or dividers
+                padding = " " * (width - _visible_len(text))
+                line.append(f"{start}{text}{end}{padding}" if text else padding)
+            out.append("| " + " | ".join(line) + " |")
+
+    def get_string(self) -> str:
+        rule = "+" + "+".join("-" * (width + 2) for width in self._widths) + "+"
+        out = [rule]
+        self._render_row(self.field_names, None, out)
+        out.append(rule)
+        for cells, colour in zip(self._rows, self._colours):
+            self._render_row(cells, colour, out)
+            out.append(rule)
+        return "\n".join(out)
+
+    def __str__(self) -> str:
+        return self.get_string()
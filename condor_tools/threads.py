@@ -0,0 +1,58 @@
+import queue
+import threading
+import time
+from collections.abc import Callable, Hashable, Mapping
+from typing import Any
+
+
+def run_with_deadline(
+    tasks: Mapping[Hashable, Callable[[], Any]], max_workers: int, timeout: float
+) -> tuple[dict[Hashable, Any], dict[Hashable, BaseException]]:
+    """Run some blocking calls on up to max_workers threads, waiting for them until the timeout.
+
+    The threads are daemon threads, so calls that are still running (e.g. a hung schedd or NSS lookup)
+    when the timeout is reached are left behind rather than joined, and don't hold up the exit of the
+    process. Returns the results of the calls that finished, and the exceptions of those that failed
+    or (as TimeoutError) didn't finish in time.
+    """
+    pending: queue.SimpleQueue = queue.SimpleQueue()
+    done: queue.SimpleQueue = queue.SimpleQueue()
+    for key, task in tasks.items():
+        pending.put((key, task))
+
+    def work():
+        while True:
+            try:
+                key, task = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                done.put((key, task(), None))
+            except BaseException as e:
+                done.put((key, None, e))
+
+    for _ in range(min(max_workers, len(tasks))):
+        threading.Thread(target=work, daemon=True).start()
+
+    deadline = time.monotonic() + timeout
+    results: dict[Hashable, Any] = {}
+    failed: dict[Hashable, BaseException] = {}
+    while len(results) + len(failed) < len(tasks):
+        try:
+            key, result, error = done.get(timeout=max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if error is None:
+            results[key] = result
+        else:
+            failed[key] = error
+    for key in tasks:
+        if key not in results and key not in failed:
+            failed[key] = TimeoutError(f"No answer within {timeout}s")
+    # Calls that haven't started yet won't be, the threads stop once the queue is empty
+    while True:
+        try:
+            pending.get_nowait()
+        except queue.Empty:
+            break
+    return results, failed
@@ -0,0 +1,95 @@
+import contextlib
+import functools
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Returned by span() when timing is off, so a disabled span is a check and a no-op context manager
+_NO_SPAN = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("name", "start", "timings")
+
+    def __init__(self, timings: "Timings", name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.record(self.name, time.perf_counter() - self.start)
+
+
+class Timings:
+    """Named spans around the phases of a run, with their call counts and total durations.
+
+    Spans only cost anything when timing is enabled (with --timings) or debug logging is on for this
+    module. Each finished span is also logged at debug level with its name and duration as extra
+    attributes, so a log handler can pick them up.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._totals: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def reset(self):
+        with self._lock:
+            self._totals = {}
+
+    def span(self, name: str):
+        """Context manager timing a block of code under a name, which may be entered many times"""
+        if not self.enabled and not logger.isEnabledFor(logging.DEBUG):
+            return _NO_SPAN
+        return _Span(self, name)
+
+    def timed(self, name: Optional[str] = None) -> Callable:
+        """Decorator timing every call of a function, under its name unless another is given"""
+
+        def decorator(func):
+            span_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record(self, name: str, duration: float):
+        with self._lock:
+            totals = self._totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += duration
+        logger.debug(f"{name} took {duration * 1000:.1f} ms", extra={"span": name, "duration": duration})
+
+    def totals(self) -> dict[str, tuple[int, float]]:
+        """Get the number of times each span was entered and its total duration in seconds"""
+        with self._lock:
+            return {name: (count, total) for name, (count, total) in self._totals.items()}
+
+    def report(self) -> str:
+        """Compact breakdown of the spans, in the order they were first entered"""
+        totals = self.totals()
+        width = max((len(name) for name in totals), default=0)
+        lines = ["Timings:"]
+        for name, (count, total) in totals.items():
+            lines.append(f"  {name:<{width}}  {count:>6}x  {total * 1000:>10.1f} ms")
+        return "\n".join(lines)
+
+
+timings = Timings()
+span = timings.span
+timed = timings.timed
@@ -0,0 +1,193 @@
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from .cache import SQLITE_TIMEOUT, default_cache_dir
+from .stats import JOB_STATUSES, MACHINE_TYPES, STATUSES, JobCounts
+
+# Raw samples are kept this long, then averaged into one sample per hour
+RAW_RETENTION = 2 * 24 * 60 * 60
+DOWNSAMPLE_SECONDS = 60 * 60
+# Hourly samples are kept this long
+RETENTION = 180 * 24 * 60 * 60
+TREND_POINTS = 48
+
+# Statuses are stored as their JobStatus code, with 0 for jobs in an unknown state
+STATUS_CODES = {**{name: code for code, name in JOB_STATUSES.items()}, "Unknown": 0}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+_STATUS_CODE_BY_INDEX = [STATUS_CODES[status] for status in STATUSES]
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    # One row per sample, so averages know how many samples each hour or bucket had (including ones where a
+    # user had no jobs, which have no counts stored). n is how many raw samples an hourly sample averages
+    "CREATE TABLE IF NOT EXISTS samples ("
+    "time INTEGER PRIMARY KEY, resolution INTEGER NOT NULL, n INTEGER NOT NULL DEFAULT 1)",
+    # Hourly samples hold the average count over the hour, which may be fractional
+    "CREATE TABLE IF NOT EXISTS counts ("
+    "user INTEGER NOT NULL, time INTEGER NOT NULL, machine INTEGER NOT NULL, status INTEGER NOT NULL, "
+    "count INTEGER NOT NULL, PRIMARY KEY (user, time, machine, status)) WITHOUT ROWID",
+    "CREATE INDEX IF NOT EXISTS counts_time ON counts (time)",
+)
+
+
+def default_store_path() -> str:
+    return os.environ.get("CONDOR_STAT_TRENDS") or os.path.join(default_cache_dir(), "trends.sqlite")
+
+
+class TrendStore:
+    """Append-only store of the job counts of every recorded run, for looking at trends over time.
+
+    Each sample is the non-zero counts per user, machine type and status, with users stored once in
+    their own table and referred to by id, and machine types and statuses stored as small integers.
+    Counts are keyed by user and time so one user's trend is a range scan, and indexed by time for
+    the trend of everyone. Samples older than RAW_RETENTION are averaged into hourly samples, and
+    those older than RETENTION are dropped, so months of one minute samples stay small.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_store_path()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._user_ids: dict[str, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), mode=0o700, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            # WAL so a long trend query doesn't block the next sample being recorded. On filesystems that
+            # can't do WAL (e.g. NFS), sqlite keeps its rollback journal
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(samples)")]
+            if "n" not in columns:
+                # Stores from before samples had n. How many raw samples their hourly samples averaged wasn't
+                # kept, so they count as one
+                self._conn.execute("ALTER TABLE samples ADD COLUMN n INTEGER NOT NULL DEFAULT 1")
+        return self._conn
+
+    def _ids(self, conn: sqlite3.Connection, users: list[str]) -> list[int]:
+        new = [user for user in users if user not in self._user_ids]
+        if new:
+            conn.executemany("INSERT OR IGNORE INTO users (name) VALUES (?)", [(user,) for user in new])
+            for i in range(0, len(new), 500):
+                chunk = new[i : i + 500]
+                rows = conn.execute(f"SELECT name, id FROM users WHERE name IN ({','.join('?' * len(chunk))})", chunk)
+                self._user_ids.update(rows)
+        return [self._user_ids[user] for user in users]
+
+    def record(self, counts: JobCounts, now: Optional[float] = None):
+        """Append a sample of the job counts, then downsample and drop old samples"""
+        now = int(time.time() if now is None else now)
+        users, flat = counts.columns()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = self._ids(conn, users)
+            rows = []
+            width = len(STATUSES)
+            for user_id, offset in zip(ids, range(0, len(flat), width * len(MACHINE_TYPES))):
+                for i in range(width * len(MACHINE_TYPES)):
+                    count = flat[offset + i]
+                    if count:
+                        rows.append((user_id, now, i // width, _STATUS_CODE_BY_INDEX[i % width], count))
+            conn.execute("INSERT OR REPLACE INTO samples VALUES (?, 0, 1)", (now,))
+            conn.executemany("INSERT OR REPLACE INTO counts VALUES (?, ?, ?, ?, ?)", rows)
+            self._compact(conn, now)
+
+    def _compact(self, conn: sqlite3.Connection, now: int):
+        """Average raw samples older than RAW_RETENTION into hourly ones, and drop samples older than RETENTION"""
+        cutoff = (now - RAW_RETENTION) // DOWNSAMPLE_SECONDS * DOWNSAMPLE_SECONDS
+        (old,) = conn.execute("SELECT COUNT(*) FROM samples WHERE resolution = 0 AND time < ?", (cutoff,)).fetchone()
+        if old:
+            step = DOWNSAMPLE_SECONDS
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS hours (hour INTEGER PRIMARY KEY, n INTEGER NOT NULL)")
+            conn.execute("DELETE FROM temp.hours")
+            conn.execute(
+                "INSERT INTO temp.hours SELECT time / ? * ?, COUNT(*) FROM samples "
+                "WHERE resolution = 0 AND time < ? GROUP BY time / ?",
+                (step, step, cutoff, step),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO counts SELECT user, hour, machine, status, "
+                "SUM(count) * 1.0 / n FROM counts JOIN temp.hours ON time / ? * ? = hour "
+                "WHERE time < ? AND time IN (SELECT time FROM samples WHERE resolution = 0) "
+                "GROUP BY user, hour, machine, status",
+                (step, step, cutoff),
+            )
+            conn.execute(
+                "DELETE FROM counts WHERE time < ? AND time IN (SELECT time FROM samples WHERE resolution = 0) "
+                "AND time NOT IN (SELECT hour FROM temp.hours)",
+                (cutoff,),
+            )
+            conn.execute("DELETE FROM samples WHERE resolution = 0 AND time < ?", (cutoff,))
+            conn.execute("INSERT OR REPLACE INTO samples SELECT hour, ?, n FROM temp.hours", (step,))
+        conn.execute("DELETE FROM counts WHERE time < ?", (now - RETENTION,))
+        conn.execute("DELETE FROM samples WHERE time < ?", (now - RETENTION,))
+
+    def trend(
+        self,
+        user: Optional[str],
+        since: float,
+        until: Optional[float] = None,
+        points: int = TREND_POINTS,
+    ) -> list[tuple[int, dict[tuple[str, str], float]]]:
+        """Get the average job counts of a user (or everyone, if None) in up to `points` buckets of time.
+
+        Returns (bucket start, {(machine type, status): average count}) for each bucket with samples, or
+        nothing if the user has never been recorded. Hourly samples are weighted by the number of raw
+        samples they average, so a bucket with both is the average over all the raw samples.
+        """
+        until = time.time() if until is None else until
+        step = max(int((until - since) // points) + 1, 1)
+        since, until = int(since), int(until)
+        conn = self._connect()
+        user_id = None
+        if user is not None:
+            row = conn.execute("SELECT id FROM users WHERE name = ?", (user,)).fetchone()
+            if row is None:
+                return []
+            (user_id,) = row
+        samples = dict(
+            conn.execute(
+                "SELECT (time - ?) / ?, SUM(n) FROM samples WHERE time >= ? AND time <= ? GROUP BY 1",
+                (since, step, since, until),
+            )
+        )
+        if user is None:
+            rows = conn.execute(
+                "SELECT (time - ?) / ?, machine, status, SUM(count * n) FROM counts JOIN samples USING (time) "
+                "WHERE time >= ? AND time <= ? GROUP BY 1, 2, 3",
+                (since, step, since, until),
+            )
+        else:
+            rows = conn.execute(
+                "SELECT (time - ?) / ?, machine, status, SUM(count * n) FROM counts JOIN samples USING (time) "
+                "WHERE user = ? AND time >= ? AND time <= ? GROUP BY 1, 2, 3",
+                (since, step, user_id, since, until),
+            )
+        buckets: dict[int, dict[tuple[str, str], float]] = {bucket: {} for bucket in sorted(samples)}
+        for bucket, machine, status, total in rows:
+            n = samples.get(bucket)
+            if n:
+                buckets[bucket][(MACHINE_TYPES[machine], STATUS_NAMES.get(status, "Unknown"))] = total / n
+        return [(since + bucket * step, averages) for bucket, averages in buckets.items()]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def record_stats(counts: JobCounts, path: Optional[str] = None):
+    """Append a sample to the trend store, logging rather than failing if it can't be written"""
+    store = TrendStore(path)
+    try:
+        store.record(counts)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning(f"Could not record the job counts to {store.path}: {e}")
+    finally:
+        store.close()
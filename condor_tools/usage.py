@@ -0,0 +1,111 @@
+import errno
+import fcntl
+import logging
+import os
+import time
+from typing import Optional
+
+from .cache import default_cache_dir
+
+USAGE_LOG_MAX_BYTES = 10 * 1024 * 1024
+USAGE_LOCK_TIMEOUT = 1.0
+_LOCK_RETRY = 0.01
+
+
+def default_spool_path() -> str:
+    return os.path.join(default_cache_dir(), "usage_spool.txt")
+
+
+def _lock(fd: int, timeout: float):
+    """Take an exclusive lock on a file, giving up with BlockingIOError after the timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            # POSIX record locks rather than flock, as they also work across NFS clients
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN) or time.monotonic() >= deadline:
+                raise BlockingIOError(errno.EAGAIN, "Usage log is locked") from e
+            time.sleep(_LOCK_RETRY)
+
+
+def _open_locked(path: str, timeout: float) -> int:
+    """Open a file for appending and lock it, reopening it if another writer rotated it while waiting for the lock"""
+    deadline = time.monotonic() + timeout
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            _lock(fd, max(deadline - time.monotonic(), 0))
+            opened = os.fstat(fd)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                current = None
+        except BaseException:
+            os.close(fd)
+            raise
+        if current is not None and (current.st_dev, current.st_ino) == (opened.st_dev, opened.st_ino):
+            return fd
+        # The lock is on what's now path.1, so try again with the new file
+        os.close(fd)
+
+
+def append_lines(path: str, data: bytes, max_bytes: int, timeout: float):
+    """Append whole lines to a shared log under a lock, first rotating it to path.1 if it would get too big"""
+    fd = _open_locked(path, timeout)
+    try:
+        size = os.fstat(fd).st_size
+        if size and size + len(data) > max_bytes:
+            # Anyone waiting on the lock of the old file will see it has moved once they get the lock, and
+            # reopen path rather than writing to (or rotating over) path.1
+            os.replace(path, f"{path}.1")
+            os.close(fd)
+            fd = _open_locked(path, timeout)
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+
+
+def _take_spool(spool_path: str) -> bytes:
+    """Take the lines spooled so far, moving the spool out of the way first so no other run sends them too"""
+    taken = f"{spool_path}.{os.getpid()}"
+    try:
+        os.rename(spool_path, taken)
+    except OSError:
+        return b""
+    try:
+        with open(taken, "rb") as f:
+            return f.read()
+    finally:
+        os.unlink(taken)
+
+
+def _spool(spool_path: str, data: bytes):
+    try:
+        os.makedirs(os.path.dirname(spool_path), mode=0o700, exist_ok=True)
+        with open(spool_path, "ab") as f:
+            f.write(data)
+    except OSError as e:
+        logging.debug(f"Could not spool usage log lines to {spool_path}: {e}")
+
+
+def write_usage(
+    line: str,
+    path: str,
+    spool_path: Optional[str] = None,
+    max_bytes: int = USAGE_LOG_MAX_BYTES,
+    timeout: float = USAGE_LOCK_TIMEOUT,
+):
+    """Append a line to the shared usage log, along with any lines spooled by earlier runs.
+
+    If the log can't be written (e.g. NFS is slow to give up the lock, or is unavailable), the lines are
+    spooled locally instead and written in a batch by a later run.
+    """
+    spool_path = spool_path or default_spool_path()
+    data = _take_spool(spool_path) + line.encode() + b"\n"
+    try:
+        append_lines(path, data, max_bytes, timeout)
+    except OSError as e:
+        logging.debug(f"Could not write usage log {path}, spooling to {spool_path}: {e}")
+        _spool(spool_path, data)
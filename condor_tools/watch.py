@@ -0,0 +1,109 @@
+import argparse
+import datetime
+import shutil
+import time
+from typing import Optional, TextIO
+
+from . import condor_tools
+from .cache import DiskCache
+
+
+class Screen:
+    """Draws successive frames of text, only rewriting the terminal lines that changed since the last frame.
+
+    Frames are clipped to the height of the terminal, as lines written past the bottom would scroll the
+    screen and leave the positions of the earlier lines out of step with what's on it.
+    """
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lines: Optional[list[str]] = None
+        self._height: Optional[int] = None
+
+    def draw(self, text: str):
+        lines = text.split("\n")
+        if not self.stream.isatty():
+            # Nothing to redraw in place (e.g. a pipe or file), so just write each frame in full
+            self.stream.write(text + "\n")
+            self.stream.flush()
+            return
+
+        # Leave the bottom line for the cursor, so the last line of the frame doesn't scroll the screen
+        height = max(shutil.get_terminal_size().lines - 1, 1)
+        lines = lines[:height]
+        if self._lines is None or height != self._height:
+            self.stream.write("\x1b[2J\x1b[H" + "\n".join(lines) + "\n")
+        else:
+            # Move to each changed line, rewrite it and clear whatever was left over from the old line
+            out = [f"\x1b[{i + 1};1H{line}\x1b[K" for i, line in enumerate(lines) if line != self._get_line(i)]
+            if len(lines) < len(self._lines):
+                out.append(f"\x1b[{len(lines) + 1};1H\x1b[J")
+            out.append(f"\x1b[{len(lines) + 1};1H")
+            self.stream.write("".join(out))
+        self.stream.flush()
+        self._lines = lines
+        self._height = height
+
+    def _get_line(self, i: int) -> Optional[str]:
+        return self._lines[i] if i < len(self._lines) else None
+
+
+def watch(
+    args: argparse.Namespace,
+    identities: condor_tools.IdentityIndex,
+    current_user: str,
+    stream: Optional[TextIO] = None,
+    refreshes: Optional[int] = None,
+):
+    """Refresh the job stats table every args.watch seconds from one long-running process.
+
+    The collector and schedd handles, machine classifier, resolved identities and cached priorities are kept
+    between refreshes (the classifier is rebuilt every MACHINE_TTL seconds), so each refresh costs a schedd
+    query plus redrawing the lines of the table that changed. Counts that changed since the previous refresh
+    are annotated with the difference.
+    """
+    screen = Screen(stream or condor_tools.handler.stream)
+    collector, schedd = condor_tools._setup_condor()
+    priority_cache = DiskCache("priorities", ttl=condor_tools.PRIORITY_TTL)
+    machine_cache = DiskCache("machines", ttl=condor_tools.MACHINE_TTL)
+    condor_tools.log(args, condor_tools._own_name(identities, current_user))
+
+    classifier = None
+    classifier_loaded = 0.0
+    previous = None
+    done = 0
+    try:
+        while True:
+            started = time.monotonic()
+            if classifier is None or started - classifier_loaded > condor_tools.MACHINE_TTL:
+                classifier = condor_tools.load_classifier(collector, machine_cache)
+                classifier_loaded = started
+            user_stats = condor_tools._fetch_user_stats(args, collector, schedd, classifier)
+            user_priorities = condor_tools.get_user_priorities(collector, priority_cache) if args.priority else {}
+
+            header = f"Every {args.watch:g}s: condor_stat.py    {datetime.datetime.now():%Y-%m-%d %H:%M:%S}"
+            if user_stats:
+                table = condor_tools.format_table(
+                    user_stats,
+                    args.only,
+                    user_priorities,
+                    current_user=current_user,
+                    priority=args.priority,
+                    identities=identities,
+                    previous=previous,
+                    sort_by=args.sort,
+                    top=args.top,
+                )
+            else:
+                table = "No jobs found in current schedd."
+            screen.draw(f"{header}\n\n{table}")
+            previous = user_stats
+
+            done += 1
+            if refreshes is not None and done >= refreshes:
+                break
+            time.sleep(max(args.watch - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        identities.save()
@@ -0,0 +1,146 @@
+import csv
+import json
+from collections.abc import Callable, Iterator, Mapping
+from typing import Optional, TextIO
+
+from .stats import MACHINE_TYPES, STATUS_NAME_INDEX, STATUSES, JobCounts
+
+FORMATS = ["table", "json", "ndjson", "csv", "prometheus"]
+
+# Writers for machine consumers, which stream one user at a time straight from the counts. Unlike the
+# table there's no colouring or highlighting, and nothing is built up for all the users at once
+
+
+def _machine_types(only: Optional[str]) -> list[str]:
+    return [only.upper()] if only else [*MACHINE_TYPES, "Total"]
+
+
+def _block_counts(block, machine_types: list[str], statuses: list[str]) -> dict[str, dict[str, int]]:
+    """Get the counts of each status (plus their total) per machine type from a user's block of counters"""
+    counts = {}
+    for m, machine_type in enumerate(MACHINE_TYPES):
+        offset = m * len(STATUSES)
+        counts[machine_type] = {status: block[offset + STATUS_NAME_INDEX[status]] for status in statuses}
+    counts["Total"] = {status: sum(counts[m][status] for m in MACHINE_TYPES) for status in statuses}
+    for stats in counts.values():
+        stats["Total"] = sum(stats.values())
+    return {machine_type: counts[machine_type] for machine_type in machine_types}
+
+
+def _records(  # noqa: PLR0913
+    counts: JobCounts,
+    users: list[str],
+    statuses: list[str],
+    only: Optional[str],
+    user_priorities: dict[str, float],
+    priority: bool,
+    identities,
+) -> Iterator[dict]:
+    machine_types = _machine_types(only)
+    for user in users:
+        record = {"user": user}
+        if identities is not None:
+            record["name"] = identities.real_name(user)
+            record["experiments"] = identities.experiments(user)
+        if priority:
+            record["priority"] = user_priorities.get(user, -1)
+        record.update(_block_counts(counts.block(user), machine_types, statuses))
+        yield record
+
+
+def _write_json(stream: TextIO, records: Iterator[dict], totals: dict):
+    stream.write('{"users": [')
+    for i, record in enumerate(records):
+        stream.write(("," if i else "") + "\n" + json.dumps(record))
+    stream.write(f'\n], "totals": {json.dumps(totals)}}}\n')
+
+
+def _write_ndjson(stream: TextIO, records: Iterator[dict]):
+    for record in records:
+        stream.write(json.dumps(record) + "\n")
+
+
+def _write_csv(stream: TextIO, records: Iterator[dict], header: list[str], machine_types: list[str]):
+    writer = csv.writer(stream)
+    writer.writerow(header)
+    for record in records:
+        row = [record["user"], record.get("name", ""), ";".join(record.get("experiments", []))]
+        if "priority" in record:
+            row.append(record["priority"])
+        for machine_type in machine_types:
+            row.extend(record[machine_type].values())
+        writer.writerow(row)
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_prometheus(stream: TextIO, records: Callable[[], Iterator[dict]], statuses: list[str], priority: bool):
+    stream.write("# HELP condor_jobs Number of jobs per user, machine type and status\n")
+    stream.write("# TYPE condor_jobs gauge\n")
+    for record in records():
+        user = _label(record["user"])
+        for machine_type in MACHINE_TYPES:
+            if machine_type not in record:
+                continue
+            for status in statuses:
+                stream.write(
+                    f'condor_jobs{{user="{user}",machine_type="{machine_type}",status="{status}"}} '
+                    f"{record[machine_type][status]}\n"
+                )
+    if priority:
+        # The samples of a metric have to be together, so the priorities are a second pass over the users
+        stream.write("# HELP condor_user_priority Effective priority of each user\n")
+        stream.write("# TYPE condor_user_priority gauge\n")
+        for record in records():
+            stream.write(f'condor_user_priority{{user="{_label(record["user"])}"}} {record["priority"]}\n')
+
+
+def write_stats(  # noqa: PLR0913
+    output_format: str,
+    user_stats: Mapping,
+    stream: TextIO,
+    statuses: list[str],
+    only: Optional[str] = None,
+    user_priorities: Optional[dict[str, float]] = None,
+    priority: bool = False,
+    identities=None,
+    users: Optional[list[str]] = None,
+):
+    """Write the job stats in one of the machine-readable formats.
+
+    Each user's record has their name and experiments (if an IdentityIndex is given), priority (if
+    wanted) and the count of jobs in each status, plus their total, for each machine type. If users is
+    given, only those users are written, in that order (e.g. the top N), but the totals cover everyone.
+    """
+    counts = JobCounts.from_user_stats(user_stats)
+    users = counts.users if users is None else users
+    user_priorities = user_priorities or {}
+    machine_types = _machine_types(only)
+    if output_format == "prometheus":
+        # Names aren't useful as labels, so the identities aren't needed
+        _write_prometheus(
+            stream,
+            lambda: _records(counts, users, statuses, only, user_priorities, priority, None),
+            statuses,
+            priority,
+        )
+        return
+
+    if identities is not None:
+        identities.resolve(users)
+    records = _records(counts, users, statuses, only, user_priorities, priority, identities)
+    if output_format == "json":
+        totals = counts.machine_type_totals(statuses)
+        for stats in totals.values():
+            stats["Total"] = sum(stats.values())
+        _write_json(stream, records, {machine_type: totals[machine_type] for machine_type in machine_types})
+    elif output_format == "ndjson":
+        _write_ndjson(stream, records)
+    elif output_format == "csv":
+        header = ["user", "name", "experiments"] + ["priority"] * priority
+        header += [f"{m}_{status}" for m in machine_types for status in [*statuses, "Total"]]
+        _write_csv(stream, records, header, machine_types)
+    else:
+        raise ValueError(f"Unknown output format {output_format!r}")
@@ -0,0 +1,23 @@
+import pytest
+
+from ..condor_tools.timing import timings
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """
+    Keep on-disk caches and the usage log out of the real home and source directories.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("CONDOR_STAT_USAGE_LOG", str(tmp_path / "usage_log.txt"))
+
+
+@pytest.fixture(autouse=True)
+def isolated_timings(monkeypatch):
+    """
+    Start every test with timing off and no spans recorded.
+    """
+    monkeypatch.setattr(timings, "enabled", False)
+    timings.reset()
+    yield
+    timings.reset()
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+
+import htcondor2
+import pytest
+
+from ..condor_tools import api
+from ..condor_tools.api import PoolStats, StatsResult, UserStats
+from .test_htcondor import TEST_JOBS
+
+
+def _schedd(mocker, jobs=TEST_JOBS):
+    def query(constraint="True", projection=(), callback=None, opts=None):
+        for job in jobs:
+            callback(job)
+        return []
+
+    schedd = mocker.Mock()
+    schedd.query.side_effect = query
+    return schedd
+
+
+@pytest.fixture
+def identities(monkeypatch):
+    monkeypatch.setattr(api.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    monkeypatch.setattr(api.IdentityIndex, "prefetch", lambda self: None)
+    monkeypatch.setattr(api.IdentityIndex, "real_name", lambda self, user: user.title())
+    monkeypatch.setattr(api.IdentityIndex, "experiments", lambda self, user: ["cms"])
+
+
+@pytest.fixture
+def collector(mocker):
+    collector = mocker.Mock()
+    collector.query.return_value = []
+    return collector
+
+
+class TestPoolStats:
+    def test_stats(self, mocker, identities, collector):
+        mocker.patch.object(api, "get_user_priorities", return_value={"test_user1": 2.5})
+
+        async def run():
+            async with PoolStats(collector=collector, schedd=_schedd(mocker)) as stats:
+                return await stats.stats()
+
+        result = asyncio.run(run())
+        assert isinstance(result, StatsResult)
+        assert [user.user for user in result.users] == ["test_user0", "test_user1"]
+        user = result.get("test_user1")
+        assert isinstance(user, UserStats)
+        assert (user.name, user.experiments, user.priority) == ("Test_User1", ["cms"], 2.5)
+        assert user.jobs["GPU"] == {"Idle": 1, "Running": 1}
+        assert user.total() == 2  # noqa: PLR2004
+        assert result.totals["Total"]["Held"] == 2  # noqa: PLR2004
+        assert result.failed == []
+        assert result.to_dict()["users"][1]["priority"] == 2.5  # noqa: PLR2004
+        assert result.get("nobody") is None
+
+    def test_slotted(self):
+        user = UserStats("alice", "Alice", ["cms"], None, {})
+        with pytest.raises(AttributeError):
+            user.extra = 1
+        assert not hasattr(StatsResult([], {}, [], 0.0), "__dict__")
+
+    def test_reuses_classifier_and_handles(self, mocker, identities, collector):
+        schedd = _schedd(mocker)
+        load_classifier = mocker.spy(api, "load_classifier")
+
+        async def run():
+            async with PoolStats(collector=collector, schedd=schedd) as stats:
+                await stats.stats(priorities=False)
+                await stats.stats(priorities=False)
+
+        asyncio.run(run())
+        load_classifier.assert_called_once_with(collector)
+        assert schedd.query.call_count == 2  # noqa: PLR2004
+
+    def test_pool_concurrent(self, mocker, identities, collector):
+        delay = 0.2
+        collector.locateAll.return_value = [{"Name": f"schedd{i}", "MyAddress": f"<{i}>"} for i in range(3)]
+
+        def slow_schedd(ad):
+            schedd = _schedd(mocker)
+            query = schedd.query.side_effect
+
+            def slow_query(*args, **kwargs):
+                if ad["Name"] == "schedd2":
+                    raise RuntimeError("schedd down")
+                time.sleep(delay)
+                return query(*args, **kwargs)
+
+            schedd.query.side_effect = slow_query
+            return schedd
+
+        make_schedd = mocker.patch.object(htcondor2, "Schedd", side_effect=slow_schedd)
+
+        async def run():
+            async with PoolStats(pool=True, collector=collector) as stats:
+                first = await stats.jobs()
+                await stats.jobs()
+                return first
+
+        start = time.monotonic()
+        counts, failed = asyncio.run(run())
+        assert counts.total(["Running"]) == 2 * 2
+        assert failed == ["schedd2"]
+        # The schedds are queried at the same time (two calls of one query each, rather than four queries
+        # in turn), and their handles are kept between calls
+        assert time.monotonic() - start < 3 * delay
+        assert make_schedd.call_count == 3  # noqa: PLR2004
+
+    def test_pool_timeout_per_schedd(self, mocker, identities, collector):
+        """Each schedd's timeout starts with its own query, however few workers there are, and a schedd
+        that hangs is left behind"""
+        delay = 0.2
+        collector.locateAll.return_value = [{"Name": f"schedd{i}", "MyAddress": f"<{i}>"} for i in range(4)]
+        hang = threading.Event()
+
+        def slow_schedd(ad):
+            schedd = _schedd(mocker)
+            query = schedd.query.side_effect
+
+            def slow_query(*args, **kwargs):
+                if ad["Name"] == "schedd3":
+                    hang.wait(10)
+                time.sleep(delay)
+                return query(*args, **kwargs)
+
+            schedd.query.side_effect = slow_query
+            return schedd
+
+        mocker.patch.object(htcondor2, "Schedd", side_effect=slow_schedd)
+
+        async def run():
+            async with PoolStats(pool=True, collector=collector, max_workers=1, schedd_timeout=2.5 * delay) as stats:
+                return await stats.jobs()
+
+        start = time.monotonic()
+        try:
+            counts, failed = asyncio.run(run())
+        finally:
+            hang.set()
+        assert counts.total(["Running"]) == 3 * 2
+        assert failed == ["schedd3"]
+        assert time.monotonic() - start < 5 * delay
+
+    def test_totals(self, mocker, collector):
+        fetch_totals = mocker.patch.object(
+            api, "fetch_totals", return_value={"CPU": {"Idle": 1}, "GPU": {"Idle": 2}, "Total": {"Idle": 3}}
+        )
+
+        async def run():
+            async with PoolStats(collector=collector, schedd="schedd") as stats:
+                return await stats.totals()
+
+        totals, failed = asyncio.run(run())
+        assert totals["Total"] == {"Idle": 3}
+        assert fetch_totals.call_args.args[0] == "schedd"
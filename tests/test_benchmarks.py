@@ -0,0 +1,56 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from ..benchmarks.bench import STAGES, SyntheticSchedd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestSyntheticSchedd:
+    def test_queue_shape(self):
+        n_jobs = 20000
+        jobs = SyntheticSchedd(n_jobs, n_owners=100, seed=1).query()
+        assert len(jobs) == n_jobs
+        owners = Counter(job["Owner"] for job in jobs).most_common()
+        # A few users have most of the jobs
+        assert owners[0][1] > 10 * owners[-1][1]
+        statuses = Counter(job["JobStatus"] for job in jobs)
+        assert statuses[2] > statuses[1] > statuses[5] > 0
+        assert all(("RemoteHost" in job) == (job["JobStatus"] == 2) for job in jobs)  # noqa: PLR2004
+        assert 0 < sum(job["RequestGPUs"] for job in jobs) < n_jobs / 2
+
+    def test_deterministic(self):
+        assert SyntheticSchedd(500, seed=3).query() == SyntheticSchedd(500, seed=3).query()
+
+    def test_query_callback_and_constraint(self):
+        schedd = SyntheticSchedd(500)
+        seen = []
+        assert schedd.query(callback=seen.append) == []
+        assert len(seen) == len(schedd)
+        held = schedd.query(constraint="JobStatus == 5")
+        assert held
+        assert all(job["JobStatus"] == 5 for job in held)  # noqa: PLR2004
+
+
+def test_benchmark_runs(tmp_path):
+    """A tiny run of the whole suite, so it doesn't rot"""
+    output = tmp_path / "bench.json"
+    args = ["--sizes", "300", "--repeat", "1", "--latency", "0", "--output", str(output)]
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench", *args],
+        cwd=REPO_DIR,
+        env={**os.environ, "XDG_CACHE_HOME": str(tmp_path / "cache")},
+        check=True,
+        capture_output=True,
+    )
+    results = json.loads(output.read_text())
+    assert [result["stage"] for result in results["results"]] == STAGES
+    for result in results["results"]:
+        assert result["jobs"] == 300  # noqa: PLR2004
+        assert result["wall_time_s"] > 0
+        assert result["peak_memory_bytes"] > 0
+    main = results["results"][-1]
+    assert main["subprocess_calls"] > 0
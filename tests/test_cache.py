@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ..condor_tools.cache import DiskCache, default_cache_dir
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache.sqlite")
+
+
+class TestDiskCache:
+    def test_round_trip(self, cache_path):
+        DiskCache("test", ttl=60, path=cache_path).update({"alice": ["Alice", ["cms"]], "bob": 1.5})
+
+        cache = DiskCache("test", ttl=60, path=cache_path)
+        assert cache.load() == {"alice": ["Alice", ["cms"]], "bob": 1.5}
+        assert cache.get("alice") == ["Alice", ["cms"]]
+        assert cache.get("carol") is None
+
+    def test_namespaces_are_separate(self, cache_path):
+        DiskCache("a", ttl=60, path=cache_path).update({"key": 1})
+        DiskCache("b", ttl=60, path=cache_path).update({"key": 2})
+        assert DiskCache("a", ttl=60, path=cache_path).load() == {"key": 1}
+        DiskCache("b", ttl=60, path=cache_path).clear()
+        assert DiskCache("a", ttl=60, path=cache_path).load() == {"key": 1}
+        assert DiskCache("b", ttl=60, path=cache_path).load() == {}
+
+    def test_expired_entries_are_ignored(self, cache_path, monkeypatch):
+        DiskCache("test", ttl=60, path=cache_path).update({"old": 1})
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 120)
+        cache = DiskCache("test", ttl=60, path=cache_path)
+        assert cache.load() == {}
+        assert cache.get("old") is None
+
+    def test_least_recently_used_evicted(self, cache_path, monkeypatch):
+        now = time.time()
+        cache = DiskCache("test", ttl=60, max_entries=2, path=cache_path)
+        monkeypatch.setattr(time, "time", lambda: now)
+        cache.update({"a": 1, "b": 2})
+        monkeypatch.setattr(time, "time", lambda: now + 1)
+        cache.update({}, touched=["a"])
+        monkeypatch.setattr(time, "time", lambda: now + 2)
+        cache.update({"c": 3})
+        assert cache.load() == {"a": 1, "c": 3}
+
+    def test_used_across_threads(self, cache_path):
+        cache = DiskCache("test", ttl=60, path=cache_path)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(cache.load).result() == {}
+        cache.update({"a": 1})
+        assert DiskCache("test", ttl=60, path=cache_path).load() == {"a": 1}
+
+    def test_unusable_path(self, tmp_path):
+        blocker = tmp_path / "file"
+        blocker.write_text("")
+        cache = DiskCache("test", ttl=60, path=str(blocker / "cache.sqlite"))
+        cache.update({"a": 1})
+        cache.clear()
+        assert cache.load() == {}
+        assert cache.get("a") is None
+
+    def test_default_cache_dir(self, monkeypatch):
+        monkeypatch.setenv("XDG_CACHE_HOME", "/xdg")
+        assert default_cache_dir() == "/xdg/condor_tools"
+        monkeypatch.delenv("XDG_CACHE_HOME")
+        monkeypatch.setenv("HOME", "/home/user")
+        assert default_cache_dir() == "/home/user/.cache/condor_tools"
@@ -0,0 +1,77 @@
+import htcondor2
+import pytest
+
+from ..condor_tools import classifier as classifier_module
+from ..condor_tools.cache import DiskCache
+from ..condor_tools.classifier import STARTD_PROJECTION, MachineClassifier
+
+STARTD_ADS = [
+    {"Machine": "wn01.example.com", "TotalGPUs": 0},
+    {"Machine": "wn02.example.com", "TotalGPUs": 4, "GPUs": 0},
+    {"Machine": "WN02.example.com", "GPUs": 1},
+    {"Machine": "lxgpu07.example.com"},
+    {"Machine": "wn03.example.com", "GPUs": 2},
+    {"TotalGPUs": 1},
+]
+
+
+@pytest.fixture
+def classifier():
+    return MachineClassifier.from_startd_ads(STARTD_ADS)
+
+
+class TestMachineClassifier:
+    def test_from_startd_ads(self, classifier):
+        assert classifier.machine_types == {
+            "wn01.example.com": "CPU",
+            "wn02.example.com": "GPU",
+            "lxgpu07.example.com": "CPU",
+            "wn03.example.com": "GPU",
+        }
+
+    @pytest.mark.parametrize(
+        ("job", "machine_type"),
+        [
+            ({"RemoteHost": "slot1_3@wn02.example.com"}, "GPU"),
+            ({"RemoteHost": "slot1@wn01.example.com", "RequestGPUs": 1}, "CPU"),
+            ({"RemoteHost": "slot1@lxgpu07.example.com"}, "CPU"),
+            ({"RemoteHost": "slot1@newgpu.example.com"}, "GPU"),
+            ({"RemoteHost": "slot1@new.example.com"}, "CPU"),
+            ({"RequestGPUs": 2}, "GPU"),
+            ({"RequestGPUs": 0}, "CPU"),
+            ({}, "CPU"),
+        ],
+    )
+    def test_classify(self, classifier, job, machine_type):
+        assert classifier.classify(job) == machine_type
+
+    def test_heuristic_without_index(self):
+        classifier = MachineClassifier()
+        assert classifier.classify({"RemoteHost": "slot1@GPU-node.example.com"}) == "GPU"
+        assert classifier.classify({"RemoteHost": "slot1@wn02.example.com"}) == "CPU"
+
+    def test_memoised(self, classifier, mocker):
+        host = mocker.patch.object(classifier_module, "_host", wraps=classifier_module._host)
+        for _ in range(3):
+            assert classifier.classify({"RemoteHost": "slot1_3@wn02.example.com"}) == "GPU"
+        host.assert_called_once()
+
+    def test_from_collector(self, mocker, tmp_path):
+        collector = mocker.Mock()
+        collector.query.return_value = STARTD_ADS
+        cache = DiskCache("machines", ttl=60, path=str(tmp_path / "cache.sqlite"))
+
+        first = MachineClassifier.from_collector(collector, cache)
+        collector.query.assert_called_once_with(htcondor2.AdType.Startd, projection=STARTD_PROJECTION)
+        assert MachineClassifier.from_collector(collector, cache).machine_types == first.machine_types
+        collector.query.assert_called_once()
+
+    def test_collector_unavailable(self, mocker, tmp_path):
+        collector = mocker.Mock()
+        collector.query.side_effect = RuntimeError("Failed to connect")
+        cache = DiskCache("machines", ttl=60, path=str(tmp_path / "cache.sqlite"))
+
+        classifier = MachineClassifier.from_collector(collector, cache)
+        assert classifier.machine_types == {}
+        assert cache.get("machines") is None
+        assert classifier.classify({"RemoteHost": "slot1@gpu1.example.com"}) == "GPU"
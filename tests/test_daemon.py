@@ -0,0 +1,152 @@
+import os
+import socket
+import stat
+import threading
+import time
+
+import pytest
+
+from ..condor_tools import condor_tools
+from ..condor_tools import daemon as daemon_module
+from ..condor_tools.daemon import SnapshotDaemon, _trusted, request_snapshot
+from ..condor_tools.snapshot import Snapshot
+from .test_htcondor import EXPECTED_RESULT, TEST_JOBS
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "condor_stat.sock")
+
+
+@pytest.fixture
+def daemon(mocker, socket_path):
+    """
+    A daemon polling a fake schedd, with priorities and identities stubbed out.
+    """
+    mocker.patch.object(condor_tools, "get_user_priorities", return_value={"test_user0": 1.0})
+    identities = mocker.Mock(spec=condor_tools.IdentityIndex)
+    identities.real_name.side_effect = lambda user: f"Name of {user}"
+    identities.experiments.return_value = ["exp"]
+    identities.export.side_effect = lambda users: condor_tools.IdentityIndex.export(identities, users)
+    schedd = mocker.Mock()
+    schedd.query.return_value = TEST_JOBS
+
+    daemon = SnapshotDaemon(mocker.Mock(), schedd, socket_path=socket_path, interval=60, identities=identities)
+    daemon.start()
+    # Wait for the first poll
+    deadline = time.monotonic() + 5
+    while daemon.payload is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    yield daemon
+    daemon.stop()
+
+
+class TestSnapshotDaemon:
+    def test_serves_snapshot(self, daemon, socket_path):
+        snapshot = request_snapshot(socket_path)
+        assert snapshot is not None
+        assert snapshot.counts == EXPECTED_RESULT
+        assert snapshot.priorities == {"test_user0": 1.0}
+        assert snapshot.identities == {
+            "test_user0": ("Name of test_user0", ["exp"]),
+            "test_user1": ("Name of test_user1", ["exp"]),
+        }
+        daemon.schedd.query.assert_called_once()
+
+    def test_many_clients_share_one_poll(self, daemon, socket_path):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(request_snapshot(socket_path))) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == len(threads)
+        assert all(result.counts == EXPECTED_RESULT for result in results)
+        daemon.schedd.query.assert_called_once()
+
+    def test_stale_or_other_mode_ignored(self, daemon, socket_path):
+        assert request_snapshot(socket_path, pool=True) is None
+        assert request_snapshot(socket_path, max_age=-1) is None
+
+    def test_staleness_follows_interval(self, daemon, socket_path):
+        snapshot = Snapshot.from_json(daemon.payload)
+        assert snapshot.interval == 60  # noqa: PLR2004
+        snapshot.created = time.time() - 200
+        daemon.payload = snapshot.to_json()
+        assert request_snapshot(socket_path) is not None
+        snapshot.created = time.time() - 300
+        daemon.payload = snapshot.to_json()
+        assert request_snapshot(socket_path) is None
+
+    def test_refuses_to_replace_running_daemon(self, daemon, socket_path, mocker):
+        with pytest.raises(RuntimeError, match="already serving"):
+            SnapshotDaemon(mocker.Mock(), mocker.Mock(), socket_path=socket_path).start()
+        assert request_snapshot(socket_path).counts == EXPECTED_RESULT
+
+    def test_untrusted_daemon_ignored(self, daemon, socket_path, mocker):
+        mocker.patch.object(daemon_module, "_peer_uid", return_value=os.getuid() + 1000)
+        mocker.patch("os.getuid", return_value=os.getuid() + 2000)
+        assert request_snapshot(socket_path) is None
+
+    def test_stop_removes_socket(self, daemon, socket_path):
+        daemon.stop()
+        assert request_snapshot(socket_path) is None
+
+    def test_poll_failure_keeps_serving(self, daemon, socket_path):
+        daemon.schedd.query.side_effect = RuntimeError("schedd went away")
+        with pytest.raises(RuntimeError):
+            daemon.poll()
+        assert request_snapshot(socket_path).counts == EXPECTED_RESULT
+
+
+def test_replaces_stale_socket(mocker, socket_path):
+    # The socket of a daemon that was killed: the file is left behind, but nothing is listening
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(socket_path)
+    mocker.patch.object(SnapshotDaemon, "_poll_forever")
+    snapshot_daemon = SnapshotDaemon(mocker.Mock(), mocker.Mock(), socket_path=socket_path)
+    snapshot_daemon.start()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+    finally:
+        snapshot_daemon.stop()
+
+
+@pytest.mark.parametrize(
+    "uid, owner, mode, expected",
+    [
+        (1000, 2000, 0o755, True),  # the current user's own daemon
+        (0, 2000, 0o1777, True),  # root's daemon
+        (3000, 3000, 0o755, True),  # a service account serving from its own directory
+        (3000, 3000, 0o775, False),  # ... which others can write to
+        (3000, 0, 0o1777, False),  # another user's socket in /tmp
+    ],
+)
+def test_trusted(mocker, uid, owner, mode, expected):
+    mocker.patch("os.getuid", return_value=1000)
+    mocker.patch("os.stat", return_value=os.stat_result((stat.S_IFDIR | mode, 0, 0, 0, owner, 0, 0, 0, 0, 0)))
+    assert _trusted(uid, "/some/dir/condor_stat.sock") is expected
+
+
+class TestRequestSnapshot:
+    def test_no_daemon(self, socket_path):
+        assert request_snapshot(socket_path) is None
+
+    def test_garbage_response(self, socket_path):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(1)
+
+        def respond():
+            conn, _ = server.accept()
+            conn.sendall(b"not a snapshot")
+            conn.close()
+
+        thread = threading.Thread(target=respond)
+        thread.start()
+        try:
+            assert request_snapshot(socket_path) is None
+        finally:
+            thread.join()
+            server.close()
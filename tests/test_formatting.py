@@ -1,6 +1,8 @@
 import pytest
 
 from ..condor_tools.condor_tools import fetch_jobs, format_table
+from ..condor_tools.slots import SlotCapacity
+from ..condor_tools.stats import JobCounts
 from .test_htcondor import TEST_JOBS
 from .test_utilities import fake_groups  # noqa: F401
 
@@ -32,7 +34,67 @@ class TestFormatTable:
             elif only.lower() == "gpu":
                 assert "CPU" not in tab.field_names
 
+    def test_format_table_totals(self, mocker):
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.return_value = TEST_JOBS
+        tab = format_table(
+            user_stats=fetch_jobs(None, mock_schedd), current_user="test_user0", only=None, user_priorities={}
+        )
+        cpu, gpu, total = tab._rows[-1][2:]
+        assert "Held: 1" in cpu
+        assert "Total: 3" in cpu
+        assert "Idle: 1" in gpu
+        assert "Total: 3" in gpu
+        assert "Running: 2" in total
+        assert "Total: 6" in total
+
+    @pytest.mark.parametrize("only", [None, "gpu"])
+    def test_format_table_slots(self, mocker, only):
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.return_value = TEST_JOBS
+        capacity = SlotCapacity.from_startd_ads(
+            [
+                {"Machine": "wn01", "SlotType": "Partitionable", "State": "Unclaimed", "Cpus": 4, "Memory": 8192},
+                {"Machine": "gpu01", "State": "Claimed", "Cpus": 8, "Memory": 16384, "GPUs": 2, "TotalGPUs": 2},
+            ]
+        )
+        tab = format_table(user_stats=fetch_jobs(None, mock_schedd), only=only, user_priorities={}, capacity=capacity)
+        assert tab._rows[-2][0] == "Total"
+        slots = tab._rows[-1]
+        assert slots[0] == "Slots"
+        assert len(slots) == len(tab.field_names)
+        cells = dict(zip(tab.field_names, slots))
+        assert "Claimed: 8 CPUs, 16 GB, 2 GPUs" in cells["GPU"]
+        if not only:
+            assert cells["CPU"].endswith("Partitionable: 4 CPUs, 8 GB")
+            assert "Partitionable: 4 CPUs, 8 GB, 0 GPUs" in cells["Total"]
+
     def test_format_table_empty(self):
         with pytest.raises(SystemExit) as excinfo:
             format_table(user_stats={}, current_user="test_user0", only=None, priority=False, user_priorities={})
             assert excinfo.value.code == 1
+
+    @pytest.mark.parametrize(("sort_by", "top"), [("jobs", None), ("jobs", 1), ("priority", None), ("priority", 1)])
+    def test_format_table_ranking(self, mocker, sort_by, top):
+        counts = JobCounts()
+        for user, n_jobs in [("few", 1), ("many", 5), ("some", 3)]:
+            for _ in range(n_jobs):
+                counts.add_job(user, "CPU", 2)
+        identities = mocker.Mock()
+        identities.real_name.return_value = "Name"
+        identities.experiments.return_value = ["exp"]
+
+        tab = format_table(
+            user_stats=counts,
+            only=None,
+            user_priorities={"few": 1.0, "some": 50.0},
+            sort_by=sort_by,
+            top=top,
+            identities=identities,
+        )
+        expected = ["many", "some", "few"] if sort_by == "jobs" else ["few", "some", "many"]
+        users = [row[0] for row in tab._rows]
+        assert users == [*expected[:top], "Total"]
+        identities.resolve.assert_called_once_with(expected[:top])
+        # The totals always cover every user
+        assert "Total: 9" in tab._rows[-1][-1]
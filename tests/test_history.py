@@ -0,0 +1,157 @@
+import pytest
+from htcondor2 import classad
+
+from ..condor_tools.cache import DiskCache
+from ..condor_tools.classifier import MachineClassifier
+from ..condor_tools.history import (
+    BUCKET_SECONDS,
+    HISTORY_PROJECTION,
+    HISTORY_RETENTION,
+    HistoryAggregate,
+    load_history,
+)
+
+NOW = 1_700_000_000 // BUCKET_SECONDS * BUCKET_SECONDS
+
+
+def _job(cluster, owner, status, finished, wall=3600, cpus=1, host="slot1@wn01.example.com", gpus=0):  # noqa: PLR0913
+    return {
+        "ClusterId": cluster,
+        "ProcId": 0,
+        "Owner": owner,
+        "JobStatus": status,
+        "EnteredCurrentStatus": finished,
+        "RemoteWallClockTime": wall,
+        "RequestCpus": cpus,
+        "RequestGPUs": gpus,
+        "LastRemoteHost": host,
+    }
+
+
+class FakeHistorySchedd:
+    """Keeps history records oldest first, and reads them newest first like Schedd.history"""
+
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.read = 0
+
+    def history(self, constraint=None, projection=(), match=-1, since=None):
+        assert set(projection) <= set(HISTORY_PROJECTION)
+        results = []
+        for job in reversed(self.jobs):
+            ad = classad.ClassAd(job)
+            if isinstance(since, str) and since == f"{job['ClusterId']}.{job['ProcId']}":
+                break
+            self.read += 1
+            if isinstance(since, str) and "." not in since and classad.ExprTree(since).eval(ad) is True:
+                break
+            if constraint is None or classad.ExprTree(constraint).eval(ad) is True:
+                results.append(job)
+        return results
+
+
+@pytest.fixture
+def schedd():
+    return FakeHistorySchedd(
+        [
+            _job(1, "alice", 4, NOW - 30 * 3600),
+            _job(2, "alice", 4, NOW - 2 * 3600, wall=7200, cpus=4),
+            _job(3, "bob", 3, NOW - 3600, wall=600),
+            _job(4, "bob", 4, NOW - 1800, host="slot1@gpu01.example.com"),
+            _job(5, "alice", 4, NOW - 60, host=None, gpus=1),
+        ]
+    )
+
+
+class TestHistoryAggregate:
+    def test_totals(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        totals = aggregate.totals(NOW - 24 * 3600)
+        assert totals["alice"]["CPU"] == [1, 0, 7200.0, 4 * 7200.0]
+        assert totals["alice"]["GPU"] == [1, 0, 3600.0, 3600.0]
+        assert totals["bob"]["CPU"] == [0, 1, 600.0, 600.0]
+        assert totals["bob"]["GPU"] == [1, 0, 3600.0, 3600.0]
+
+    def test_cold_read_stops_at_window(self, schedd):
+        aggregate = HistoryAggregate()
+        assert aggregate.update(schedd, NOW - 24 * 3600, now=NOW) == len(schedd.jobs) - 1
+        assert schedd.read == len(schedd.jobs)
+        assert aggregate.cursor == "5.0"
+
+    def test_incremental(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        schedd.jobs.append(_job(6, "carol", 4, NOW + 60))
+        schedd.read = 0
+
+        aggregate = HistoryAggregate.from_json(aggregate.to_json())
+        assert aggregate.update(schedd, NOW - 24 * 3600, now=NOW + 120) == 1
+        assert schedd.read == 1
+        assert aggregate.totals(NOW - 24 * 3600)["carol"]["CPU"][0] == 1
+        assert aggregate.totals(NOW - 24 * 3600)["alice"]["CPU"][0] == 1
+
+    def test_nothing_new(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        before = aggregate.totals(NOW - 24 * 3600)
+        assert aggregate.update(schedd, NOW - 24 * 3600, now=NOW) == 0
+        assert aggregate.totals(NOW - 24 * 3600) == before
+
+    def test_longer_window_reads_again(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        aggregate.update(schedd, NOW - 48 * 3600, now=NOW)
+        assert aggregate.totals(NOW - 48 * 3600)["alice"]["CPU"][0] == 2  # noqa: PLR2004
+
+    def test_rotated_cursor_not_counted_twice(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        before = aggregate.totals(NOW - 24 * 3600)
+        aggregate.cursor = "999.0"
+        schedd.jobs.append(_job(6, "carol", 4, NOW + 60))
+        # Only the new record is added, the ones read again are recognised or finished too long ago
+        assert aggregate.update(schedd, NOW - 24 * 3600, now=NOW + 120) == 1
+        after = aggregate.totals(NOW - 24 * 3600)
+        assert after.pop("carol")["CPU"][0] == 1
+        assert after == before
+
+    def test_out_of_order_records_kept(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        # Left the queue after the newest record seen so far, but entered its final status before it
+        schedd.jobs.append(_job(6, "carol", 4, NOW - 600))
+        assert aggregate.update(schedd, NOW - 24 * 3600, now=NOW + 120) == 1
+        assert aggregate.totals(NOW - 24 * 3600)["carol"]["CPU"][0] == 1
+
+    def test_recent_ids_pruned(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        assert set(aggregate.recent) == {"3.0", "4.0", "5.0"}
+
+    def test_old_hours_pruned(self, schedd):
+        aggregate = HistoryAggregate()
+        aggregate.update(schedd, NOW - 24 * 3600, now=NOW)
+        later = NOW + HISTORY_RETENTION + 3600
+        aggregate.update(FakeHistorySchedd(schedd.jobs), later - 24 * 3600, now=later)
+        assert aggregate.buckets == {}
+        assert aggregate.covered_since == later - HISTORY_RETENTION
+
+    def test_bad_state(self):
+        assert HistoryAggregate.from_json({"version": -1}).cursor is None
+
+
+def test_load_history_cache(schedd, tmp_path, mocker):
+    mocker.patch("time.time", return_value=NOW)
+    cache = DiskCache("history", ttl=HISTORY_RETENTION, path=str(tmp_path / "cache.sqlite"))
+    classifier = MachineClassifier({"wn01.example.com": "GPU"})
+    history = load_history(schedd, "schedd1.example.com", 24, classifier=classifier, cache=cache)
+    assert history["alice"]["GPU"][0] == 2  # noqa: PLR2004
+    schedd.read = 0
+    assert load_history(schedd, "schedd1.example.com", 24, cache=cache) == history
+    assert schedd.read == 0
+
+    # Another node's schedd, sharing the cache through the home directory, has its own aggregates and cursor
+    other = FakeHistorySchedd([_job(7, "dave", 4, NOW - 60)])
+    assert set(load_history(other, "schedd2.example.com", 24, cache=cache)) == {"dave"}
+    assert load_history(schedd, "schedd1.example.com", 24, cache=cache) == history
@@ -1,6 +1,26 @@
+import time
+from unittest.mock import ANY
+
+import htcondor2
 import pytest
+from htcondor2 import classad
 
-from ..condor_tools.condor_tools import fetch_jobs
+from ..condor_tools.cache import DiskCache
+from ..condor_tools.classifier import MachineClassifier
+from ..condor_tools.condor_tools import (
+    JOB_PROJECTION,
+    _classad_string,
+    _gpu_job_constraint,
+    _machine_type_constraint,
+    _user_jobs_constraint,
+    fetch_jobs,
+    fetch_pool_jobs,
+    fetch_pool_totals,
+    fetch_totals,
+    fetch_user_jobs,
+    get_user_priorities,
+)
+from ..condor_tools.timing import timings
 
 TEST_JOBS = [
     {
@@ -69,3 +89,251 @@ class TestFetchJobs:
         else:
             expected_result = EXPECTED_RESULT
         assert result == expected_result
+
+    @pytest.mark.parametrize("only", [None, "cpu", "gpu"])
+    def test_fetch_jobs_query(self, mocker, only):
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.return_value = []
+
+        fetch_jobs(only, mock_schedd)
+        mock_schedd.query.assert_called_once_with(
+            constraint=_machine_type_constraint(only), projection=JOB_PROJECTION, callback=ANY
+        )
+
+    @pytest.mark.parametrize("only", [None, "cpu"])
+    def test_fetch_jobs_callback(self, mocker, only):
+        """Jobs passed to the query callback are counted as they arrive, and none are kept"""
+
+        def query(constraint, projection, callback):
+            results = [callback(job) for job in TEST_JOBS]
+            assert results == [None] * len(TEST_JOBS)
+            return []
+
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.side_effect = query
+        reference_schedd = mocker.Mock()
+        reference_schedd.query.return_value = TEST_JOBS
+        assert fetch_jobs(only, mock_schedd) == fetch_jobs(only, reference_schedd)
+
+    def test_fetch_jobs_classifier(self, mocker):
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.return_value = TEST_JOBS
+        classifier = MachineClassifier({"cpu2.example.com": "GPU"})
+
+        result = fetch_jobs("gpu", mock_schedd, classifier)
+        assert result["test_user0"]["GPU"] == {"Running": 1, "Held": 1}
+        mock_schedd.query.assert_called_once_with(
+            constraint=_machine_type_constraint("gpu", classifier), projection=JOB_PROJECTION, callback=ANY
+        )
+
+
+class TestFetchUserJobs:
+    def test_fetch_user_jobs_query(self, mocker):
+        schedd = mocker.Mock()
+        schedd.query.return_value = []
+        assert list(fetch_user_jobs("test_user0", schedd, status="held", limit=10)) == []
+        kwargs = schedd.query.call_args.kwargs
+        assert kwargs["constraint"] == 'Owner == "test_user0" && JobStatus == 5'
+        assert "HoldReason" in kwargs["projection"]
+        assert kwargs["limit"] == 10  # noqa: PLR2004
+
+    def test_fetch_user_jobs_rows(self, mocker):
+        schedd = mocker.Mock()
+        schedd.query.side_effect = lambda constraint, projection, callback, limit: [
+            callback(job) for job in TEST_JOBS if classad.ExprTree(constraint).eval(classad.ClassAd(job)) is True
+        ][:limit]
+        pages = list(fetch_user_jobs("test_user0", schedd, page_size=3))
+        assert [len(page) for page in pages] == [3, 1]
+        assert pages[0][0] == ["12345.0", "Idle", "CPU", "cpu1.example.com"]
+        assert pages[1][0] == ["12345.1", "Held", "GPU", ""]
+
+    def test_fetch_user_jobs_hold_reason(self, mocker):
+        schedd = mocker.Mock()
+        schedd.query.return_value = []
+        list(fetch_user_jobs("test_user0", schedd, status="held"))
+        row = schedd.query.call_args.kwargs["callback"]
+        job = {"ClusterId": 1, "ProcId": 0, "JobStatus": 5, "HoldReason": "x" * 200}
+        assert row(job)[3] == "x" * 80
+
+    def test_fetch_user_jobs_timed(self, mocker, monkeypatch):
+        """The schedd query is timed, not just creating the generator"""
+        delay = 0.05
+        monkeypatch.setattr(timings, "enabled", True)
+        schedd = mocker.Mock()
+        schedd.query.side_effect = lambda **kwargs: time.sleep(delay) or []
+        list(fetch_user_jobs("test_user0", schedd))
+        calls, seconds = timings.totals()["fetch_user_jobs"]
+        assert calls == 1
+        assert seconds >= delay
+
+    @pytest.mark.parametrize("user", ["alice", 'a"b', "a\\b"])
+    def test_constraint_quoting(self, user):
+        assert classad.ExprTree(_classad_string(user)).eval() == user
+        assert classad.ExprTree(_user_jobs_constraint(user)).eval(classad.ClassAd({"Owner": user})) is True
+
+
+class TestFetchPoolJobs:
+    def test_fetch_pool_jobs(self, mocker):
+        def make_schedd(ad):
+            schedd = mocker.Mock()
+            if ad["Name"] == "broken":
+                schedd.query.side_effect = RuntimeError("Failed to connect")
+            elif ad["Name"] == "slow":
+                schedd.query.side_effect = lambda **kw: time.sleep(1) or TEST_JOBS
+            else:
+                schedd.query.return_value = TEST_JOBS
+            return schedd
+
+        mocker.patch("htcondor2.Schedd", side_effect=make_schedd)
+        collector = mocker.Mock()
+        collector.locateAll.return_value = [{"Name": name} for name in ["a", "broken", "slow", "b"]]
+
+        start = time.monotonic()
+        result, failed = fetch_pool_jobs(None, collector, timeout=0.2)
+        assert time.monotonic() - start < 1
+        assert failed == ["broken", "slow"]
+        assert {user: {k: dict(v) for k, v in stats.items()} for user, stats in result.items()} == {
+            user: {k: {status: 2 * count for status, count in v.items()} for k, v in stats.items()}
+            for user, stats in EXPECTED_RESULT.items()
+        }
+
+    def test_fetch_pool_jobs_no_schedds(self, mocker):
+        collector = mocker.Mock()
+        collector.locateAll.return_value = []
+        assert fetch_pool_jobs(None, collector) == ({}, [])
+
+
+ACCOUNTING_ADS = [
+    {"Name": "alice@example.com", "Priority": 10.5123, "IsAccountingGroup": False},
+    {"Name": "bob@example.com", "Priority": 500.0, "IsAccountingGroup": False},
+    {"Name": "<none>", "IsAccountingGroup": True},
+]
+
+
+class TestGetUserPriorities:
+    @pytest.fixture
+    def negotiator(self, mocker):
+        negotiator = mocker.patch("htcondor2.Negotiator")
+        negotiator.return_value.getPriorities.return_value = ACCOUNTING_ADS
+        return negotiator
+
+    def test_get_user_priorities(self, mocker, negotiator):
+        collector = mocker.Mock()
+        assert get_user_priorities(collector) == {"alice": 10.51, "bob": 500.0}
+        negotiator.assert_called_once_with(collector.locate.return_value)
+
+    def test_priorities_cached(self, mocker, negotiator, tmp_path):
+        cache = DiskCache("priorities", ttl=60, path=str(tmp_path / "cache.sqlite"))
+        first = get_user_priorities(mocker.Mock(), cache)
+        assert get_user_priorities(mocker.Mock(), cache) == first
+        negotiator.return_value.getPriorities.assert_called_once()
+
+    def test_negotiator_unavailable(self, mocker, caplog):
+        mocker.patch("htcondor2.Negotiator", side_effect=RuntimeError("Unable to locate negotiator"))
+        assert get_user_priorities(mocker.Mock()) == {}
+        assert "Unable to locate negotiator" in caplog.text
+
+
+CLASSIFIER_JOBS = [
+    *TEST_JOBS,
+    {"Owner": "u", "JobStatus": 1},
+    {"Owner": "u", "JobStatus": 1, "RequestGPUs": 2},
+    {"Owner": "u", "JobStatus": 2, "RemoteHost": "slot1@GPU-node.example.com", "RequestGPUs": 0},
+    {"Owner": "u", "JobStatus": 2, "RemoteHost": "slot1_3@wn42.example.com", "RequestGPUs": 1},
+    {"Owner": "u", "JobStatus": 2, "RemoteHost": "slot1@lxgpu07.example.com"},
+    {"Owner": "u", "JobStatus": 5, "RequestGPUs": 0.0},
+]
+
+
+class TestMachineTypeConstraint:
+    @pytest.mark.parametrize("job", CLASSIFIER_JOBS)
+    @pytest.mark.parametrize("only", ["cpu", "gpu"])
+    def test_constraint_matches_classifier(self, job, only):
+        """The schedd-side constraint selects exactly the jobs the Python classifier puts in that machine type"""
+        matches = classad.ExprTree(_machine_type_constraint(only)).eval(classad.ClassAd(job))
+        assert matches is (MachineClassifier().classify(job) == only.upper())
+
+    @pytest.mark.parametrize("job", CLASSIFIER_JOBS)
+    @pytest.mark.parametrize("only", ["cpu", "gpu"])
+    def test_constraint_with_index(self, job, only):
+        """With an index of machines, the schedd-side constraint selects exactly the jobs in that machine type"""
+        classifier = MachineClassifier({"wn42.example.com": "GPU", "lxgpu07.example.com": "CPU"})
+        matches = classad.ExprTree(_machine_type_constraint(only, classifier)).eval(classad.ClassAd(job))
+        assert matches is (classifier.classify(job) == only.upper())
+
+    def test_no_filter(self):
+        assert _machine_type_constraint(None) == "True"
+
+    @pytest.mark.parametrize("job", CLASSIFIER_JOBS)
+    @pytest.mark.parametrize("indexed", [True, False])
+    def test_gpu_job_constraint(self, job, indexed):
+        """The schedd-side GPU job expression agrees with the classifier, with or without an index"""
+        classifier = MachineClassifier({"wn42.example.com": "GPU", "lxgpu07.example.com": "CPU"} if indexed else {})
+        matches = classad.ExprTree(_gpu_job_constraint(classifier)).eval(classad.ClassAd(job))
+        assert matches is (classifier.classify(job) == "GPU")
+
+    def test_gpu_job_constraint_lists_misnamed(self):
+        """Only the machines the naming heuristic gets wrong are listed in the expression"""
+        classifier = MachineClassifier(
+            {
+                "wn42.example.com": "GPU",
+                "lxgpu07.example.com": "CPU",
+                "wn01.example.com": "CPU",
+                "gpu01.example.com": "GPU",
+            }
+        )
+        constraint = _gpu_job_constraint(classifier)
+        assert "wn42.example.com" in constraint
+        assert "lxgpu07.example.com" in constraint
+        assert "wn01.example.com" not in constraint
+        assert "gpu01.example.com" not in constraint
+        for remote_host in ["slot1@wn42.example.com", "slot1@gpu01.example.com", "slot1@gpu99.example.com"]:
+            assert classad.ExprTree(constraint).eval(classad.ClassAd({"RemoteHost": remote_host})) is True
+        for remote_host in ["slot1@lxgpu07.example.com", "slot1@wn01.example.com", "slot1@wn99.example.com"]:
+            assert classad.ExprTree(constraint).eval(classad.ClassAd({"RemoteHost": remote_host})) is False
+
+
+def _summary_schedd(mocker, jobs=TEST_JOBS):
+    """A schedd answering summary queries by counting the jobs matching the constraint, as the schedd would"""
+
+    def query(constraint, projection, opts):
+        matching = [job for job in jobs if classad.ExprTree(constraint).eval(classad.ClassAd(job)) is True]
+        summary = {"MyType": "Summary", "Jobs": len(matching)}
+        for status, name in [(1, "Idle"), (2, "Running"), (5, "Held")]:
+            summary[name] = sum(job["JobStatus"] == status for job in matching)
+        return [summary]
+
+    schedd = mocker.Mock()
+    schedd.query.side_effect = query
+    return schedd
+
+
+class TestFetchTotals:
+    def test_summary(self, mocker):
+        schedd = _summary_schedd(mocker)
+        totals = fetch_totals(schedd)
+        mock_schedd = mocker.Mock()
+        mock_schedd.query.return_value = TEST_JOBS
+        assert totals == fetch_jobs(None, mock_schedd).machine_type_totals(["Running", "Idle", "Held"])
+        assert all(call.kwargs["opts"] == htcondor2.QueryOpt.SummaryOnly for call in schedd.query.call_args_list)
+
+    def test_no_summary(self, mocker):
+        def query(constraint="True", projection=(), callback=None, opts=None):
+            if opts is None:
+                for job in TEST_JOBS:
+                    callback(job)
+            return []
+
+        schedd = mocker.Mock()
+        schedd.query.side_effect = query
+        assert fetch_totals(schedd)["GPU"] == {"Running": 1, "Idle": 1, "Held": 1}
+
+    def test_pool(self, mocker):
+        collector = mocker.Mock()
+        collector.locateAll.return_value = [{"Name": "schedd1"}, {"Name": "schedd2"}]
+        schedds = {"schedd1": _summary_schedd(mocker), "schedd2": mocker.Mock()}
+        schedds["schedd2"].query.side_effect = RuntimeError("schedd down")
+        mocker.patch.object(htcondor2, "Schedd", side_effect=lambda ad: schedds[ad["Name"]])
+        totals, failed = fetch_pool_totals(collector)
+        assert totals["Total"] == {"Running": 2, "Idle": 2, "Held": 2}
+        assert failed == ["schedd2"]
@@ -0,0 +1,68 @@
+import htcondor2
+import pytest
+
+from ..condor_tools.cache import DiskCache
+from ..condor_tools.slots import SLOT_PROJECTION, SlotCapacity
+
+STARTD_ADS = [
+    # A partitionable CPU machine with two dynamic slots carved out of it
+    {"Machine": "wn01.example.com", "SlotType": "Partitionable", "State": "Unclaimed", "Cpus": 4, "Memory": 8192},
+    {"Machine": "wn01.example.com", "SlotType": "Dynamic", "State": "Claimed", "Cpus": 2, "Memory": 4096},
+    {"Machine": "wn01.example.com", "SlotType": "Dynamic", "State": "Claimed", "Cpus": 2, "Memory": 4096},
+    # Static slots on a GPU machine
+    {"Machine": "gpu01.example.com", "SlotType": "Static", "State": "Claimed", "Cpus": 8, "Memory": 16384,
+     "GPUs": 1, "TotalGPUs": 2},
+    {"Machine": "gpu01.example.com", "SlotType": "Static", "State": "Unclaimed", "Cpus": 8, "Memory": 16384,
+     "GPUs": 1, "TotalGPUs": 2},
+    {"Machine": "wn02.example.com", "State": "Owner", "Cpus": "bad"},
+]  # fmt: skip
+
+
+@pytest.fixture
+def capacity():
+    return SlotCapacity.from_startd_ads(STARTD_ADS)
+
+
+class TestSlotCapacity:
+    @pytest.mark.parametrize(
+        ("machine_type", "state", "resource", "total"),
+        [
+            ("CPU", "Claimed", "Cpus", 4),
+            ("CPU", "Claimed", "Memory", 8192),
+            ("CPU", "Partitionable", "Cpus", 4),
+            ("CPU", "Unclaimed", "Cpus", 0),
+            ("GPU", "Claimed", "GPUs", 1),
+            ("GPU", "Unclaimed", "Cpus", 8),
+            ("cpu", "Partitionable", "GPUs", 0),
+            (None, "Claimed", "Cpus", 12),
+            (None, "Unclaimed", "Memory", 16384),
+        ],
+    )
+    def test_totals(self, capacity, machine_type, state, resource, total):
+        assert capacity.get(machine_type, state, resource) == total
+
+    def test_slots_and_machines(self, capacity):
+        assert capacity.slots == len(STARTD_ADS)
+        assert capacity.machine_types == {
+            "wn01.example.com": "CPU",
+            "gpu01.example.com": "GPU",
+            "wn02.example.com": "CPU",
+        }
+        assert capacity.classifier().classify({"RemoteHost": "slot1@gpu01.example.com"}) == "GPU"
+
+    def test_from_collector(self, mocker, tmp_path):
+        collector = mocker.Mock()
+        collector.query.return_value = STARTD_ADS
+        cache = DiskCache("machines", ttl=60, path=str(tmp_path / "cache.sqlite"))
+        capacity = SlotCapacity.from_collector(collector, cache)
+        collector.query.assert_called_once_with(htcondor2.AdType.Startd, projection=SLOT_PROJECTION)
+        assert capacity.get(None, "Claimed", "Cpus") == 12  # noqa: PLR2004
+        assert cache.get("machines") == capacity.machine_types
+
+    def test_collector_unavailable(self, mocker, caplog):
+        collector = mocker.Mock()
+        collector.query.side_effect = RuntimeError("no collector")
+        capacity = SlotCapacity.from_collector(collector)
+        assert capacity.slots == 0
+        assert capacity.get(None, "Claimed", "Cpus") == 0
+        assert "Could not get the slots" in caplog.text
@@ -0,0 +1,93 @@
+import json
+import os
+import struct
+
+import pytest
+
+from ..condor_tools.snapshot import SNAPSHOT_VERSION, Snapshot
+from ..condor_tools.stats import JobCounts
+from .test_htcondor import EXPECTED_RESULT
+
+
+@pytest.fixture
+def snapshot():
+    return Snapshot(
+        counts=JobCounts.from_user_stats(EXPECTED_RESULT),
+        priorities={"test_user0": 1.5},
+        identities={"test_user0": ("Test User", ["expA"])},
+        pool=True,
+    )
+
+
+class TestSnapshotJson:
+    def test_round_trip(self, snapshot):
+        decoded = Snapshot.from_json(snapshot.to_json())
+        assert decoded.counts == EXPECTED_RESULT
+        assert decoded.counts.users == snapshot.counts.users
+        assert decoded.priorities == snapshot.priorities
+        assert decoded.identities == snapshot.identities
+        assert decoded.created == snapshot.created
+        assert decoded.pool
+
+    @pytest.mark.parametrize(
+        "change",
+        [
+            {"version": 0},
+            {"layout": [["CPU"], ["Idle"]]},
+            {"counts": [1, 2, 3]},
+        ],
+    )
+    def test_incompatible(self, snapshot, change):
+        with pytest.raises(ValueError):
+            Snapshot.from_json(json.dumps({**json.loads(snapshot.to_json()), **change}).encode())
+
+    @pytest.mark.parametrize("data", [b"", b"{}", b"[1, 2]", b"garbage"])
+    def test_malformed(self, data):
+        with pytest.raises(ValueError):
+            Snapshot.from_json(data)
+
+
+class TestSnapshotFile:
+    def test_round_trip(self, snapshot, tmp_path):
+        path = str(tmp_path / "stats.snap")
+        snapshot.save(path)
+        loaded = Snapshot.load(path)
+        assert loaded.counts == EXPECTED_RESULT
+        assert loaded.counts.users == snapshot.counts.users
+        assert loaded.priorities == snapshot.priorities
+        assert loaded.identities == snapshot.identities
+        assert loaded.created == snapshot.created
+        assert loaded.pool
+        assert os.listdir(tmp_path) == ["stats.snap"]
+
+    def test_many_users(self, tmp_path):
+        n_users = 10000
+        counts = JobCounts()
+        for i in range(n_users):
+            counts.add_job(f"user{i}", "GPU" if i % 3 else "CPU", i % 7 + 1)
+        path = str(tmp_path / "stats.snap")
+        Snapshot(counts).save(path)
+        loaded = Snapshot.load(path)
+        assert loaded.counts.columns() == counts.columns()
+        assert not loaded.pool
+
+    @pytest.mark.parametrize(
+        "corrupt",
+        [
+            lambda data: b"",
+            lambda data: data[:10],
+            lambda data: data[:-8],
+            lambda data: b"XXXX" + data[4:],
+            lambda data: data[:4] + struct.pack("<H", SNAPSHOT_VERSION + 1) + data[6:],
+        ],
+    )
+    def test_corrupt(self, snapshot, tmp_path, corrupt):
+        path = tmp_path / "stats.snap"
+        snapshot.save(str(path))
+        path.write_bytes(corrupt(path.read_bytes()))
+        with pytest.raises(ValueError):
+            Snapshot.load(str(path))
+
+    def test_missing(self, tmp_path):
+        with pytest.raises(OSError):
+            Snapshot.load(str(tmp_path / "missing.snap"))
@@ -0,0 +1,82 @@
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from ..condor_tools.snapshot import Snapshot
+from ..condor_tools.stats import JobCounts
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["htcondor2", "classad2", "prettytable", "termcolor", "importlib.metadata"]
+
+# Generous, so this only fails if something heavy creeps back into the import path
+IMPORT_TIME_BUDGET = 0.3
+
+
+def _run(code: str, tmp_path, *args: str) -> subprocess.CompletedProcess:
+    """Run some Python in a fresh interpreter, as condor_stat.py would be"""
+    env = {**os.environ, "XDG_CACHE_HOME": str(tmp_path / "cache")}
+    return subprocess.run(
+        [sys.executable, *args, "-c", code], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def _loaded(code: str, tmp_path) -> set[str]:
+    """Get which of the heavy modules are loaded after running some code"""
+    code += f"\nimport sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    return set(filter(None, _run(code, tmp_path).stdout.strip().split("\n")[-1].split(",")))
+
+
+class TestStartup:
+    def test_import_time(self, tmp_path):
+        """The cumulative import time of the main module, as reported by -X importtime"""
+        times = []
+        for _ in range(3):
+            stderr = _run("import condor_tools.condor_tools", tmp_path, "-X", "importtime").stderr
+            match = re.search(r"\|\s*(\d+) \| condor_tools\.condor_tools$", stderr, re.MULTILINE)
+            times.append(int(match.group(1)) / 1e6)
+        assert min(times) < IMPORT_TIME_BUDGET
+
+    def test_import_is_light(self, tmp_path):
+        assert _loaded("import condor_tools.condor_tools", tmp_path) == set()
+
+    @pytest.mark.parametrize("option", ["--help", "--version"])
+    def test_help_and_version(self, tmp_path, option):
+        code = (
+            "import sys\n"
+            "from condor_tools import condor_tools\n"
+            f"sys.argv = ['condor_stat.py', '{option}']\n"
+            "try:\n"
+            "    condor_tools.main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+        )
+        loaded = _loaded(code, tmp_path)
+        assert "htcondor2" not in loaded
+        assert "prettytable" not in loaded
+        assert ("importlib.metadata" in loaded) == (option == "--version")
+
+    def test_from_snapshot(self, tmp_path):
+        counts = JobCounts()
+        counts.add_job("alice", "CPU", 2)
+        path = str(tmp_path / "stats.snap")
+        Snapshot(counts, identities={"alice": ("Alice", ["cms"])}).save(path)
+        code = (
+            "import sys\n"
+            "from condor_tools import condor_tools\n"
+            "condor_tools.log = lambda *args: None\n"
+            f"sys.argv = ['condor_stat.py', '--from-snapshot', {path!r}]\n"
+            "condor_tools.main()\n"
+        )
+        assert "htcondor2" not in _loaded(code, tmp_path)
+
+    def test_daemon_client(self, tmp_path):
+        code = (
+            "import sys\n"
+            "from condor_tools import condor_tools\n"
+            "from condor_tools.daemon import request_snapshot\n"
+            f"request_snapshot({str(tmp_path / 'missing.sock')!r})\n"
+        )
+        assert "htcondor2" not in _loaded(code, tmp_path)
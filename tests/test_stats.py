@@ -0,0 +1,76 @@
+import pytest
+
+from ..condor_tools.stats import MACHINE_TYPE_INDEX, STATUS_NAME_INDEX, JobCounts
+from .test_htcondor import EXPECTED_RESULT
+
+
+@pytest.fixture
+def counts():
+    return JobCounts.from_user_stats(EXPECTED_RESULT)
+
+
+class TestJobCounts:
+    def test_view_round_trip(self, counts):
+        assert counts == EXPECTED_RESULT
+        assert list(counts) == ["test_user0", "test_user1"]
+        assert len(counts) == len(EXPECTED_RESULT)
+        assert "test_user0" in counts
+        assert "nobody" not in counts
+        with pytest.raises(KeyError):
+            counts["nobody"]
+
+    def test_view_defaults_to_zero(self, counts):
+        assert counts["test_user1"]["CPU"]["Held"] == 0
+
+    def test_add_job(self):
+        counts = JobCounts()
+        counts.add_job("alice", "GPU", 5)
+        counts.add_job("alice", "GPU", 5)
+        counts.add_job("alice", "CPU", 99)
+        assert counts == {"alice": {"CPU": {"Unknown": 1}, "GPU": {"Held": 2}, "Total": {"Held": 2, "Unknown": 1}}}
+
+    def test_block(self, counts):
+        block = counts.block("test_user0")
+        assert block[MACHINE_TYPE_INDEX["GPU"] * len(STATUS_NAME_INDEX) + STATUS_NAME_INDEX["Held"]] == 1
+        assert sum(block) == sum(EXPECTED_RESULT["test_user0"]["Total"].values())
+
+    def test_machine_type_totals(self, counts):
+        assert counts.machine_type_totals(["Running", "Idle", "Held"]) == {
+            "CPU": {"Running": 1, "Idle": 1, "Held": 1},
+            "GPU": {"Running": 1, "Idle": 1, "Held": 1},
+            "Total": {"Running": 2, "Idle": 2, "Held": 2},
+        }
+        assert counts.total() == counts.total(["Running", "Idle", "Held"]) == 6  # noqa: PLR2004
+        assert counts.total(["Completed"]) == 0
+
+    def test_user_totals(self, counts):
+        assert counts.user_totals() == {"test_user0": 4, "test_user1": 2}
+        assert counts.user_totals(["Held"]) == {"test_user0": 2, "test_user1": 0}
+        assert counts.user_totals(["Running", "Idle"], "gpu") == {"test_user0": 0, "test_user1": 2}
+
+    def test_merge(self, counts):
+        other = JobCounts()
+        other.add_job("test_user1", "CPU", 2)
+        other.add_job("new_user", "GPU", 1)
+        counts.merge(other)
+        assert counts["test_user1"]["CPU"] == {"Running": 1}
+        assert counts["test_user1"]["Total"] == {"Idle": 1, "Running": 2}
+        assert counts["new_user"]["GPU"] == {"Idle": 1}
+        assert list(counts) == ["test_user0", "test_user1", "new_user"]
+
+    def test_from_user_stats_passthrough(self, counts):
+        assert JobCounts.from_user_stats(counts) is counts
+
+    def test_columns_round_trip(self, counts):
+        users, columns = counts.columns()
+        assert JobCounts.from_columns(users, columns) == counts
+        with pytest.raises(ValueError):
+            JobCounts.from_columns(users, columns[:-1])
+
+    @pytest.mark.parametrize("machine_type", ["cpu", "GPU"])
+    def test_select(self, counts, machine_type):
+        selected = counts.select(machine_type)
+        for user, stats in selected.items():
+            assert stats["Total"] == stats[machine_type.upper()] == EXPECTED_RESULT[user][machine_type.upper()]
+        assert set(selected) == {user for user, stats in EXPECTED_RESULT.items() if stats[machine_type.upper()]}
+        assert counts.select(None) is counts
@@ -0,0 +1,42 @@
+import pytest
+from prettytable import PrettyTable
+
+from ..condor_tools.table import Table
+
+ROWS = [
+    ["alice", "Alice (cms)", 1.5, "Running: 1\nIdle: 2\nTotal: 3"],
+    ["bob", "Bob (lhcb)", -1, "Running: 10\nTotal: 10"],
+]
+
+
+class TestTable:
+    def test_matches_prettytable(self):
+        """The layout is the same as the PrettyTable it replaces"""
+        headers = ["User", "Name", "Priority", "CPU"]
+        table = Table(headers)
+        reference = PrettyTable(headers, align="l", hrules=1)
+        for row in ROWS:
+            table.add_row(row)
+            reference.add_row(row)
+        assert str(table) == reference.get_string()
+
+    def test_colour(self, monkeypatch):
+        monkeypatch.setenv("FORCE_COLOR", "1")
+        monkeypatch.delenv("NO_COLOR", raising=False)
+        plain = Table(["User", "CPU"])
+        coloured = Table(["User", "CPU"])
+        plain.add_row(["bob", "Running: 1\nIdle: 10"])
+        coloured.add_row(["bob", "Running: 1\nIdle: 10"], colour="green")
+        lines = str(coloured).split("\n")
+        assert lines[3] == "| \x1b[32mbob\x1b[0m  | \x1b[32mRunning: 1\x1b[0m |"
+        assert lines[4] == "|      | \x1b[32mIdle: 10\x1b[0m   |"
+        assert str(coloured).replace("\x1b[32m", "").replace("\x1b[0m", "") == str(plain)
+
+    def test_width_ignores_colour_codes(self):
+        table = Table(["CPU"])
+        table.add_row(["Running: 3\x1b[33m (+2)\x1b[0m"])
+        assert str(table).split("\n")[0] == "+" + "-" * len(" Running: 3 (+2) ") + "+"
+
+    def test_wrong_number_of_cells(self):
+        with pytest.raises(ValueError):
+            Table(["User", "CPU"]).add_row(["alice"])
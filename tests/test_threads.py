@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from ..condor_tools.threads import run_with_deadline
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestRunWithDeadline:
+    def test_results(self):
+        results, failed = run_with_deadline({i: (lambda i=i: i * 2) for i in range(10)}, max_workers=3, timeout=5)
+        assert results == {i: i * 2 for i in range(10)}
+        assert failed == {}
+
+    def test_failures(self):
+        def fail():
+            raise RuntimeError("down")
+
+        def hang():
+            time.sleep(2)
+
+        start = time.monotonic()
+        results, failed = run_with_deadline({"ok": lambda: 1, "fail": fail, "hang": hang}, max_workers=3, timeout=0.1)
+        assert time.monotonic() - start < 1
+        assert results == {"ok": 1}
+        assert isinstance(failed["fail"], RuntimeError)
+        assert isinstance(failed["hang"], TimeoutError)
+
+    def test_queued_calls_dropped(self):
+        started = []
+
+        def hang(key):
+            started.append(key)
+            time.sleep(0.5)
+
+        tasks = {key: (lambda key=key: hang(key)) for key in range(4)}
+        _, failed = run_with_deadline(tasks, max_workers=1, timeout=0.1)
+        time.sleep(0.6)
+        assert set(failed) == {0, 1, 2, 3}
+        assert started == [0]
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_hung_calls_dont_block_exit(self, workers):
+        code = (
+            "import time\n"
+            "from condor_tools.threads import run_with_deadline\n"
+            f"run_with_deadline({{i: lambda: time.sleep(60) for i in range(4)}}, max_workers={workers}, timeout=0.1)\n"
+        )
+        start = time.monotonic()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR, check=True, timeout=30)
+        assert time.monotonic() - start < 10  # noqa: PLR2004
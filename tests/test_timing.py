@@ -0,0 +1,95 @@
+import logging
+import threading
+
+from ..condor_tools import timing
+from ..condor_tools.condor_tools import _get_real_name, _get_user_experiments
+from ..condor_tools.timing import Timings
+
+
+class TestTimings:
+    def test_disabled(self):
+        timings = Timings()
+        with timings.span("phase"):
+            pass
+        assert timings.span("phase") is timing._NO_SPAN
+        assert timings.totals() == {}
+
+    def test_spans(self, mocker):
+        timings = Timings()
+        timings.enable()
+        mocker.patch("time.perf_counter", side_effect=[0.0, 0.5, 1.0, 1.25])
+        for _ in range(2):
+            with timings.span("phase"):
+                pass
+        assert timings.totals() == {"phase": (2, 0.75)}
+
+    def test_threads(self):
+        timings = Timings()
+        timings.enable()
+        n_threads = 8
+
+        def work():
+            for _ in range(100):
+                with timings.span("work"):
+                    pass
+
+        threads = [threading.Thread(target=work) for _ in range(n_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert timings.totals()["work"][0] == n_threads * 100
+
+    def test_timed(self):
+        timings = Timings()
+        timings.enable()
+
+        @timings.timed()
+        def add(a, b=1):
+            """Add two numbers"""
+            return a + b
+
+        @timings.timed("other")
+        def fail():
+            raise ValueError
+
+        assert add(1, b=2) == 3  # noqa: PLR2004
+        assert add.__name__ == "add"
+        assert add.__doc__ == "Add two numbers"
+        try:
+            fail()
+        except ValueError:
+            pass
+        assert list(timings.totals()) == ["add", "other"]
+
+    def test_logged_at_debug(self, caplog):
+        timings = Timings()
+        caplog.set_level(logging.DEBUG, logger=timing.logger.name)
+        with timings.span("phase"):
+            pass
+        (record,) = caplog.records
+        assert record.span == "phase"
+        assert record.duration >= 0
+        assert timings.totals()["phase"][0] == 1
+
+    def test_report(self):
+        timings = Timings()
+        timings.record("main", 1.5)
+        timings.record("subprocess.pinky", 0.01)
+        timings.record("subprocess.pinky", 0.02)
+        assert timings.report().split("\n") == [
+            "Timings:",
+            "  main                   1x      1500.0 ms",
+            "  subprocess.pinky       2x        30.0 ms",
+        ]
+
+    def test_subprocess_spans(self, mocker):
+        mocker.patch("subprocess.run", return_value=mocker.Mock(returncode=1, stdout=""))
+        timing.timings.enable()
+        _get_real_name("alice")
+        _get_user_experiments("alice")
+        _get_real_name("bob")
+        assert {name: count for name, (count, _) in timing.timings.totals().items()} == {
+            "subprocess.pinky": 2,
+            "subprocess.groups": 1,
+        }
@@ -1,13 +1,22 @@
 import argparse
+import csv
 import datetime
 import getpass
+import io
+import json
 import os
-import subprocess
+import pstats
 import sys
+import time
 
 import pytest
 
 from ..condor_tools import condor_tools
+from ..condor_tools import daemon as daemon_module
+from ..condor_tools import trends as trends_module
+from ..condor_tools import watch as watch_module
+from ..condor_tools.snapshot import Snapshot
+from ..condor_tools.stats import JobCounts
 
 
 def test_log_writes_to_file(fs, monkeypatch):
@@ -15,6 +24,9 @@ def test_log_writes_to_file(fs, monkeypatch):
     Test the log() function without touching the real filesystem.
     """
 
+    # Arrange: Log next to the module, as by default
+    monkeypatch.delenv("CONDOR_STAT_USAGE_LOG")
+
     # Arrange: Patch getpass.getuser and _get_real_name to known values
     monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
     monkeypatch.setattr(condor_tools, "_get_real_name", lambda u: "Test User")
@@ -45,33 +57,469 @@ def test_log_writes_to_file(fs, monkeypatch):
 
 
 @pytest.mark.parametrize("priority", [True, False])
-def test_main_with_priority(monkeypatch, caplog, priority):
+def test_main_with_priority(monkeypatch, mocker, caplog, priority):
     # Fake a bunch of stuff
-    fake_output = b"""
-    some header
-    more header
-    even more header
-    skip me
-    alice@domain.com  10.5  something
-    bob@domain.com    5.0   something
-    trailing line
-    footer line
-    footer line 2
-    """
     if priority:
         monkeypatch.setattr(sys, "argv", ["script.py", "--priority", "--only", "cpu"])
     else:
         monkeypatch.setattr(sys, "argv", ["script.py", "--only", "cpu"])
     monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
-    monkeypatch.setattr(
-        subprocess, "run", lambda *a, **kw: subprocess.CompletedProcess(args=a, returncode=0, stdout=fake_output)
+    get_user_priorities = mocker.patch.object(
+        condor_tools, "get_user_priorities", return_value={"alice": 10.5, "bob": 5.0}
     )
-    monkeypatch.setattr(condor_tools, "log", lambda args: None)
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
     monkeypatch.setattr(condor_tools, "_setup_condor", lambda: (None, "schedd"))
-    monkeypatch.setattr(condor_tools, "fetch_jobs", lambda only, schedd: {"job": {"some": "stats"}})
-    monkeypatch.setattr(condor_tools, "format_table", lambda *a, **k: "formatted table")
+    monkeypatch.setattr(condor_tools, "fetch_jobs", lambda only, schedd, classifier=None: {"job": {"some": "stats"}})
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
     caplog.set_level("INFO")
 
     condor_tools.main()
     assert "HTCondor Job Stats" in caplog.text
     assert "formatted table" in caplog.text
+    assert get_user_priorities.called == priority
+    assert format_table.call_args.args[2] == ({"alice": 10.5, "bob": 5.0} if priority else {})
+
+
+@pytest.mark.parametrize("refresh", [True, False])
+def test_main_refresh_identities(monkeypatch, mocker, refresh):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--refresh-identities"] if refresh else ["script.py"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: (None, "schedd"))
+    monkeypatch.setattr(condor_tools, "fetch_jobs", lambda only, schedd, classifier=None: {})
+    monkeypatch.setattr(condor_tools, "format_table", lambda *a, **k: "formatted table")
+    mock_cache = mocker.patch.object(condor_tools, "DiskCache")
+
+    condor_tools.main()
+    assert mock_cache.return_value.clear.called == refresh
+
+
+@pytest.mark.parametrize("failed", [[], ["schedd2"]])
+def test_main_pool(monkeypatch, mocker, caplog, failed):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--pool"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: ("collector", "schedd"))
+    fetch_jobs = mocker.patch.object(condor_tools, "fetch_jobs")
+    fetch_pool_jobs = mocker.patch.object(condor_tools, "fetch_pool_jobs", return_value=({}, failed))
+    monkeypatch.setattr(condor_tools, "format_table", lambda *a, **k: "formatted table")
+    caplog.set_level("INFO")
+
+    condor_tools.main()
+    fetch_jobs.assert_not_called()
+    assert fetch_pool_jobs.call_args.args == (None, "collector")
+    assert ("schedd2" in caplog.text) == bool(failed)
+
+
+def test_main_gathers_concurrently(monkeypatch, mocker, caplog):
+    """The schedd query, priority fetch and identity prefetch overlap, and the usage log overlaps the output"""
+
+    delay = 0.3
+
+    def slow(result):
+        return lambda *a, **k: time.sleep(delay) or result
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--priority"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: (None, "schedd"))
+    monkeypatch.setattr(condor_tools, "fetch_jobs", slow({"user": {}}))
+    monkeypatch.setattr(condor_tools, "get_user_priorities", slow({"user": 1.0}))
+    monkeypatch.setattr(condor_tools, "log", slow(None))
+    monkeypatch.setattr(condor_tools.IdentityIndex, "prefetch", slow(None))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    start = time.monotonic()
+    condor_tools.main()
+    # Four steps in turn would take 4 * delay, the usage log waits for the stats so this is at least 2 * delay
+    assert time.monotonic() - start < 3 * delay
+    assert format_table.call_args.args[:3] == ({"user": {}}, None, {"user": 1.0})
+
+
+def test_main_watch(monkeypatch, mocker):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--watch", "5"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    gather = mocker.patch.object(condor_tools, "_gather")
+    watch = mocker.patch.object(watch_module, "watch")
+
+    condor_tools.main()
+    gather.assert_not_called()
+    assert watch.call_args.args[0].watch == 5.0  # noqa: PLR2004
+    assert watch.call_args.kwargs == {"current_user": "testuser"}
+
+
+@pytest.mark.parametrize("no_daemon", [True, False])
+def test_main_uses_daemon(monkeypatch, mocker, no_daemon):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 1)
+    counts.add_job("bob", "GPU", 2)
+    snapshot = Snapshot(counts, priorities={"alice": 2.0}, identities={"alice": ("Alice", ["cms"])})
+    monkeypatch.setattr(sys, "argv", ["script.py", "--priority", "--only", "cpu"] + ["--no-daemon"] * no_daemon)
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    request_snapshot = mocker.patch.object(daemon_module, "request_snapshot", return_value=snapshot)
+    gather = mocker.patch.object(condor_tools, "_gather", return_value=({}, {}))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    condor_tools.main()
+    assert request_snapshot.called != no_daemon
+    assert gather.called == no_daemon
+    if not no_daemon:
+        user_stats, _, user_priorities = format_table.call_args.args
+        assert list(user_stats) == ["alice"]
+        assert user_priorities == {"alice": 2.0}
+        assert format_table.call_args.kwargs["identities"].real_name("alice") == "Alice"
+
+
+def test_main_daemon(monkeypatch, mocker):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--daemon", "--socket", "/tmp/test.sock", "--daemon-interval", "5"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: ("collector", "schedd"))
+    snapshot_daemon = mocker.patch.object(daemon_module, "SnapshotDaemon")
+
+    condor_tools.main()
+    assert snapshot_daemon.call_args.args == ("collector", "schedd")
+    assert snapshot_daemon.call_args.kwargs["socket_path"] == "/tmp/test.sock"
+    assert snapshot_daemon.call_args.kwargs["interval"] == 5.0  # noqa: PLR2004
+    snapshot_daemon.return_value.run.assert_called_once()
+
+
+def test_main_user(monkeypatch, mocker, caplog):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--user", "alice", "--status", "held", "--limit", "2"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "real_name", lambda self, user: user.title())
+    schedd = mocker.Mock()
+    schedd.query.side_effect = lambda constraint, projection, callback, limit: [
+        callback({"ClusterId": 1, "ProcId": i, "JobStatus": 5, "HoldReason": "Out of memory"}) for i in range(limit)
+    ]
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: ("collector", schedd))
+    monkeypatch.setattr(condor_tools, "load_classifier", lambda collector: None)
+    gather = mocker.patch.object(condor_tools, "_gather")
+
+    with caplog.at_level("INFO"):
+        condor_tools.main()
+    gather.assert_not_called()
+    assert schedd.query.call_args.kwargs["constraint"] == 'Owner == "alice" && JobStatus == 5'
+    assert "Jobs of alice (Alice), held" in caplog.text
+    assert "1.1" in caplog.text
+    assert "Out of memory" in caplog.text
+    assert "Only the first 2 jobs are shown" in caplog.text
+
+
+def test_main_history(monkeypatch, mocker, caplog):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--history", "24", "--only", "gpu"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "real_name", lambda self, user: user.title())
+    monkeypatch.setattr(condor_tools.IdentityIndex, "experiments", lambda self, user: ["cms"])
+    schedd = mocker.Mock()
+    schedd.history.return_value = [
+        {
+            "ClusterId": 1,
+            "ProcId": 0,
+            "Owner": "alice",
+            "JobStatus": 4,
+            "EnteredCurrentStatus": time.time(),
+            "RemoteWallClockTime": 5400,
+            "RequestCpus": 2,
+            "RequestGPUs": 1,
+        },
+    ]
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: ("collector", schedd))
+    monkeypatch.setattr(condor_tools, "load_classifier", lambda collector: None)
+    gather = mocker.patch.object(condor_tools, "_gather")
+
+    with caplog.at_level("INFO"):
+        condor_tools.main()
+    gather.assert_not_called()
+    assert "Jobs finished in the last 24 hours" in caplog.text
+    assert "Alice (cms)" in caplog.text
+    assert "Wall hours: 1.5" in caplog.text
+    assert "CPU hours: 3.0" in caplog.text
+    header = next(line for line in caplog.text.splitlines() if line.startswith("| User"))
+    assert [cell.strip() for cell in header.split("|")[1:-1]] == ["User", "Name", "GPU"]
+
+
+def test_main_record_and_trend(monkeypatch, mocker, caplog):
+    counts = JobCounts()
+    counts.add_job("alice", "GPU", 5)
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--record"])
+    condor_tools.main()
+    monkeypatch.setattr(sys, "argv", ["script.py", "--trend", "alice", "--since", "1h", "--only", "gpu"])
+    with caplog.at_level("INFO"):
+        condor_tools.main()
+    assert "Average jobs of alice" in caplog.text
+    header = next(line for line in caplog.text.splitlines() if line.startswith("| Time"))
+    assert [cell.strip() for cell in header.split("|")[1:-1]] == ["Time", "GPU Running", "GPU Idle", "GPU Held"]
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--trend", "bob"])
+    with pytest.raises(SystemExit):
+        condor_tools.main()
+
+
+def test_main_record_only(monkeypatch, mocker):
+    """--record stores every machine type even with --only, which just filters the output"""
+    counts = JobCounts()
+    counts.add_job("alice", "GPU", 5)
+    counts.add_job("bob", "CPU", 2)
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    gather = mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+    record_stats = mocker.patch.object(trends_module, "record_stats")
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--record", "--only", "gpu"])
+    condor_tools.main()
+    assert gather.call_args.kwargs["unfiltered"] is True
+    assert list(record_stats.call_args.args[0]) == ["alice", "bob"]
+    assert list(format_table.call_args.args[0]) == ["alice"]
+
+
+@pytest.mark.parametrize(("text", "seconds"), [("90m", 5400), ("12h", 43200), ("2", 7200), ("1.5d", 129600)])
+def test_duration(text, seconds):
+    assert condor_tools._duration(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "d", "abc", "-1h", "0"])
+def test_bad_duration(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        condor_tools._duration(text)
+
+
+def test_main_slots(monkeypatch, mocker):
+    counts = JobCounts()
+    counts.add_job("alice", "GPU", 2)
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--slots"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    collector = mocker.Mock()
+    collector.query.return_value = [{"Machine": "wn01", "State": "Claimed", "Cpus": 4, "Memory": 4096}]
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: (collector, "schedd"))
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    condor_tools.main()
+    assert format_table.call_args.kwargs["capacity"].get("CPU", "Claimed", "Cpus") == 4  # noqa: PLR2004
+
+
+def test_main_slots_one_startd_query(monkeypatch, mocker):
+    """With --slots on a cold machine cache, the startd ads are queried once for both the slots and the
+    classifier, with one set of handles"""
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--slots"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    collector = mocker.Mock()
+    collector.query.return_value = [
+        {"Machine": "wn01.example.com", "State": "Claimed", "Cpus": 4, "Memory": 4096, "GPUs": 2, "TotalGPUs": 2}
+    ]
+    schedd = mocker.Mock()
+    schedd.query.return_value = [{"Owner": "alice", "JobStatus": 2, "RemoteHost": "slot1@wn01.example.com"}]
+    setup_condor = mocker.patch.object(condor_tools, "_setup_condor", return_value=(collector, schedd))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    condor_tools.main()
+    setup_condor.assert_called_once()
+    collector.query.assert_called_once()
+    assert format_table.call_args.args[0]["alice"]["GPU"] == {"Running": 1}
+    assert format_table.call_args.kwargs["capacity"].get("GPU", "Claimed", "GPUs") == 2  # noqa: PLR2004
+
+
+def test_main_usage_log_name(monkeypatch, mocker):
+    """The usage log gets the name of the user running it from one lookup, not by enumerating the directory"""
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon"])
+    log = mocker.patch.object(condor_tools, "log")
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+    mocker.patch.object(
+        condor_tools.pwd, "getpwnam", return_value=mocker.Mock(pw_name="testuser", pw_gid=100, pw_gecos="Test User")
+    )
+    mocker.patch.object(condor_tools.os, "getgrouplist", return_value=[])
+    getpwall = mocker.patch.object(condor_tools.pwd, "getpwall")
+    getgrall = mocker.patch.object(condor_tools.grp, "getgrall")
+
+    condor_tools.main()
+    assert log.call_args.args[1] == "Test User"
+    getpwall.assert_not_called()
+    getgrall.assert_not_called()
+
+
+def test_main_second_run_no_lookups(monkeypatch, mocker):
+    """Identities looked up by one run, including the user running it, are cached for the next"""
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon"])
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    entries = {
+        name: mocker.Mock(pw_name=name, pw_gid=100, pw_gecos=f"{name.title()} Smith") for name in ("alice", "testuser")
+    }
+    lookups = [
+        mocker.patch.object(condor_tools.pwd, "getpwnam", side_effect=entries.__getitem__),
+        mocker.patch.object(condor_tools.os, "getgrouplist", return_value=[100]),
+        mocker.patch.object(condor_tools.grp, "getgrgid", return_value=mocker.Mock(gr_name="cms0")),
+        mocker.patch.object(condor_tools.pwd, "getpwall", return_value=[]),
+        mocker.patch.object(condor_tools.grp, "getgrall", return_value=[]),
+        mocker.patch.object(condor_tools.subprocess, "run"),
+    ]
+
+    condor_tools.main()
+    assert lookups[0].call_count == 2  # noqa: PLR2004
+    for lookup in lookups:
+        lookup.reset_mock()
+    condor_tools.main()
+    for lookup in lookups:
+        lookup.assert_not_called()
+
+
+def test_main_totals_only(monkeypatch, mocker, caplog):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--totals-only", "--only", "gpu"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    log = mocker.patch.object(condor_tools, "log")
+    getpwnam = mocker.patch.object(
+        condor_tools.pwd, "getpwnam", return_value=mocker.Mock(pw_name="testuser", pw_gid=100, pw_gecos="Test User,,,")
+    )
+    mocker.patch.object(condor_tools.os, "getgrouplist", return_value=[])
+    getpwall = mocker.patch.object(condor_tools.pwd, "getpwall")
+    monkeypatch.setattr(condor_tools, "_setup_condor", lambda: ("collector", "schedd"))
+    monkeypatch.setattr(condor_tools, "load_classifier", lambda collector: None)
+    totals = {m: {"Running": 1, "Idle": 2, "Held": 3} for m in ("CPU", "GPU", "Total")}
+    fetch_totals = mocker.patch.object(condor_tools, "fetch_totals", return_value=totals)
+    gather = mocker.patch.object(condor_tools, "_gather")
+    priorities = mocker.patch.object(condor_tools, "get_user_priorities")
+
+    with caplog.at_level("INFO"):
+        condor_tools.main()
+    fetch_totals.assert_called_once_with("schedd", None)
+    gather.assert_not_called()
+    priorities.assert_not_called()
+    # Only the user running it is looked up, for the usage log, and not by enumerating the directory
+    getpwnam.assert_called_once_with("testuser")
+    getpwall.assert_not_called()
+    assert log.call_args.args[1] == "Test User"
+    assert "Total: 6" in caplog.text
+    assert "| GPU" in caplog.text
+    assert "| CPU" not in caplog.text
+
+
+def test_main_status_needs_user(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--status", "held"])
+    with pytest.raises(SystemExit):
+        condor_tools.main()
+
+
+def test_main_save_and_load_snapshot(monkeypatch, mocker, tmp_path):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 1)
+    counts.add_job("bob", "GPU", 2)
+    path = str(tmp_path / "stats.snap")
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools, "log", lambda *args: None)
+    resolve = mocker.patch.object(condor_tools.IdentityIndex, "resolve")
+    monkeypatch.setattr(condor_tools.IdentityIndex, "real_name", lambda self, user: user.title())
+    monkeypatch.setattr(condor_tools.IdentityIndex, "experiments", lambda self, user: ["cms"])
+    gather = mocker.patch.object(condor_tools, "_gather", return_value=(counts, {"alice": 2.0}))
+    format_table = mocker.patch.object(condor_tools, "format_table", return_value="formatted table")
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--save-snapshot", path])
+    condor_tools.main()
+    gather.assert_called_once()
+    assert gather.call_args.args[0].save_snapshot == path
+    # Everyone in the snapshot is resolved in one batch, not just the users the table showed
+    assert sorted(resolve.call_args.args[0]) == ["alice", "bob"]
+
+    monkeypatch.setattr(sys, "argv", ["script.py", "--priority", "--only", "gpu", "--from-snapshot", path])
+    condor_tools.main()
+    gather.assert_called_once()
+    user_stats, _, user_priorities = format_table.call_args.args
+    assert list(user_stats) == ["bob"]
+    assert user_priorities == {"alice": 2.0}
+    assert Snapshot.load(path).identities == {"alice": ("Alice", ["cms"]), "bob": ("Bob", ["cms"])}
+
+
+def test_main_save_snapshot_only(monkeypatch, tmp_path):
+    monkeypatch.setattr(sys, "argv", ["script.py", "--only", "gpu", "--save-snapshot", str(tmp_path / "stats.snap")])
+    with pytest.raises(SystemExit):
+        condor_tools.main()
+
+
+def test_main_bad_snapshot(monkeypatch, tmp_path):
+    path = tmp_path / "stats.snap"
+    path.write_bytes(b"garbage")
+    monkeypatch.setattr(sys, "argv", ["script.py", "--from-snapshot", str(path)])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    with pytest.raises(SystemExit):
+        condor_tools.main()
+
+
+def test_main_format(monkeypatch, mocker, capsys):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--format", "ndjson"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    format_table = mocker.patch.object(condor_tools, "format_table")
+
+    condor_tools.main()
+    assert json.loads(capsys.readouterr().out)["CPU"]["Running"] == 1
+    format_table.assert_not_called()
+
+
+def test_main_format_top(monkeypatch, mocker, capsys):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    for _ in range(2):
+        counts.add_job("bob", "GPU", 1)
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--format", "ndjson", "--top", "1"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+
+    condor_tools.main()
+    assert [json.loads(line)["user"] for line in capsys.readouterr().out.splitlines()] == ["bob"]
+
+
+def test_main_format_sort(monkeypatch, mocker, capsys):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    for _ in range(2):
+        counts.add_job("bob", "GPU", 1)
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--format", "csv", "--sort", "priority"])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {"alice": 1.5, "bob": 20.0}))
+
+    condor_tools.main()
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert [row[0] for row in rows[1:]] == ["alice", "bob"]
+    assert [row[3] for row in rows[1:]] == ["1.5", "20.0"]
+
+
+def test_main_timings_and_profile(monkeypatch, mocker, caplog, tmp_path):
+    counts = JobCounts()
+    counts.add_job("alice", "CPU", 2)
+    profile = tmp_path / "condor_stat.prof"
+    monkeypatch.setattr(sys, "argv", ["script.py", "--no-daemon", "--timings", "--profile", str(profile)])
+    monkeypatch.setattr(getpass, "getuser", lambda: "testuser")
+    monkeypatch.setattr(condor_tools.IdentityIndex, "resolve", lambda self, users, **kwargs: None)
+    mocker.patch.object(condor_tools, "_gather", return_value=(counts, {}))
+    caplog.set_level("INFO")
+
+    condor_tools.main()
+    report = caplog.records[-1].getMessage()
+    assert report.startswith("Timings:")
+    for name in ["main", "load_stats", "format_table", "format_table.rows", "render", "identities.save"]:
+        assert f"  {name} " in report
+    assert pstats.Stats(str(profile)).total_calls > 0
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+from ..condor_tools.stats import JobCounts
+from ..condor_tools.trends import DOWNSAMPLE_SECONDS, RAW_RETENTION, RETENTION, TrendStore, record_stats
+
+START = 1_700_000_000 // DOWNSAMPLE_SECONDS * DOWNSAMPLE_SECONDS
+
+
+def _counts(**jobs) -> JobCounts:
+    counts = JobCounts()
+    for user, (machine_type, status, n) in jobs.items():
+        for _ in range(n):
+            counts.add_job(user, machine_type, status)
+    return counts
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TrendStore(str(tmp_path / "trends.sqlite"))
+    yield store
+    store.close()
+
+
+class TestTrendStore:
+    def test_wal(self, store):
+        assert store._connect().execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+    def test_record_and_trend(self, store):
+        store.record(_counts(alice=("CPU", 5, 2), bob=("GPU", 1, 3)), now=START)
+        store.record(_counts(alice=("CPU", 5, 4)), now=START + 60)
+        trend = store.trend("alice", START, until=START + 119, points=2)
+        assert trend == [(START, {("CPU", "Held"): 2.0}), (START + 60, {("CPU", "Held"): 4.0})]
+        assert store.trend("bob", START, until=START + 119, points=2)[1] == (START + 60, {})
+        assert store.trend(None, START, until=START + 119, points=1) == [
+            (START, {("CPU", "Held"): 3.0, ("GPU", "Idle"): 1.5})
+        ]
+
+    def test_integer_encoded(self, store):
+        store.record(_counts(alice=("GPU", 2, 1)), now=START)
+        conn = store._connect()
+        assert conn.execute("SELECT * FROM users").fetchall() == [(1, "alice")]
+        assert conn.execute("SELECT * FROM counts").fetchall() == [(1, START, 1, 2, 1)]
+
+    def test_trend_uses_indexes(self, store):
+        store.record(_counts(alice=("CPU", 2, 1)), now=START)
+        conn = store._connect()
+        for query, args in [
+            ("SELECT * FROM counts WHERE user = ? AND time >= ?", (1, START)),
+            ("SELECT * FROM counts WHERE time >= ?", (START,)),
+        ]:
+            plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", args))
+            assert "SEARCH" in plan
+
+    def test_downsampling(self, store):
+        for minute in range(60):
+            store.record(_counts(alice=("CPU", 2, minute % 2 + 1)), now=START + minute * 60)
+        store.record(_counts(), now=START + DOWNSAMPLE_SECONDS + RAW_RETENTION)
+        conn = store._connect()
+        assert conn.execute("SELECT * FROM samples WHERE time < ?", (START + DOWNSAMPLE_SECONDS,)).fetchall() == [
+            (START, DOWNSAMPLE_SECONDS, 60)
+        ]
+        assert conn.execute("SELECT time, count FROM counts").fetchall() == [(START, 1.5)]
+        assert store.trend("alice", START, until=START + 60) == [(START, {("CPU", "Running"): 1.5})]
+
+    def test_mixed_resolutions(self, store):
+        """A bucket with an hourly sample and raw samples is weighted by how many raw samples each stands for"""
+        for minute in range(60):
+            store.record(_counts(alice=("CPU", 2, 1)), now=START + minute * 60)
+        store.record(_counts(alice=("CPU", 2, 4)), now=START + DOWNSAMPLE_SECONDS + RAW_RETENTION)
+        store.record(_counts(alice=("CPU", 2, 4)), now=START + DOWNSAMPLE_SECONDS + RAW_RETENTION + 60)
+        trend = store.trend("alice", START, until=START + DOWNSAMPLE_SECONDS + RAW_RETENTION + 60, points=1)
+        assert trend == [(START, {("CPU", "Running"): pytest.approx((60 * 1 + 2 * 4) / 62)})]
+        trend = store.trend(None, START, until=START + DOWNSAMPLE_SECONDS + RAW_RETENTION + 60, points=1)
+        assert trend == [(START, {("CPU", "Running"): pytest.approx((60 * 1 + 2 * 4) / 62)})]
+
+    def test_old_schema(self, tmp_path):
+        """Stores from before samples had n are migrated, with their hourly samples counting as one"""
+        path = str(tmp_path / "trends.sqlite")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE samples (time INTEGER PRIMARY KEY, resolution INTEGER NOT NULL)")
+        conn.execute("INSERT INTO samples VALUES (?, ?)", (START, DOWNSAMPLE_SECONDS))
+        conn.commit()
+        conn.close()
+        store = TrendStore(path)
+        store.record(_counts(alice=("CPU", 2, 1)), now=START + 60)
+        assert store._connect().execute("SELECT * FROM samples").fetchall() == [
+            (START, DOWNSAMPLE_SECONDS, 1),
+            (START + 60, 0, 1),
+        ]
+        store.close()
+
+    def test_retention(self, store):
+        store.record(_counts(alice=("CPU", 2, 1)), now=START)
+        store.record(_counts(bob=("CPU", 2, 1)), now=START + RETENTION + 1)
+        assert store._connect().execute("SELECT COUNT(*) FROM counts").fetchone() == (1,)
+        assert store._connect().execute("SELECT COUNT(*) FROM samples").fetchone() == (1,)
+
+    def test_user_ids_kept(self, tmp_path):
+        path = str(tmp_path / "trends.sqlite")
+        TrendStore(path).record(_counts(alice=("CPU", 2, 1)), now=START)
+        store = TrendStore(path)
+        store.record(_counts(bob=("CPU", 2, 1), alice=("CPU", 2, 1)), now=START + 60)
+        assert dict(store._connect().execute("SELECT name, id FROM users")) == {"alice": 1, "bob": 2}
+        store.close()
+
+
+def test_record_stats_failure(mocker, caplog):
+    mocker.patch.object(TrendStore, "record", side_effect=sqlite3.OperationalError("database is locked"))
+    record_stats(_counts(alice=("CPU", 2, 1)))
+    assert "Could not record" in caplog.text
@@ -0,0 +1,119 @@
+import fcntl
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from ..condor_tools.usage import append_lines, write_usage
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "usage_log.txt"), str(tmp_path / "spool" / "usage_spool.txt")
+
+
+def _write_many(path: str, spool_path: str, writer: int, n_lines: int):
+    for i in range(n_lines):
+        write_usage(f"writer {writer} line {i} " + "x" * 200, path, spool_path)
+
+
+class TestWriteUsage:
+    def test_appends(self, paths):
+        path, spool_path = paths
+        write_usage("first", path, spool_path)
+        write_usage("second", path, spool_path)
+        with open(path) as f:
+            assert f.read() == "first\nsecond\n"
+
+    def test_concurrent_writers(self, paths):
+        """Lines from processes writing at the same time are all there, and never interleaved"""
+        path, spool_path = paths
+        n_writers, n_lines = 4, 50
+        processes = [
+            multiprocessing.Process(target=_write_many, args=(path, spool_path, writer, n_lines))
+            for writer in range(n_writers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        with open(path) as f:
+            lines = f.read().splitlines()
+        assert sorted(lines) == sorted(
+            f"writer {writer} line {i} " + "x" * 200 for writer in range(n_writers) for i in range(n_lines)
+        )
+
+    def test_rotates(self, paths):
+        path, _ = paths
+        max_bytes = 20
+        append_lines(path, b"0123456789\n", max_bytes, timeout=1)
+        append_lines(path, b"abcdefghij\n", max_bytes, timeout=1)
+        with open(f"{path}.1") as f:
+            assert f.read() == "0123456789\n"
+        with open(path) as f:
+            assert f.read() == "abcdefghij\n"
+
+    def test_rotation_race(self, paths):
+        """A writer that was waiting on the lock while the log was rotated writes to the new log, and
+        doesn't rotate it over the old one"""
+        path, _ = paths
+        max_bytes = 20
+        with open(path, "w") as f:
+            f.write("0123456789\n")
+        ready = multiprocessing.Event()
+        release = multiprocessing.Event()
+        holder = multiprocessing.Process(target=_hold_lock, args=(path, ready, release))
+        holder.start()
+        ready.wait(5)
+        writer = multiprocessing.Process(target=append_lines, args=(path, b"abcdefghij\n", max_bytes, 5))
+        writer.start()
+        time.sleep(0.2)
+
+        # Rotate as the writer holding the lock would, while the other one is waiting for it
+        os.replace(path, f"{path}.1")
+        with open(path, "w") as f:
+            f.write("fresh\n")
+        release.set()
+        holder.join()
+        writer.join()
+
+        with open(f"{path}.1") as f:
+            assert f.read() == "0123456789\n"
+        with open(path) as f:
+            assert f.read() == "fresh\nabcdefghij\n"
+
+    def test_spools_when_locked(self, paths):
+        """A line that can't be written in time is spooled, then written along with the next one"""
+        path, spool_path = paths
+        with open(path, "w") as held:
+            # Locks are per process, so hold the lock from a child process
+            ready = multiprocessing.Event()
+            release = multiprocessing.Event()
+            holder = multiprocessing.Process(target=_hold_lock, args=(path, ready, release))
+            holder.start()
+            ready.wait(5)
+            write_usage("while locked", path, spool_path, timeout=0.05)
+            release.set()
+            holder.join()
+            assert os.path.getsize(held.name) == 0
+
+        with open(spool_path) as f:
+            assert f.read() == "while locked\n"
+        write_usage("after", path, spool_path)
+        with open(path) as f:
+            assert f.read() == "while locked\nafter\n"
+        assert not os.path.exists(spool_path)
+
+    def test_unwritable(self, paths):
+        _, spool_path = paths
+        write_usage("line", "/nonexistent/dir/usage_log.txt", spool_path)
+        with open(spool_path) as f:
+            assert f.read() == "line\n"
+
+
+def _hold_lock(path, ready, release):
+    with open(path, "a") as f:
+        fcntl.lockf(f.fileno(), fcntl.LOCK_EX)
+        ready.set()
+        release.wait(5)
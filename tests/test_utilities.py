@@ -1,16 +1,21 @@
+import grp
+import pwd
 import subprocess
+import time
 from collections import defaultdict
 from unittest.mock import MagicMock, patch
 
 import pytest
 
+from ..condor_tools.cache import DiskCache
 from ..condor_tools.condor_tools import (
+    IdentityIndex,
     TableContext,
     _build_machine_stats_string,
     _get_headers,
     _get_real_name,
     _get_row,
-    _highlight_row,
+    _local_schedd_name,
     _setup_condor,
 )
 
@@ -60,6 +65,16 @@ class TestCondorSetup:
             mock_schedd.assert_called_once()
 
 
+@pytest.mark.parametrize(
+    "schedd_name, expected",
+    [(None, "node1.example.com"), ("schedd_b", "schedd_b@node1.example.com"), ("a@b.example.com", "a@b.example.com")],
+)
+def test_local_schedd_name(mocker, schedd_name, expected):
+    config = {"FULL_HOSTNAME": "node1.example.com", "SCHEDD_NAME": schedd_name}
+    mocker.patch("htcondor2.param", new={key: value for key, value in config.items() if value})
+    assert _local_schedd_name() == expected
+
+
 class TestGetRealName:
     """Test cases for _get_real_name function."""
 
@@ -69,6 +84,148 @@ class TestGetRealName:
         assert result == expected
 
 
+@pytest.fixture
+def fake_nss(mocker):
+    """
+    Mock the passwd and group databases with a couple of indexed users.
+    """
+    users = [
+        pwd.struct_passwd(("alice", "x", 1001, 2001, "Alice Smith,Room 1,,", "/home/alice", "/bin/bash")),
+        pwd.struct_passwd(("bob", "x", 1002, 1002, "& Jones", "/home/bob", "/bin/bash")),
+        pwd.struct_passwd(("carol", "x", 1003, 1003, "", "/home/carol", "/bin/bash")),
+    ]
+    groups = [
+        grp.struct_group(("cms0", "x", 2001, [])),
+        grp.struct_group(("bob", "x", 1002, [])),
+        grp.struct_group(("carol", "x", 1003, [])),
+        grp.struct_group(("res0", "x", 3001, ["alice", "bob"])),
+        grp.struct_group(("lhcb0", "x", 3002, ["alice"])),
+        grp.struct_group(("htcuser", "x", 3003, ["bob", "carol"])),
+        grp.struct_group(("atlas0", "x", 3004, ["bob"])),
+    ]
+    users_by_name = {user.pw_name: user for user in users}
+    groups_by_gid = {group.gr_gid: group for group in groups}
+
+    def getgrouplist(username, gid):
+        return [gid] + [group.gr_gid for group in groups if username in group.gr_mem]
+
+    mocker.patch("pwd.getpwall", return_value=users)
+    mocker.patch("grp.getgrall", return_value=groups)
+    mocker.patch("pwd.getpwnam", side_effect=lambda username: users_by_name[username])
+    mocker.patch("os.getgrouplist", side_effect=getgrouplist)
+    mocker.patch("grp.getgrgid", side_effect=lambda gid: groups_by_gid[gid])
+
+
+class TestIdentityIndex:
+    @pytest.mark.parametrize(
+        "username, expected",
+        [("alice", "Alice Smith"), ("bob", "Bob Jones"), ("carol", "Unknown"), ("test_user0", "Unknown")],
+    )
+    def test_real_name(self, fake_nss, username, expected):
+        assert IdentityIndex().real_name(username) == expected
+
+    @pytest.mark.parametrize(
+        "username, expected",
+        [("alice", ["cms", "lhcb"]), ("bob", ["atlas"]), ("carol", ["???"]), ("test_user0", ["expA"])],
+    )
+    def test_experiments(self, fake_nss, username, expected):
+        assert IdentityIndex().experiments(username) == expected
+
+    def test_indexed_users_do_not_fork(self, fake_nss):
+        index = IdentityIndex()
+        for user in ["alice", "bob", "carol"]:
+            index.real_name(user)
+            index.experiments(user)
+        subprocess.run.assert_not_called()
+
+    def test_index_built_once(self, fake_nss):
+        index = IdentityIndex()
+        index.real_name("alice")
+        index.experiments("bob")
+        index.real_name("test_user1")
+        assert pwd.getpwall.call_count == 1
+        assert grp.getgrall.call_count == 1
+
+    def test_cached_identities_skip_lookups(self, fake_nss, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=path))
+        expected = {user: (index.real_name(user), index.experiments(user)) for user in ["alice", "test_user0"]}
+        index.save()
+        pwd.getpwall.reset_mock()
+        subprocess.run.reset_mock()
+
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=path))
+        assert {user: (index.real_name(user), index.experiments(user)) for user in expected} == expected
+        pwd.getpwall.assert_not_called()
+        subprocess.run.assert_not_called()
+
+    def test_prefetch(self, fake_nss, tmp_path):
+        path = str(tmp_path / "cache.sqlite")
+        DiskCache("identities", ttl=60, path=path).update({"alice": ("Alice Smith", ["cms"])})
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=path))
+        index.prefetch()
+        pwd.getpwall.assert_not_called()
+        grp.getgrall.assert_not_called()
+        assert index._cached == {"alice": ["Alice Smith", ["cms"]]}
+
+    def test_resolve_does_not_enumerate(self, fake_nss):
+        index = IdentityIndex()
+        index.resolve(["alice", "bob"])
+        assert (index.real_name("alice"), index.experiments("alice")) == ("Alice Smith", ["cms", "lhcb"])
+        assert (index.real_name("bob"), index.experiments("bob")) == ("Bob Jones", ["atlas"])
+        pwd.getpwall.assert_not_called()
+        grp.getgrall.assert_not_called()
+        assert sorted(call.args[0] for call in pwd.getpwnam.call_args_list) == ["alice", "bob"]
+        subprocess.run.assert_not_called()
+
+    def test_resolve_matches_sequential(self, fake_nss):
+        users = ["alice", "bob", "carol", "test_user0", "test_user1"]
+        sequential = IdentityIndex()
+        expected = [(sequential.real_name(user), sequential.experiments(user)) for user in users]
+
+        index = IdentityIndex()
+        index.resolve(users, max_workers=2)
+        subprocess.run.reset_mock()
+        assert [(index.real_name(user), index.experiments(user)) for user in users] == expected
+        subprocess.run.assert_not_called()
+
+    def test_resolve_timeout(self, fake_nss, mocker, tmp_path):
+        def slow_resolve(username, timeout=None):
+            if username == "test_user1":
+                time.sleep(1)
+            return "Real Name", ["exp"]
+
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=str(tmp_path / "cache.sqlite")))
+        mocker.patch.object(index, "_resolve_one", side_effect=slow_resolve)
+        start = time.monotonic()
+        index.resolve(["test_user0", "test_user1"], timeout=0.1)
+        assert time.monotonic() - start < 1
+        assert (index.real_name("test_user0"), index.experiments("test_user0")) == ("Real Name", ["exp"])
+        assert (index.real_name("test_user1"), index.experiments("test_user1")) == ("Unknown", ["???"])
+
+        # Timed out lookups aren't cached, so they're retried next time
+        index.save()
+        assert set(index.cache.load()) == {"test_user0"}
+
+    def test_real_name_only_cached(self, fake_nss, tmp_path):
+        """Users only asked for their real name are saved too, with their experiments"""
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=str(tmp_path / "cache.sqlite")))
+        index.real_name("alice")
+        index.save()
+        assert index.cache.load() == {"alice": ["Alice Smith", ["cms", "lhcb"]]}
+
+    def test_external_identities_not_cached(self, fake_nss, tmp_path):
+        index = IdentityIndex(cache=DiskCache("identities", ttl=60, path=str(tmp_path / "cache.sqlite")))
+        index.update({"alice": ("Someone Else", ["other"])})
+        index.experiments("bob")
+        assert index.real_name("alice") == "Someone Else"
+        index.save()
+        assert set(index.cache.load()) == {"bob"}
+
+    def test_excluded_groups(self, fake_nss):
+        assert IdentityIndex(excluded_groups=["cms0"]).experiments("alice") == ["res", "lhcb"]
+
+
 class TestHeaders:
     @pytest.mark.parametrize("priority", [True, False])
     @pytest.mark.parametrize("only", ["cpu", "gpu", None])
@@ -102,6 +259,14 @@ class TestMachineStats:
         assert "Total: 6" in result
         assert machine_stats[machine_type] == stats
 
+    def test_build_machine_stats_string_deltas(self):
+        with patch.dict(_build_machine_stats_string.__globals__, {"colored": lambda t, *_: t}):
+            stats = {"Running": 3, "Idle": 2, "Held": 0}
+            previous = {"Running": 1, "Idle": 2, "Held": 1}
+            machine_stats = defaultdict(lambda: defaultdict(int))
+            result = _build_machine_stats_string("CPU", stats, machine_stats, previous)
+        assert result == "Running: 3 (+2)\nIdle: 2\nHeld: 0 (-1)\nTotal: 5 (+1)"
+
 
 class TestGetRow:
     @pytest.mark.parametrize("priority", [True, False])
@@ -139,22 +304,3 @@ class TestGetRow:
         else:
             assert row[2] == _build_machine_stats_string("cpu", jobs["cpu"], machine_stats)
             assert row[3] == _build_machine_stats_string("gpu", jobs["gpu"], machine_stats)
-
-
-class TestHighlightRow:
-    @pytest.mark.parametrize("current_user", ["test_user0", "test_user1"])
-    def test_highlight_row(self, current_user):
-        with patch.dict(_highlight_row.__globals__, {"colored": lambda t, *_: "COLOURED" + t}):
-            user = "test_user0"
-            test_context.current_user = current_user
-            row = _get_row(
-                user=user,
-                jobs={"cpu": {"Running": 1, "Idle": 2, "Held": 3}, "gpu": {"Running": 0, "Idle": 1, "Held": 0}},
-                ctx=test_context,
-            )[0]
-            h_row = _highlight_row(user, test_context.current_user, row)
-
-            if user != current_user:
-                assert h_row == row
-            else:
-                assert h_row[0] == "COLOURED" + user
@@ -0,0 +1,126 @@
+import argparse
+import io
+import os
+
+import pytest
+
+from ..condor_tools import condor_tools
+from ..condor_tools.stats import JobCounts
+from ..condor_tools.watch import Screen, watch
+
+
+class FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+class TestScreen:
+    def test_not_a_terminal(self):
+        stream = io.StringIO()
+        screen = Screen(stream)
+        screen.draw("a\nb")
+        screen.draw("a\nc")
+        assert stream.getvalue() == "a\nb\na\nc\n"
+
+    def test_only_changed_lines_redrawn(self):
+        stream = FakeTerminal()
+        screen = Screen(stream)
+        screen.draw("header 1\nsame\nold")
+        assert stream.getvalue() == "\x1b[2J\x1b[Hheader 1\nsame\nold\n"
+
+        stream.seek(0)
+        stream.truncate()
+        screen.draw("header 2\nsame\nnew\nextra")
+        assert stream.getvalue() == "\x1b[1;1Hheader 2\x1b[K\x1b[3;1Hnew\x1b[K\x1b[4;1Hextra\x1b[K\x1b[5;1H"
+
+    def test_clipped_to_terminal(self, mocker):
+        mocker.patch("shutil.get_terminal_size", return_value=os.terminal_size((80, 3)))
+        stream = FakeTerminal()
+        screen = Screen(stream)
+        screen.draw("a\nb\nc\nd")
+        assert stream.getvalue() == "\x1b[2J\x1b[Ha\nb\n"
+
+        stream.seek(0)
+        stream.truncate()
+        screen.draw("a\nB\nc\nD")
+        assert stream.getvalue() == "\x1b[2;1HB\x1b[K\x1b[3;1H"
+
+    def test_resize_redraws(self, mocker):
+        size = mocker.patch("shutil.get_terminal_size", return_value=os.terminal_size((80, 3)))
+        stream = FakeTerminal()
+        screen = Screen(stream)
+        screen.draw("a\nb\nc")
+        size.return_value = os.terminal_size((80, 24))
+        stream.seek(0)
+        stream.truncate()
+        screen.draw("a\nb\nc")
+        assert stream.getvalue() == "\x1b[2J\x1b[Ha\nb\nc\n"
+
+    def test_shorter_frame_clears_rest(self):
+        stream = FakeTerminal()
+        screen = Screen(stream)
+        screen.draw("a\nb\nc")
+        stream.seek(0)
+        stream.truncate()
+        screen.draw("a")
+        assert stream.getvalue() == "\x1b[2;1H\x1b[J\x1b[2;1H"
+
+
+def _counts(*jobs):
+    counts = JobCounts()
+    for owner, machine_type, status in jobs:
+        counts.add_job(owner, machine_type, status)
+    return counts
+
+
+class TestWatch:
+    @pytest.fixture
+    def identities(self, mocker):
+        identities = mocker.Mock(spec=condor_tools.IdentityIndex)
+        identities.real_name.return_value = "Real Name"
+        identities.experiments.return_value = ["exp"]
+        return identities
+
+    def test_watch(self, mocker, monkeypatch, identities):
+        setup_condor = mocker.patch.object(condor_tools, "_setup_condor", return_value=("collector", "schedd"))
+        log = mocker.patch.object(condor_tools, "log")
+        load_classifier = mocker.patch.object(condor_tools, "load_classifier", return_value="classifier")
+        fetch = mocker.patch.object(
+            condor_tools,
+            "_fetch_user_stats",
+            side_effect=[
+                _counts(("alice", "CPU", 2), ("bob", "GPU", 1)),
+                _counts(("alice", "CPU", 2), ("alice", "CPU", 2), ("bob", "GPU", 1)),
+                JobCounts(),
+            ],
+        )
+        sleep = mocker.patch("time.sleep")
+        args = argparse.Namespace(watch=10.0, only=None, priority=False, pool=False, sort="jobs", top=None)
+        stream = io.StringIO()
+
+        refreshes = 3
+        watch(args, identities, current_user="alice", stream=stream, refreshes=refreshes)
+
+        setup_condor.assert_called_once()
+        log.assert_called_once_with(args, "Real Name")
+        assert fetch.call_count == refreshes
+        assert all(call.args[1:] == ("collector", "schedd", "classifier") for call in fetch.call_args_list)
+        load_classifier.assert_called_once()
+        assert sleep.call_count == refreshes - 1
+        identities.save.assert_called_once()
+
+        first, second, third = stream.getvalue().split("Every 10s")[1:]
+        assert "(+" not in first
+        assert "Running: 2" in second
+        assert "(+1)" in second
+        assert "No jobs found" in third
+
+    def test_watch_interrupted(self, mocker, identities):
+        mocker.patch.object(condor_tools, "_setup_condor", return_value=("collector", "schedd"))
+        mocker.patch.object(condor_tools, "log")
+        mocker.patch.object(condor_tools, "load_classifier")
+        mocker.patch.object(condor_tools, "_fetch_user_stats", side_effect=KeyboardInterrupt)
+        args = argparse.Namespace(watch=10.0, only=None, priority=False, pool=False, sort="jobs", top=None)
+
+        watch(args, identities, current_user="alice", stream=io.StringIO())
+        identities.save.assert_called_once()
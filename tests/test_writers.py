@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+
+import pytest
+
+from ..condor_tools.condor_tools import STATUSES_TO_PRINT
+from ..condor_tools.writers import write_stats
+from .test_htcondor import EXPECTED_RESULT
+
+
+class FakeIdentities:
+    def __init__(self):
+        self.resolved = None
+
+    def resolve(self, usernames):
+        self.resolved = list(usernames)
+
+    def real_name(self, user):
+        return f"Name of {user}"
+
+    def experiments(self, user):
+        return ["cms", "lhcb"]
+
+
+def _write(output_format, **kwargs) -> str:
+    stream = io.StringIO()
+    write_stats(output_format, EXPECTED_RESULT, stream, STATUSES_TO_PRINT, **kwargs)
+    return stream.getvalue()
+
+
+class TestWriteStats:
+    def test_json(self):
+        decoded = json.loads(_write("json", identities=FakeIdentities()))
+        user0, user1 = decoded["users"]
+        assert user0["user"] == "test_user0"
+        assert user0["name"] == "Name of test_user0"
+        assert user0["experiments"] == ["cms", "lhcb"]
+        assert user0["CPU"] == {"Running": 1, "Idle": 1, "Held": 1, "Total": 3}
+        assert user0["GPU"] == {"Running": 0, "Idle": 0, "Held": 1, "Total": 1}
+        assert user0["Total"] == {"Running": 1, "Idle": 1, "Held": 2, "Total": 4}
+        assert user1["GPU"] == {"Running": 1, "Idle": 1, "Held": 0, "Total": 2}
+        assert decoded["totals"]["Total"] == {"Running": 2, "Idle": 2, "Held": 2, "Total": 6}
+
+    def test_json_no_users(self):
+        stream = io.StringIO()
+        write_stats("json", {}, stream, STATUSES_TO_PRINT)
+        assert json.loads(stream.getvalue())["users"] == []
+
+    def test_ndjson_only_priority(self):
+        lines = _write("ndjson", only="gpu", user_priorities={"test_user1": 2.5}, priority=True).splitlines()
+        records = [json.loads(line) for line in lines]
+        assert [record["priority"] for record in records] == [-1, 2.5]
+        assert all(set(record) == {"user", "priority", "GPU"} for record in records)
+
+    def test_csv(self):
+        identities = FakeIdentities()
+        rows = list(csv.reader(io.StringIO(_write("csv", only="cpu", identities=identities))))
+        assert rows[0] == ["user", "name", "experiments", "CPU_Running", "CPU_Idle", "CPU_Held", "CPU_Total"]
+        assert rows[1] == ["test_user0", "Name of test_user0", "cms;lhcb", "1", "1", "1", "3"]
+        assert rows[2] == ["test_user1", "Name of test_user1", "cms;lhcb", "0", "0", "0", "0"]
+        assert identities.resolved == ["test_user0", "test_user1"]
+
+    def test_prometheus(self):
+        identities = FakeIdentities()
+        lines = _write("prometheus", user_priorities={"test_user0": 1.5}, priority=True, identities=identities)
+        lines = lines.splitlines()
+        assert 'condor_jobs{user="test_user0",machine_type="GPU",status="Held"} 1' in lines
+        assert 'condor_jobs{user="test_user1",machine_type="GPU",status="Running"} 1' in lines
+        assert 'condor_user_priority{user="test_user0"} 1.5' in lines
+        assert not any('machine_type="Total"' in line for line in lines)
+        assert lines.index("# TYPE condor_user_priority gauge") > max(
+            i for i, line in enumerate(lines) if line.startswith("condor_jobs")
+        )
+        assert identities.resolved is None
+
+    def test_users(self):
+        identities = FakeIdentities()
+        decoded = json.loads(_write("json", identities=identities, users=["test_user1"]))
+        assert [record["user"] for record in decoded["users"]] == ["test_user1"]
+        assert identities.resolved == ["test_user1"]
+        assert decoded["totals"]["Total"]["Total"] == 6  # noqa: PLR2004
+        lines = _write("prometheus", users=["test_user1"]).splitlines()
+        assert not any('user="test_user0"' in line for line in lines)
+
+    def test_no_colour(self):
+        for output_format in ["json", "ndjson", "csv", "prometheus"]:
+            assert "\x1b[" not in _write(output_format, identities=FakeIdentities())
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            _write("xml")